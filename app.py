@@ -1,17 +1,34 @@
+import time
+
+# Taken before anything else is imported, for --startup-profile
+_started = time.perf_counter()
+
 import os
 import sys
 import json
 import shutil
-import requests
+import threading
 import subprocess
 from pathlib import Path
+from functools import partial
+from concurrent.futures import Future
+from typing import Callable, Optional, TYPE_CHECKING
 from shutil import get_terminal_size
 
-from whiptail import Whiptail
-import questionary as q
-from halo import Halo
+from ui import UI, create_ui
+from catalog import CatalogIndex
+from startup import StartupProfile
 
-from breadbox import Breadbox, APIKeyError
+# Network modules pull in requests, urllib3 and keyring, so they're imported where they're first used.
+# That way the first screen doesn't wait for them.
+if TYPE_CHECKING:
+    from breadbox import Breadbox
+    from jikan import Jikan
+    from downloads import DownloadManager
+    from prefetch import Prefetcher, WatchHistory
+    from library import MediaLibrary
+    from thumbnails import ThumbnailPipeline
+    from nyaa import NyaaClient
 
 
 # Some metadata about the app
@@ -31,6 +48,13 @@ else:
 
 config_file = config_root / 'config.json'
 theme_folder = config_root / 'themes'
+cache_folder = config_root / 'cache'
+jikan_folder = config_root / 'jikan'
+downloads_file = config_root / 'downloads.json'
+history_file = config_root / 'history.json'
+user_file = config_root / 'user.json'
+library_file = config_root / 'library.json'
+thumbnails_file = config_root / 'thumbnails.json'
 
 # Helper exception
 class AppExit(Exception):
@@ -58,9 +82,6 @@ Languages = [
     'polish',
 ]
 
-# A handy dandy eraser
-Eraser = '\x1b[1A\x1b[2K'
-
 # Spawn a new detached instance of VLC
 def vlc(media: str | list[str] | tuple[str], exit_after: bool = False):
     if sys.platform == 'win32':  # Experimental windows support
@@ -82,10 +103,30 @@ def vlc(media: str | list[str] | tuple[str], exit_after: bool = False):
         stderr=subprocess.DEVNULL
     )
 
+# Run a function on a daemon thread, so an unfinished one never holds up exiting
+def background(function: Callable, name: str) -> Future:
+    future = Future()
+
+    def work():
+        try:
+            future.set_result(function())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=work, name=name, daemon=True).start()
+
+    return future
+
 # Main application class
 # noinspection PyAttributeOutsideInit
 class App:
-    def __init__(self):
+    def __init__(self, ui: UI = None, profile: StartupProfile = None):
+        """
+        :param ui: The UI backend to use; by default it's chosen by the "ui" setting when the app runs
+        :param profile: Records how long starting up takes
+        """
+        self.profile = profile or StartupProfile(enabled=False)
+
         self.title = __title__
         self.version = __version__
         self.credit = __credit__
@@ -97,28 +138,60 @@ class App:
             "downloads_folder": "~/Downloads",
             "vlc_auto_exit": True,
             "enable_theme": True,
-            "theme": "default"
+            "theme": "default",
+            "ui": "auto",
+            "connection_pool_size": 10,
+            "keep_alive": True,
+            "enable_cache": True,
+            "download_workers": 4,
+            "download_segment_size_mb": 32,
+            "download_chunk_size_kb": 1024,
+            "max_downloads": 2,
+            "max_connections_per_server": 8,
+            "prefetch_workers": 2,
+            "prefetch_bandwidth_kb": 512,
+            "signed_url_ttl": 300,
+            "connect_timeout": 5,
+            "read_timeout": 30,
+            "request_retries": 3,
+            "thumbnail_workers": 8,
+            "thumbnail_max_size": 0,
+            "thumbnail_quality": 0
         }
 
         self.config = self.default_config
 
         # Load configs if they exist; otherwise save defaults
-        if config_file.is_file():
-            self.load_config()
-        else:
-            self.save_config()
+        with self.profile.step("load config"):
+            if config_file.is_file():
+                self.load_config()
+            else:
+                self.save_config()
 
         # Set window background info
         self.backtitle = f" {self.title} v{self.version}"
 
-        # Create spinner object
-        self.spinner = Halo(spinner='line', placement='right', color="yellow")
+        # The UI is only set up once the app runs, so the command line interface never touches the terminal
+        self.ui = ui
 
         # Define other variables
         self.breadbox: Breadbox
-        self.user_info: dict
+        self.downloads: DownloadManager
+        self.prefetch: Prefetcher
+        self.history: WatchHistory
+        self.screens: dict[str, tuple] = {}
+        self.offline = False
+        self.spinner: object
+        self.user_info: Optional[dict] = None
         self.theme: dict
 
+        # Set by run() while the connection is being set up in the background
+        self.connecting: Optional[Future] = None
+
+        self._jikan: Optional[Jikan] = None
+        self._library: Optional[MediaLibrary] = None
+        self._nyaa: Optional[NyaaClient] = None
+
     def load_config(self):
         with open(config_file, 'r') as f:
             self.config = self.default_config | json.load(f)
@@ -132,7 +205,7 @@ class App:
             json.dump(self.config, f, indent=2)
 
     def load_theme(self):
-        """Load a custom whiptail theme"""
+        """Load a custom theme"""
         # Create theme folder if it doesn't exist
         if not theme_folder.is_dir():
             shutil.copytree(Path(__file__).absolute().parent / 'themes', theme_folder)
@@ -141,50 +214,82 @@ class App:
         with open(theme_file, 'r') as f:
             self.theme = json.load(f)
 
-        t = self.theme
-
-        root = f"{t['root_fg']},{t['root_bg']}"
-        window = f"{t['window_fg']},{t['window_bg']}"
-        element = f"{t['element_fg']},{t['element_bg']}"
-        select = f"{t['select_fg']},{t['select_bg']}"
-        focus = f"{t['focus_fg']},{t['focus_bg']}"
-
-        # noinspection SpellCheckingInspection
-        os.environ['NEWT_COLORS'] = f"""
-            root={root}
-            border={t['border']},{t['window_bg']}
-            window={window}
-            shadow={t['shadow']},{t['shadow']}
-            title={t['window_title']},{t['window_bg']}
-            button={focus}
-            actbutton={focus}
-            checkbox={element}
-            actcheckbox={focus}
-            entry={focus}
-            label={window}
-            listbox={element}
-            actlistbox={select}
-            textbox={window}
-            acttextbox={focus}
-            helpline={window}
-            roottext={root}
-            emptyscale={element}
-            fullscale={focus}
-            disentry={element}
-            compactbutton={window}
-            actsellistbox={focus}
-            sellistbox={element}
-        """
+        self.ui.apply_theme(self.theme)
+
+    @property
+    def jikan(self) -> 'Jikan':
+        """The Jikan client, set up the first time it's needed"""
+        if self._jikan is None:
+            from jikan import Jikan
+
+            self._jikan = Jikan(jikan_folder if self.config['enable_cache'] else None, timeout=self.timeout)
+
+        return self._jikan
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        """How long outbound requests wait to connect, and then between bytes, so a hung server can't freeze the UI"""
+        return self.config['connect_timeout'], self.config['read_timeout']
+
+    @property
+    def library(self) -> 'MediaLibrary':
+        """The index of downloaded files, following the downloads folder setting"""
+        folder = Path(self.config['downloads_folder']).expanduser().absolute()
+
+        if self._library is None or self._library.folder != folder:
+            from library import MediaLibrary
+
+            self._library = MediaLibrary(folder, library_file)
+
+        return self._library
+
+    @property
+    def nyaa(self) -> 'NyaaClient':
+        """The Nyaa.si client, set up the first time it's needed"""
+        if self._nyaa is None:
+            from nyaa import NyaaClient
+
+            self._nyaa = NyaaClient(timeout=self.timeout)
+
+        return self._nyaa
 
     def run(self):
-        # Set Whiptail theme
+        # Set up the UI
+        if self.ui is None:
+            with self.profile.step(f"set up the {self.config['ui']} UI"):
+                self.ui = create_ui(self.config['ui'])
+
+        self.spinner = self.ui.spinner()
+
+        # Set the UI theme
         if self.config['enable_theme']:
-            self.load_theme()
+            with self.profile.step("load theme"):
+                self.load_theme()
 
         # Make sure all the important configurations exist
         if not self.config.get('server'):
             self.ask_for_server_url()
 
+        # Show who was logged in last time until the server says otherwise
+        self.user_info = self.load_user_info()
+        self.update_backtitle()
+
+        # Connect while the main menu is on screen; the first screen that needs the server waits for it
+        self.connecting = background(self.start, 'startup')
+
+        # Load the main menu
+        self.profile.mark("first screen")
+        self.navigate(self.main_menu)
+
+    def start(self) -> tuple['Breadbox', Optional[dict]]:
+        """
+        Set up the Breadbox wrapper and fetch user info
+        :return: The wrapper, and the user info or None if the server can't be reached
+        """
+        with self.profile.step("import network modules"):
+            import requests
+            from breadbox import Breadbox
+
         # Set breadbox server
         Breadbox.SERVER = self.config.get('server')
 
@@ -192,31 +297,283 @@ class App:
         #Breadbox.SERVICE_NAME = __slug__
 
         # Set up breadbox wrapper
+        with self.profile.step("read API key"):
+            breadbox = self.connect()
+
+        # Only new or changed files are hashed, so this is quick after the first run
+        with self.profile.step("scan library"):
+            self.library.scan()
+
+        with self.profile.step("fetch user info"):
+            user_info = self.fetch_user_info(breadbox)
+
+        return breadbox, user_info
+
+    def ready(self):
+        """
+        Wait for the connection run() started, then set up everything that needs it.
+        Only the first call does anything.
+        """
+        if self.connecting is None:
+            return
+
+        from breadbox import APIKeyError, ServerNameError
+        from prefetch import Prefetcher, WatchHistory
+
+        connecting = self.connecting
+
+        # Nothing below works without the wrapper, so keep at it until there is one or the user gives up
+        while True:
+            self.spinner.start("Connecting...")
+
+            try:
+                self.breadbox, user_info = connecting.result()
+                break
+            except APIKeyError:
+                self.spinner.stop()
+                self.ask_for_api_key()
+            except ServerNameError:
+                self.spinner.stop()
+                self.ask_for_server_url()
+            except OSError as e:
+                # Includes connection errors, and the library scan failing to read the downloads folder
+                self.spinner.stop()
+
+                if not self.ui.yesno("Breadbox", f"Breadbox couldn't start.\n\n{e}\n\nTry again?"):
+                    raise AppExit
+            finally:
+                self.spinner.stop()
+
+            connecting = background(self.start, 'startup')
+
+        self.connecting = None
+
+        self.downloads = self.download_manager()
+        self.history = WatchHistory(history_file)
+
+        # Warm metadata and signed URLs in the background
+        self.prefetch = Prefetcher(
+            self.breadbox,
+            self.episode_titles,
+            workers=self.config['prefetch_workers'],
+            bandwidth=self.config['prefetch_bandwidth_kb'] * 1024 or None,
+            url_ttl=self.config['signed_url_ttl']
+        )
+
+        # Carry on offline if the server can't be reached
+        self.set_online(user_info)
+
+    def go_online(self) -> bool:
+        """
+        Try to reach the server again
+        :return: Whether the app is online
+        """
+        import requests
+        from breadbox import APIKeyError
+
+        self.spinner.start("Connecting...")
+
         try:
-            self.breadbox = Breadbox()
+            user_info = self.fetch_user_info(self.breadbox)
         except APIKeyError:
+            self.spinner.stop()
+
+            # The wrapper was set up with the old key, so the new one is used from the next start
             self.ask_for_api_key()
-            self.breadbox = Breadbox()
+            self.ui.msgbox("Breadbox", "Your API key has been saved. Restart Breadbox to use it.")
 
-        # Get user info
-        self.user_info = self.breadbox.user_info()
+            raise AppExit
+        except requests.RequestException:
+            # The server answered, but with an error; it's still no use
+            user_info = None
+        finally:
+            self.spinner.stop()
 
-        self.spinner.stop()
+        return self.set_online(user_info)
 
-        # Update backtitle to show user info
-        self.backtitle = f" {self.title} v{self.version} | User: {self.user_info['username']}"
+    def fetch_user_info(self, breadbox: 'Breadbox') -> Optional[dict]:
+        """
+        Ask the server who the API key belongs to
+        :return: The user info, or None if the server can't be reached
+        :raises APIKeyError: If the server doesn't know the key
+        """
+        import requests
+        from breadbox import APIKeyError
 
-        # Load the main menu
-        self.main_menu()
+        try:
+            user_info = breadbox.user_info(timeout=self.config['connect_timeout'])
+        except (requests.ConnectionError, requests.Timeout):
+            # Only a server that can't be reached means offline
+            return None
+
+        if not user_info:
+            raise APIKeyError("The server doesn't recognise your API key")
+
+        return user_info
+
+    def set_online(self, user_info: Optional[dict]) -> bool:
+        """
+        Switch between online and offline mode
+        :param user_info: The user info from the server, or None if it couldn't be reached
+        :return: Whether the app is online
+        """
+        self.offline = user_info is None
+        self.breadbox.offline = self.offline
+        self.jikan.offline = self.offline
+
+        if not self.offline:
+            self.user_info = user_info
+            self.save_user_info()
+
+            # Continue any unfinished downloads in the background
+            self.downloads.resume()
+
+        self.update_backtitle()
+
+        return not self.offline
+
+    def update_backtitle(self):
+        """Show the user info and connection state behind every dialog"""
+        self.backtitle = f" {self.title} v{self.version}"
+
+        if self.user_info:
+            self.backtitle += f" | User: {self.user_info['username']}"
+
+        if self.offline:
+            self.backtitle += " | Offline"
+
+        self.ui.backtitle = self.backtitle
+
+    def load_user_info(self) -> Optional[dict]:
+        """The user info saved last time, if it's for the same server"""
+        try:
+            with open(user_file, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return saved['user_info'] if saved.get('server') == self.config['server'] else None
+
+    def save_user_info(self):
+        with open(user_file, 'w') as f:
+            json.dump({'server': self.config['server'], 'user_info': self.user_info}, f)
+
+    def navigate(self, screen: Optional[Callable]):
+        """
+        Show screens until one of them raises AppExit.
+
+        Every menu returns the next screen to show instead of calling it,
+        so the call stack stays the same size however long the session runs.
+        """
+        while screen:
+            screen = screen()
+
+    def screen_data(self, kind: str, key, loader: Callable):
+        """
+        The one place data shared between screens lives.
+        Only the latest entry of each kind is kept, so memory stays constant while browsing.
+        :param kind: What kind of data it is, e.g. 'overview'
+        :param key: What the data is for, e.g. an anime ID
+        :param loader: Fetches the data if it isn't already loaded
+        """
+        if (entry := self.screens.get(kind)) and entry[0] == key:
+            return entry[1]
+
+        data = loader()
+        self.screens[kind] = (key, data)
+
+        return data
+
+    def anime_overview(self, anime_id) -> dict:
+        """Everything the episode and watch menus need to know about an anime"""
+        return self.screen_data(
+            'overview', anime_id,
+            lambda: self.breadbox.anime.overview(anime_id, self.episode_titles)
+        )
+
+    def connect(self, api_key: str = None) -> 'Breadbox':
+        """Create a Breadbox wrapper using the connection settings from the config"""
+        from breadbox import Breadbox
+
+        return Breadbox(
+            api_key_override=api_key,
+            pool_size=self.config['connection_pool_size'],
+            keep_alive=self.config['keep_alive'],
+            cache_folder=cache_folder if self.config['enable_cache'] else None,
+            timeout=self.timeout,
+            retries=self.config['request_retries']
+        )
+
+    def episode_titles(self, info: dict) -> dict[int, str]:
+        """Look up the episode titles of an anime"""
+        return self.jikan.episodes(info['external']['jikan'])
+
+    def downloader_options(self) -> dict:
+        """Download engine settings from the config"""
+        from downloader import MiB
+
+        return {
+            'segment_size': self.config['download_segment_size_mb'] * MiB,
+            'workers': self.config['download_workers'],
+            'chunk_size': self.config['download_chunk_size_kb'] * 1024
+        }
+
+    def download_manager(self) -> 'DownloadManager':
+        """Create a download queue using the download settings from the config"""
+        from downloads import DownloadManager
+
+        return DownloadManager(
+            self.breadbox,
+            downloads_file,
+            self.config['downloads_folder'],
+            max_downloads=self.config['max_downloads'],
+            max_connections_per_server=self.config['max_connections_per_server'],
+            library=self.library,
+            **self.downloader_options()
+        )
+
+    def thumbnail_pipeline(self) -> 'ThumbnailPipeline':
+        """Create a thumbnail pipeline using the thumbnail settings from the config"""
+        from thumbnails import ThumbnailPipeline
+
+        return ThumbnailPipeline(
+            self.breadbox,
+            self.jikan,
+            thumbnails_file,
+            workers=self.config['thumbnail_workers'],
+            max_size=self.config['thumbnail_max_size'] or None,
+            quality=self.config['thumbnail_quality'] or None,
+            timeout=self.timeout
+        )
+
+    def close(self):
+        """Stop background work and release any open connections"""
+        if prefetch := getattr(self, 'prefetch', None):
+            prefetch.close()
+
+        if downloads := getattr(self, 'downloads', None):
+            downloads.close()
+
+        if breadbox := getattr(self, 'breadbox', None):
+            breadbox.close()
+
+        if self._jikan:
+            self._jikan.close()
+
+        if self._nyaa:
+            self._nyaa.close()
+
+        if self.ui:
+            self.ui.close()
+
+        self.profile.report()
 
     def ask_for_server_url(self):
-        inp = Whiptail(
-            title="Breadbox",
-            backtitle=self.backtitle
-        ).inputbox(
+        inp = self.ui.inputbox(
+            "Breadbox",
             msg="The Breadbox server URL has not been set. Input it here and it will be saved automatically.\nUse Ctrl+Shift+V to paste.",
             default="https://api.example.com"
-        )[0]
+        )
 
         if not inp:
             raise AppExit()
@@ -225,108 +582,179 @@ class App:
         self.save_config()
 
     def ask_for_api_key(self):
-        inp = Whiptail(
-            title="Breadbox",
-            backtitle=self.backtitle
-        ).inputbox(
-            msg="Your API key has not been set or is invalid. Input it here and it will be saved automatically.\nUse Ctrl+Shift+V to paste.",
-            password=True
-        )[0]
+        import requests
+        from breadbox import Breadbox
 
-        if not inp:
-            raise AppExit
+        while True:
+            inp = self.ui.inputbox(
+                "Breadbox",
+                msg="Your API key has not been set or is invalid. Input it here and it will be saved automatically.\nUse Ctrl+Shift+V to paste.",
+                password=True
+            )
 
-        if not Breadbox.check_key(inp):
-            self.ask_for_api_key()
-        else:
-            Breadbox.login(inp)
+            if not inp:
+                raise AppExit
+
+            self.spinner.start("Checking your API key...")
+
+            try:
+                valid = Breadbox.check_key(inp, timeout=self.timeout)
+            except requests.RequestException as e:
+                # The server is down or answered with an error, which says nothing about the key
+                self.spinner.stop()
+
+                if not self.ui.yesno("Breadbox", f"Your API key couldn't be checked.\n\n{e}\n\nTry again?"):
+                    raise AppExit
+
+                continue
+            finally:
+                self.spinner.stop()
+
+            if valid:
+                Breadbox.login(inp)
+                return
 
     def main_menu(self):
-        inp = Whiptail(
-            title="Breadbox",
-            backtitle=self.backtitle
-        ).menu("Welcome to Breadbox", [
-            'Archive',
-            'Settings',
-            'Contribute',
-            'About'
-        ])[0]
+        # Forget screen data, so the archive is up-to-date the next time it's opened
+        self.screens.clear()
+
+        if self.offline:
+            inp = self.ui.menu("Breadbox", "You're offline. Only downloaded media can be played.", [
+                'Archive',
+                'Downloads',
+                'Settings',
+                'Reconnect',
+                'About'
+            ])
+        else:
+            inp = self.ui.menu("Breadbox", "Welcome to Breadbox", [
+                'Archive',
+                'Downloads',
+                'Settings',
+                'Contribute',
+                'About'
+            ])
+
+        # Everything except settings needs the connection started by run()
+        if inp not in ('Settings', 'About', None):
+            self.ready()
+
+            # The menu was shown before it was known whether the server can be reached
+            if inp == 'Contribute' and self.offline:
+                self.ui.msgbox("Breadbox", "The server can't be reached, so you're offline. Contributing needs the server.")
+                return self.main_menu
 
         # noinspection PyUnreachableCode
         match inp:
             # case 'Archive': self.archive_menu()
             case 'Archive':
-                self.anime_menu()
+                return self.anime_menu
+            case 'Downloads':
+                return self.downloads_menu
             case 'Settings':
-                self.settings_menu()
+                return self.settings_menu
             case 'Contribute':
-                self.contrib_menu()
+                return self.contrib_menu
+            case 'Reconnect':
+                if not self.go_online():
+                    self.ui.msgbox("Breadbox", "The server still can't be reached.")
+                return self.main_menu
             case 'About':
-                self.about_menu()
+                return self.about_menu
             case _:
                 raise AppExit
 
     # For development and debugging purposes
     def wip_message(self):
-        Whiptail(
-            title="Breadbox / ?",
-            backtitle=self.backtitle
-        ).msgbox("Unfortunately, there's nothing here yet. :(")
+        self.ui.msgbox("Breadbox / ?", "Unfortunately, there's nothing here yet. :(")
 
-        self.main_menu()
+        return self.main_menu
 
     def anime_menu(self):
+        import requests
+
         self.spinner.start("Fetching metadata...")
 
-        # Get all anime info
-        all_anime_info = self.breadbox.anime.all_info()
+        # Get all anime info, indexed for searching
+        try:
+            catalog = self.screen_data(
+                'catalog', None,
+                lambda: CatalogIndex(self.index_library(self.breadbox.anime.catalog()))
+            )
+        except requests.RequestException as e:
+            self.spinner.stop()
+            self.ui.msgbox(
+                "Breadbox / Archive",
+                "The archive can't be loaded right now.\n"
+                "\n"
+                + ("The archive has to be opened online once before it's available offline." if self.offline else str(e))
+            )
+            return self.main_menu
+
+        # Warm up the anime the user is most likely to open
+        self.prefetch.warm(self.history.recent(5))
 
         # Calculate the size that the text inside the menu should be.
         sz = get_terminal_size().columns - 35
 
-        # Create a list of whiptail options
-        options = []
-        for _id, _info in all_anime_info.items():
+        # Only the results that are shown get turned into menu options
+        def search(query: str, limit: int = None) -> list[tuple[str, str]]:
             # https://stackoverflow.com/a/2872519/19693227
-            title = (_info['title'][:sz] + '..') if len(_info['title']) > sz else _info['title']
-            options.append((_id, title))
+            return [
+                (_id, (title[:sz] + '..') if len(title) > sz else title)
+                for _id, title in catalog.choices(query, limit)
+            ]
 
         self.spinner.stop()
 
-        # Ask the user which anime to watch
-        inp = Whiptail(
-            title="Breadbox / Archive",
-            backtitle=self.backtitle
-        ).menu("Choose an anime to watch:", options)[0]
+        # Ask the user which anime to watch, warming whichever one is highlighted (if the UI can tell)
+        inp = self.ui.search(
+            "Breadbox / Archive",
+            "Search for an anime to watch:",
+            search,
+            on_highlight=self.prefetch.highlight
+        )
 
         # If the user cancelled; go back a menu.
         if not inp:
-            self.main_menu()
+            return self.main_menu
 
-        self.episode_menu(inp)
+        return partial(self.episode_menu, inp)
 
     def episode_menu(self, anime_id):
+        import requests
+
         self.spinner.start("Fetching metadata...")
 
-        media = self.breadbox.anime.list_media(anime_id)
-        info = self.breadbox.anime.info(anime_id)
+        self.history.add(anime_id)
+
+        try:
+            overview = self.anime_overview(anime_id)
+        except requests.RequestException as e:
+            self.spinner.stop()
+            self.ui.msgbox(
+                "Breadbox / Archive",
+                "This anime can't be loaded right now.\n"
+                "\n"
+                + ("Only anime that were opened while online are available offline." if self.offline else str(e))
+            )
+            return self.anime_menu
 
-        episodes_info = requests.get(info['external']['jikan'] + '/episodes').json()['data']
+        media, info, episodes_info = overview['media'], overview['info'], overview['episodes']
 
         if len(media['episodes']) == 0:
             self.spinner.stop()
-            Whiptail(
-                title="Breadbox / " + info['title'],
-                backtitle=self.backtitle
-            ).msgbox(
+            self.ui.msgbox(
+                "Breadbox / " + info['title'],
                 "This anime seems to be empty.\n"
                 "\n"
                 "Check back again later or contact the archive administrator."
             )
-            self.anime_menu()
+            return self.anime_menu
 
-        elif len(episodes_info) <= 1:
-            self.watch_menu(anime_id, '_movie')
+        # Jikan's episode list tells movies apart; without one, e.g. offline, the archive's media has to
+        elif len(episodes_info or media['episodes']) <= 1:
+            return partial(self.watch_menu, anime_id, '_movie')
 
         # Calculate the size that the text inside the menu should be.
         sz = get_terminal_size().columns - 32
@@ -334,7 +762,12 @@ class App:
         # Create a list of whiptail options
         options = []
         for _ep_num in media['episodes']:
-            _ep_tit = episodes_info[_ep_num - 1]['title']
+            _ep_tit = episodes_info.get(_ep_num, f"Episode {_ep_num}")
+
+            # Mark episodes that can be played without a connection
+            if self.local_file(anime_id, info, str(_ep_num)):
+                _ep_tit = "[downloaded] " + _ep_tit
+
             # https://stackoverflow.com/a/2872519/19693227
             title = (_ep_tit[:sz] + '..') if len(_ep_tit) > sz else _ep_tit
             options.append((str(_ep_num), title))
@@ -342,34 +775,57 @@ class App:
         if len(media['bonus']) > 0:
             options.append(('*', 'Bonus'))
 
+        if not self.offline:
+            options.append(('+', 'Download all'))
+
         self.spinner.stop()
 
-        inp = Whiptail(
-            title="Breadbox / " + info['title'],
-            backtitle=self.backtitle
-        ).menu("Choose an episode:", options)[0]
+        inp = self.ui.menu("Breadbox / " + info['title'], "Choose an episode:", options)
 
         if not inp:
-            self.anime_menu()
+            return self.anime_menu
+
+        elif inp == '+':
+            include_bonus = len(media['bonus']) > 0 and self.ui.yesno("Breadbox / " + info['title'], "Download the bonus content too?", default=False)
+
+            media_ids = self.downloads.media_ids(anime_id, include_bonus)
+            jobs = self.downloads.enqueue_anime(anime_id, include_bonus)
+
+            message = f"Added {len(jobs)} files to the download queue."
+
+            if skipped := len(media_ids) - len(jobs):
+                message += f"\n\n{skipped} were skipped because they're already downloaded or downloading."
+
+            self.ui.msgbox("Breadbox / " + info['title'], message)
+
+            return partial(self.episode_menu, anime_id)
 
         elif inp == '*':
-            inp = Whiptail(
-                title="Breadbox / " + info['title'],
-                backtitle=self.backtitle
-            ).menu("Bonus content", media['bonus'])[0]
+            inp = self.ui.menu("Breadbox / " + info['title'], "Bonus content", [
+                (bonus, "[downloaded]" if self.local_file(anime_id, info, bonus) else "") for bonus in media['bonus']
+            ])
 
             if not inp:
-                self.episode_menu(anime_id)
+                return partial(self.episode_menu, anime_id)
 
-        self.watch_menu(anime_id, inp)
+        return partial(self.watch_menu, anime_id, inp)
 
     def watch_menu(self, anime_id, media_id):
         self.spinner.start("Fetching metadata...")
 
-        info = self.breadbox.anime.info(anime_id)
+        info = self.anime_overview(anime_id)['info']
+
+        next_media_id = self.next_media(anime_id, media_id)
+        file = self.local_file(anime_id, info, media_id)
+
+        # Sign this and the next episode's URLs while the user decides
+        if not self.offline:
+            self.prefetch.presign(anime_id, media_id)
+            if next_media_id:
+                self.prefetch.presign(anime_id, next_media_id)
 
         if media_id.isnumeric():
-            ep_title = requests.get(info['external']['jikan'] + '/episodes').json()['data'][int(media_id) - 1]['title']
+            ep_title = self.jikan.episode_title(info['external']['jikan'], media_id)
             msg = f"Episode {media_id} - {ep_title}"
         elif media_id == '_movie':
             msg = info['title'] + " - Movie"
@@ -378,47 +834,103 @@ class App:
 
         self.spinner.stop()
 
-        inp = Whiptail(
-            title="Breadbox / " + info['title'],
-            backtitle=self.backtitle
-        ).menu(msg, ['Stream with VLC', 'Save to downloads'])[0]
+        # Downloaded media plays straight from disk
+        options = ['Play downloaded file'] if file else []
+
+        if not self.offline:
+            options += ['Stream with VLC', 'Save to downloads']
 
-        if inp == 'Stream with VLC':
-            url = self.breadbox.anime.get_media_url(anime_id, media_id)
-            self.watch(url)
+        if not options:
+            self.ui.msgbox("Breadbox / " + info['title'], msg + "\n\nThis hasn't been downloaded, so it can't be played offline.")
+            inp = None
+        else:
+            inp = self.ui.menu("Breadbox / " + info['title'], msg, options)
+
+        if inp == 'Play downloaded file':
+            self.play_local(anime_id, info, media_id, next_media_id)
+
+        elif inp == 'Stream with VLC':
+            self.stream(anime_id, media_id, next_media_id)
 
         elif inp == 'Save to downloads':
-            self.spinner.start("Downloading media...")
+            msg = self.save_media_message(anime_id, media_id, info)
 
-            if not self.config.get('download_folder'):
-                self.config['download_folder'] = '~/Downloads'
+            self.ui.msgbox("Breadbox / " + info['title'], msg)
 
-            downloads_folder = Path(self.config['download_folder']).expanduser()
+        if media_id == '_movie':
+            return self.anime_menu
+        else:
+            return partial(self.episode_menu, anime_id)
 
-            if media_id.isnumeric():
-                filename = f"%s - Episode %02d.mp4" % (info['title'], int(media_id))
-            else:
-                filename = f"%s - %s" % (info['title'], media_id)
+    def save_media(self, anime_id, media_id, info: dict) -> Path:
+        """Download an episode or bonus file to the downloads folder"""
+        from downloader import Downloader
+        from downloads import media_filename
+
+        self.spinner.start("Downloading media...")
 
-            file = downloads_folder / filename
+        downloads_folder = Path(self.config['downloads_folder']).expanduser()
+        file = downloads_folder / media_filename(info['title'], media_id)
 
-            with open(file, 'wb') as fp:
-                with self.breadbox.anime.download_media(anime_id, media_id) as r:
-                    r.raise_for_status()
-                    for chunk in r.iter_content(chunk_size=8192):
-                        fp.write(chunk)
+        def show_progress(progress):
+            self.spinner.text = f"Downloading media... {progress}"
 
+        try:
+            Downloader(
+                lambda **kwargs: self.breadbox.anime.download_media(anime_id, media_id, **kwargs),
+                progress=show_progress,
+                connections=self.downloads.connections(self.breadbox.base_url),
+                **self.downloader_options()
+            ).download(file)
+        finally:
             self.spinner.stop()
 
-            Whiptail(
-                title="Breadbox / " + info['title'],
-                backtitle=self.backtitle
-            ).msgbox(f"Saved file to " + str(file))
+        self.library.add(file, anime_id, media_id)
 
-        if media_id == '_movie':
-            self.anime_menu()
-        else:
-            self.episode_menu(anime_id)
+        return file
+
+    def save_media_message(self, anime_id, media_id, info: dict) -> str:
+        """Download media and describe how it went"""
+        import requests
+        from downloader import IntegrityError
+
+        if file := self.local_file(anime_id, info, media_id):
+            return "Already downloaded to " + str(file)
+
+        try:
+            file = self.save_media(anime_id, media_id, info)
+        except IntegrityError as e:
+            return f"The download was corrupted and has been deleted.\n\n{e}"
+        except requests.RequestException as e:
+            return f"The download was interrupted. It will resume where it left off next time.\n\n{e}"
+
+        return "Saved file to " + str(file)
+
+    def downloads_menu(self):
+        # Calculate the size that the text inside the menu should be.
+        sz = get_terminal_size().columns - 32
+
+        options = [
+            ('Refresh', 'Update the progress shown below'),
+            ('Retry', 'Queue failed downloads again'),
+            ('Clear', 'Remove finished downloads from the list')
+        ]
+
+        for n, job in enumerate(self.downloads.status(), start=1):
+            desc = job.describe()
+            options.append((str(n), (desc[:sz] + '..') if len(desc) > sz else desc))
+
+        inp = self.ui.menu("Breadbox / Downloads", "Download queue:", options)
+
+        match inp:
+            case None:
+                return self.main_menu
+            case 'Retry':
+                self.downloads.retry_failed()
+            case 'Clear':
+                self.downloads.clear_finished()
+
+        return self.downloads_menu
 
     def settings_menu(self):
         # Calculate the size that the text inside the menu should be.
@@ -428,55 +940,61 @@ class App:
             ["server", "Set the Breadbox server address"],
             ["downloads_folder", "Set the destination for downloads"],
             ["vlc_auto_exit", "Enable/disable VLC closing after media is finished"],
-            ["enable_theme", "Enable/disable custom Whiptail theme"],
-            ["theme", "Set which whiptail theme is used"]
+            ["enable_theme", "Enable/disable custom theme"],
+            ["theme", "Set which theme is used"],
+            ["ui", "Set the interface style (applies after a restart)"],
+            ["enable_cache", "Enable/disable caching archive metadata"]
         ]
 
         # Automatically truncate larger options
         for opt in options:
             opt[1] = (opt[1][:sz] + '..') if len(opt[1]) > sz else opt[1]
 
-        key = Whiptail(
-            title="Breadbox / Settings",
-            backtitle=self.backtitle
-        ).menu(
+        key = self.ui.menu(
+            "Breadbox / Settings",
             "Select the setting that you'd like to modify:",
             options
-        )[0]
+        )
 
         if not key:
-            self.main_menu()
+            return self.main_menu
 
-        w = Whiptail(
-            title="Breadbox / Settings / " + key,
-            backtitle=self.backtitle
-        )
+        page_title = "Breadbox / Settings / " + key
 
         match key:
             case 'server':
-                inp = w.inputbox(msg="Edit server URL:", default=self.config[key])[0]
+                inp = self.ui.inputbox(page_title, msg="Edit server URL:", default=self.config[key])
                 if inp:
                     self.config[key] = inp
             case 'downloads_folder':
-                inp = w.inputbox(msg="Please provide a valid path:", default=self.config[key])[0]
+                inp = self.ui.inputbox(page_title, msg="Please provide a valid path:", default=self.config[key])
                 if inp:
                     self.config[key] = inp
             case 'vlc_auto_exit':
                 if self.config[key]:
-                    inp = w.yesno(msg="Disable VLC auto-exit?")
+                    inp = self.ui.yesno(page_title, msg="Disable VLC auto-exit?")
                     if inp:
                         self.config[key] = False
                 else:
-                    inp = w.yesno(msg="Enable VLC auto-exit?")
+                    inp = self.ui.yesno(page_title, msg="Enable VLC auto-exit?")
                     if inp:
                         self.config[key] = True
             case 'enable_theme':
                 if self.config[key]:
-                    inp = w.yesno(msg="Disable custom theme?")
+                    inp = self.ui.yesno(page_title, msg="Disable custom theme?")
                     if inp:
                         self.config[key] = False
                 else:
-                    inp = w.yesno(msg="Enable custom theme?")
+                    inp = self.ui.yesno(page_title, msg="Enable custom theme?")
+                    if inp:
+                        self.config[key] = True
+            case 'enable_cache':
+                if self.config[key]:
+                    inp = self.ui.yesno(page_title, msg="Disable metadata cache?")
+                    if inp:
+                        self.config[key] = False
+                else:
+                    inp = self.ui.yesno(page_title, msg="Enable metadata cache?")
                     if inp:
                         self.config[key] = True
             case 'theme':
@@ -485,193 +1003,182 @@ class App:
                     if fil.is_file() and fil.suffix == '.json':
                         options.append(fil.stem)
 
-                inp = w.menu("Current theme: " + self.config['theme'], options)[0]
+                inp = self.ui.menu(page_title, "Current theme: " + self.config['theme'], options)
 
                 if inp:
                     self.config[key] = inp
 
                 self.load_theme()
+            case 'ui':
+                inp = self.ui.menu(page_title, "Current interface: " + self.config['ui'], [
+                    ('auto', "Whiptail if it's installed, otherwise inline prompts"),
+                    ('whiptail', "Whiptail dialogs"),
+                    ('questionary', "Inline prompts"),
+                    ('curses', "Built-in full screen dialogs")
+                ])
+
+                if inp:
+                    self.config[key] = inp
 
         self.save_config()
-        self.settings_menu()
+        return self.settings_menu
 
     def contrib_menu(self):
+        # Changes are compared with the server's copy, and the permissions come from it
+        if self.offline or self.user_info is None:
+            self.ui.msgbox("Breadbox / Contribute", "Contributing needs the server, which can't be reached right now.")
+            return self.main_menu
+
         if self.user_info['auth_level'] < 2:
-            Whiptail(
-                title="Breadbox / Contribute",
-                backtitle=self.backtitle
-            ).msgbox(
+            self.ui.msgbox(
+                "Breadbox / Contribute",
                 "You lack the permissions required to make changes to the archive.\n"
                 "\n"
                 "Contact the archive's administrator for access if you'd like to make changes."
             )
-            self.main_menu()
+            return self.main_menu
 
-        inp = Whiptail(
-            title="Breadbox / Contribute",
-            backtitle=self.backtitle
-        ).yesno(
+        inp = self.ui.yesno(
+            "Breadbox / Contribute",
             "You're about to be asked a series of questions. You can cancel at any time, but your work will be lost.\n"
             "\n"
             "Any contributions you make will either OVERWRITE existing information, or CREATE new information.\n"
+            "Only the information that's different from the archive's is sent.\n"
             "Contributions cannot be undone.\n"
             "\n"
             "Continue?"
         )
 
         if not inp:
-            self.main_menu()
+            return self.main_menu
 
         # ------ Anime ID ------
-        inp = Whiptail(
-            title="Breadbox / Contribute",
-            backtitle=self.backtitle
-        ).inputbox("What is the anime's ID on Breadbox?")[0]
+        inp = self.ui.inputbox("Breadbox / Contribute", "What is the anime's ID on Breadbox?")
 
         if not inp:
-            self.main_menu()
+            return self.main_menu
 
         while not inp.isnumeric():
-            Whiptail(
-                title="Breadbox / Contribute",
-                backtitle=self.backtitle
-            ).msgbox("IDs must be numeric.")
+            self.ui.msgbox("Breadbox / Contribute", "IDs must be numeric.")
 
-            inp = Whiptail(
-                title="Breadbox / Contribute",
-                backtitle=self.backtitle
-            ).inputbox("What is the anime's ID on Breadbox?")[0]
+            inp = self.ui.inputbox("Breadbox / Contribute", "What is the anime's ID on Breadbox?")
 
             if not inp:
-                self.main_menu()
+                return self.main_menu
 
         breadbox_id = int(inp)
         page_title = "Breadbox / Contribute / " + inp
 
         # ------ Title ------
-        inp = Whiptail(
-            title=page_title,
-            backtitle=self.backtitle
-        ).inputbox("What is the anime's title?")[0]
+        inp = self.ui.inputbox(page_title, "What is the anime's title?")
 
         if not inp:
-            self.main_menu()
+            return self.main_menu
 
         title = inp
 
         # ------ MyAnimeList ID ------
-        inp = Whiptail(
-            title=page_title,
-            backtitle=self.backtitle
-        ).inputbox("What is the anime's ID on MyAnimeList?")[0]
+        inp = self.ui.inputbox(page_title, "What is the anime's ID on MyAnimeList?")
 
         if not inp:
-            self.main_menu()
+            return self.main_menu
 
         while not inp.isnumeric():
-            Whiptail(
-                title=page_title,
-                backtitle=self.backtitle
-            ).msgbox("IDs must be numeric.")
+            self.ui.msgbox(page_title, "IDs must be numeric.")
 
-            inp = Whiptail(
-                title=page_title,
-                backtitle=self.backtitle
-            ).inputbox("What is the anime's ID on MyAnimeList?")[0]
+            inp = self.ui.inputbox(page_title, "What is the anime's ID on MyAnimeList?")
 
             if not inp:
-                self.main_menu()
+                return self.main_menu
 
         mal_id = int(inp)
 
         # ------ AniList ID ------
-        inp = Whiptail(
-            title=page_title,
-            backtitle=self.backtitle
-        ).inputbox("What is the anime's ID on AniList?")[0]
+        inp = self.ui.inputbox(page_title, "What is the anime's ID on AniList?")
 
         if not inp:
-            self.main_menu()
+            return self.main_menu
 
         while not inp.isnumeric():
-            Whiptail(
-                title=page_title,
-                backtitle=self.backtitle
-            ).msgbox("IDs must be numeric.")
+            self.ui.msgbox(page_title, "IDs must be numeric.")
 
-            inp = Whiptail(
-                title=page_title,
-                backtitle=self.backtitle
-            ).inputbox("What is the anime's ID on AniList?")[0]
+            inp = self.ui.inputbox(page_title, "What is the anime's ID on AniList?")
 
             if not inp:
-                self.main_menu()
+                return self.main_menu
 
         anilist_id = int(inp)
 
-        # ------ Nyaa ID ------
+        # ------ Nyaa search ------
         nyaa_ids = []
 
-        while True:
-            inp = Whiptail(
-                title=page_title,
-                backtitle=self.backtitle
-            ).inputbox("What is the ID of the torrent on Nyaa.si?")[0]
+        # A whole season's torrents can be picked from the search results at once
+        if self.ui.yesno(page_title, msg=f"Search Nyaa.si for torrents of {title}?"):
+            import requests
+            from nyaa import NyaaError
+
+            self.spinner.start("Searching Nyaa.si...")
+
+            try:
+                results = self.nyaa.search_anime(title)
+            except (NyaaError, requests.RequestException) as e:
+                results = []
+                self.spinner.stop()
+                self.ui.msgbox(page_title, f"Nyaa.si can't be searched right now.\n\n{e}")
+
+            self.spinner.stop()
+
+            if results:
+                inp = self.ui.checklist(
+                    page_title,
+                    "Select the torrents to add.",
+                    [(str(result.id), result.describe()) for result in results[:self.ui.SEARCH_LIMIT]]
+                )
+
+                nyaa_ids += [int(_id) for _id in inp]
+
+        # ------ Nyaa ID ------
+        while not nyaa_ids or self.ui.yesno(
+            page_title,
+            msg="Would you like to add another torrent by its ID?",
+            default=False
+        ):
+            inp = self.ui.inputbox(page_title, "What is the ID of the torrent on Nyaa.si?")
 
             if not inp:
-                self.main_menu()
+                return self.main_menu
 
             while not inp.isnumeric():
-                Whiptail(
-                    title=page_title,
-                    backtitle=self.backtitle
-                ).msgbox("IDs must be numeric.")
+                self.ui.msgbox(page_title, "IDs must be numeric.")
 
-                inp = Whiptail(
-                    title=page_title,
-                    backtitle=self.backtitle
-                ).inputbox("What is the ID of the torrent on Nyaa.si?")[0]
+                inp = self.ui.inputbox(page_title, "What is the ID of the torrent on Nyaa.si?")
 
                 if not inp:
-                    self.main_menu()
+                    return self.main_menu
 
             nyaa_ids.append(int(inp))
 
-            if not Whiptail(
-                    title=page_title,
-                    backtitle=self.backtitle
-            ).yesno(
-                msg="Would you like to add another torrent?",
-                default='no'
-            ): break
-
         # ------ Audio ------
-        inp = Whiptail(
-            title=page_title,
-            backtitle=self.backtitle
-        ).checklist(
+        inp = self.ui.checklist(
+            page_title,
             "Select the languages that are available as audio.",
             Languages
-        )[0]
+        )
 
         audio_languages = inp
 
         # ------ Subtitles ------
-        inp = Whiptail(
-            title=page_title,
-            backtitle=self.backtitle
-        ).checklist(
+        inp = self.ui.checklist(
+            page_title,
             "Select the languages that are available as subtitles.",
             Languages
-        )[0]
+        )
 
         subtitle_languages = inp
 
         # ------ Confirm ------
-        inp = Whiptail(
-            title=page_title,
-            backtitle=self.backtitle
-        ).yesno(
+        inp = self.ui.yesno(
+            page_title,
             f"Title: {title}\n"
             f"Breadbox ID: {breadbox_id}\n"
             f"MyAnimeList ID: {mal_id}\n"
@@ -680,288 +1187,156 @@ class App:
             f"Audio: [{', '.join(audio_languages)}]\n"
             f"Subtitles: [{', '.join(subtitle_languages)}]\n"
             "\n"
-            "Any existing information will be lost!\n"
+            "Existing information that's different will be lost!\n"
             "\n"
             "Continue?"
         )
 
         if not inp:
-            self.main_menu()
+            return self.main_menu
 
         # ------ Find magnet link and torrent link ------
         self.spinner.start("Finding torrent info...")
 
-        from nyaa import NyaaTorrent
-
-        torrents = []
+        import requests
+        from nyaa import NyaaError
 
-        for _id in nyaa_ids:
-            torrent = NyaaTorrent(_id)
+        # Every page is fetched at once
+        try:
+            torrents = [torrent.to_dict() for torrent in self.nyaa.resolve_many(nyaa_ids)]
+        except (NyaaError, requests.RequestException) as e:
+            self.spinner.stop()
+            self.ui.msgbox(page_title, f"The torrents couldn't be found on Nyaa.si.\n\n{e}")
 
-            torrents.append({
-                "magnet": torrent.magnet,
-                "file": torrent.file,
-                "url": torrent.url
-            })
+            return self.main_menu
 
         self.spinner.stop()
 
         # ------ Upload metadata ------
-        self.spinner.start("Uploading metadata...")
-
-        metadata = {
-            "title": title,
-            "audio": audio_languages,
-            "subtitles": subtitle_languages,
-            "external": {
-                "myanimelist": f"https://myanimelist.net/anime/{mal_id}",
-                "jikan": f"https://api.jikan.moe/v4/anime/{mal_id}",
-                "anilist": f"https://anilist.co/anime/{anilist_id}"
-            },
-            "torrents": torrents
-        }
-
-        resp = self.breadbox.anime.patch('/' + str(breadbox_id), data=metadata).json()
-
-        self.spinner.stop()
-
-        Whiptail(
-            title=page_title,
-            backtitle=self.backtitle
-        ).msgbox(
-            f"{resp['details']}\n\nBreadbox response code: {resp['code']}"
-        )
+        self.spinner.start("Comparing with the archive...")
 
-        self.spinner.start("Downloading thumbnail...")
+        from importer import ManifestRow
+        from contributions import ContributionEngine
 
-        image_url = requests.get(f"https://api.jikan.moe/v4/anime/{mal_id}").json()['data']['images']['jpg'][
-            'image_url']
+        metadata = ManifestRow(
+            breadbox_id, title, mal_id, anilist_id, nyaa_ids, audio_languages, subtitle_languages
+        ).metadata(torrents)
 
-        resp = self.breadbox.anime.upload(
-            f'/{breadbox_id}/thumbnail',
-            content=requests.get(image_url).content,
-            filename='thumbnail.jpg',
-            mimetype='image/jpeg'
-        ).json()
+        # Only the fields that differ from the archive's copy are sent
+        engine = ContributionEngine(self.breadbox)
+        changes = engine.changes(breadbox_id, metadata)
 
         self.spinner.stop()
 
-        Whiptail(
-            title=page_title,
-            backtitle=self.backtitle
-        ).msgbox(
-            f"{resp['details']}\n\nBreadbox response code: {resp['code']}"
-        )
-
-        self.main_menu()
-
-    def about_menu(self):
-        Whiptail(
-            title="Breadbox / About",
-            backtitle=self.backtitle
-        ).msgbox(f"{self.title} v{self.version}\n\n{self.summary}\n\n{self.credit}")
-
-        self.main_menu()
-
-    def watch(self, url: str):
-        vlc(url, exit_after=self.config['vlc_auto_exit'])
-
+        if changes:
+            self.spinner.start("Uploading metadata...")
 
-# Fallback application class
-class FallbackApp(App):
-    @staticmethod
-    def erase_line():
-        """Erase the last line written to stdout"""
-        sys.stdout.write(Eraser)
+            resp = self.breadbox.anime.patch('/' + str(breadbox_id), data=changes).json()
 
-    def ask_for_server_url(self):
-        inp = q.text("Input a server URL:", default="https://api.example.com").ask(kbi_msg=Eraser)
-        self.erase_line()
-
-        if not inp:
-            raise AppExit()
-
-        self.config['server'] = inp
-        self.save_config()
-
-    def ask_for_api_key(self):
-        inp = q.password("Set API key:").ask(kbi_msg=Eraser)
-        self.erase_line()
-
-        if not inp:
-            raise AppExit
+            self.spinner.stop()
 
-        if not Breadbox.check_key(inp):
-            self.ask_for_api_key()
+            self.ui.msgbox(
+                page_title,
+                f"Changed: {', '.join(sorted(changes))}\n\n{resp['details']}\n\nBreadbox response code: {resp['code']}"
+            )
         else:
-            Breadbox.login(inp)
+            self.ui.msgbox(page_title, "The archive already has this information, so nothing was changed.")
 
-    def main_menu(self):
-        inp = q.select("Welcome to Breadbox", [
-            'Archive',
-            'About',
-            'Exit'
-        ]).ask(kbi_msg=Eraser)
-        self.erase_line()
+        self.spinner.start("Uploading thumbnail...")
 
-        match inp:
-            case 'Archive':
-                self.anime_menu()
-            case 'About':
-                self.about_menu()
-            case _:
-                raise AppExit
-
-    # For development and debugging purposes
-    def wip_message(self):
-        q.press_any_key_to_continue("Unfortunately, there's nothing here yet. :(").ask(kbi_msg=Eraser)
-        self.erase_line()
-        self.main_menu()
-
-    def anime_menu(self):
-        self.spinner.start("Fetching metadata...")
-
-        # Get all anime info
-        all_anime_info = self.breadbox.anime.all_info()
-
-        # Create a list of options
-        options = []
-        for _id, _info in all_anime_info.items():
-            options.append(q.Choice(title=_info['title'], value=_id))
-
-        options.append(q.Choice(title="<-----[ Back ]", value=False))
-
-        self.spinner.stop()
-
-        # Ask the user which anime to watch
-        inp = q.select("Choose an anime to watch:", options).ask(kbi_msg=Eraser)
-        self.erase_line()
-
-        # If the user cancelled; go back a menu.
-        if not inp:
-            self.main_menu()
+        # Copied from MyAnimeList straight into the archive, and skipped if the archive already has it
+        thumbnails = self.thumbnail_pipeline()
 
-        self.episode_menu(inp)
-
-    def episode_menu(self, anime_id):
-        self.spinner.start("Fetching metadata...")
-
-        media = self.breadbox.anime.list_media(anime_id)
-        info = self.breadbox.anime.info(anime_id)
-
-        episodes_info = requests.get(info['external']['jikan'] + '/episodes').json()['data']
-
-        if len(media['episodes']) == 0:
+        try:
+            result = thumbnails.run([breadbox_id])[str(breadbox_id)]
+        finally:
+            thumbnails.close()
             self.spinner.stop()
-            q.press_any_key_to_continue("This anime seems to be empty.").ask(kbi_msg=Eraser)
-            self.erase_line()
-            self.anime_menu()
-
-        elif len(episodes_info) <= 1:
-            self.watch_menu(anime_id, '_movie')
 
-        options = []
-        for _ep_num in media['episodes']:
-            _ep_tit = episodes_info[_ep_num - 1]['title']
-            options.append(q.Choice(title=str(_ep_num) + ' - ' + _ep_tit, value=_ep_num))
+        self.ui.msgbox(page_title, f"Thumbnail: {result}")
 
-        if len(media['bonus']) > 0:
-            options.append(q.Choice(title="* - Bonus", value='*'))
+        return self.main_menu
 
-        options.append(q.Choice(title="<-----[ Back ]", value=False))
+    def about_menu(self):
+        self.ui.msgbox("Breadbox / About", f"{self.title} v{self.version}\n\n{self.summary}\n\n{self.credit}")
 
-        self.spinner.stop()
+        return self.main_menu
 
-        inp = q.select("Choose an episode:", options).ask(kbi_msg=Eraser)
-        self.erase_line()
+    def next_media(self, anime_id, media_id) -> str | None:
+        """Get the episode after media_id, if there is one"""
+        if not media_id.isnumeric():
+            return None
 
-        if not inp:
-            self.anime_menu()
+        episodes = [str(ep) for ep in self.anime_overview(anime_id)['media']['episodes']]
 
-        elif inp == '*':
-            inp = q.select("Bonus content:", [
-                *media['bonus'],
-                q.Choice(title="<-----[ Back ]", value=False)
-            ]).ask(kbi_msg=Eraser)
-            self.erase_line()
+        if media_id in episodes and (n := episodes.index(media_id) + 1) < len(episodes):
+            return episodes[n]
 
-            if not inp:
-                self.episode_menu(anime_id)
+        return None
 
-        self.watch_menu(anime_id, str(inp))
+    def stream(self, anime_id, media_id, next_media_id: str = None):
+        """Open an episode in VLC, queueing the next one so it starts instantly"""
+        urls = [self.prefetch.media_url(anime_id, media_id)]
 
-    def watch_menu(self, anime_id, media_id):
-        self.spinner.start("Fetching metadata...")
+        if next_media_id:
+            urls.append(self.prefetch.media_url(anime_id, next_media_id))
 
-        info = self.breadbox.anime.info(anime_id)
+        self.watch(urls)
 
-        if media_id.isnumeric():
-            ep_title = requests.get(info['external']['jikan'] + '/episodes').json()['data'][int(media_id) - 1]['title']
-            msg = f"Episode {media_id} - {ep_title}"
-        elif media_id == '_movie':
-            msg = info['title'] + " - Movie"
-        else:
-            msg = "Bonus - " + media_id
+    def index_library(self, catalog: dict[str, dict]) -> dict[str, dict]:
+        """Pick up changes to the downloads folder and match new files to the catalog, passing the catalog on"""
+        self.library.scan()
+        self.library.identify(catalog)
 
-        self.spinner.stop()
+        return catalog
 
-        inp = q.select(msg, [
-            "Stream with VLC",
-            "Save to downloads",
-            "<-----[ Back ]"
-        ]).ask(kbi_msg=Eraser)
-        self.erase_line()
+    def local_file(self, anime_id, info: dict, media_id) -> Optional[Path]:
+        """The downloaded copy of an episode or bonus file, if there is one"""
+        if file := self.library.find(anime_id, media_id):
+            return file
 
-        if inp == 'Stream with VLC':
-            url = self.breadbox.anime.get_media_url(anime_id, media_id)
-            self.watch(url)
+        # Saved since the last scan, under the name it was given
+        from downloads import media_filename
 
-        elif inp == 'Save to downloads':
-            self.spinner.start("Downloading media...")
+        file = Path(self.config['downloads_folder']).expanduser() / media_filename(info['title'], str(media_id))
 
-            if not self.config.get('download_folder'):
-                self.config['download_folder'] = '~/Downloads'
+        if file.is_file() and self.library.add(file, anime_id, media_id):
+            return file
 
-            downloads_folder = Path(self.config['download_folder']).expanduser()
+        return None
 
-            if media_id.isnumeric():
-                filename = f"%s - Episode %02d.mp4" % (info['title'], int(media_id))
-            else:
-                filename = f"%s - %s" % (info['title'], media_id)
+    def play_local(self, anime_id, info: dict, media_id, next_media_id: str = None):
+        """Open a downloaded episode in VLC, queueing the next one if it's downloaded too"""
+        files = [str(self.local_file(anime_id, info, media_id))]
 
-            file = downloads_folder / filename
+        if next_media_id and (next_file := self.local_file(anime_id, info, next_media_id)):
+            files.append(str(next_file))
 
-            with open(file, 'wb') as fp:
-                with self.breadbox.anime.download_media(anime_id, media_id) as r:
-                    r.raise_for_status()
-                    for chunk in r.iter_content(chunk_size=8192):
-                        fp.write(chunk)
+        self.watch(files)
 
-            self.spinner.stop()
+    def watch(self, url: str | list[str]):
+        vlc(url, exit_after=self.config['vlc_auto_exit'])
 
-            q.press_any_key_to_continue("Saved file to " + str(file)).ask(kbi_msg=Eraser)
-            self.erase_line()
 
+if __name__ == '__main__':
 
-        if media_id == '_movie':
-            self.anime_menu()
-        else:
-            self.episode_menu(anime_id)
+    args = sys.argv[1:]
 
-    def about_menu(self):
-        q.press_any_key_to_continue(self.backtitle).ask(kbi_msg=Eraser)
-        self.erase_line()
-        self.main_menu()
+    # Print how long each step of starting up took, on exit
+    profile = '--startup-profile' in args
+    if profile:
+        args.remove('--startup-profile')
 
-if __name__ == '__main__':
+    # Run headless when given a command
+    if args:
+        import cli
+        sys.exit(cli.main(args))
 
-    # Check if whiptail is installed
-    if shutil.which('whiptail'):
-        app = App()
-    else:
-        app = FallbackApp()
+    app = App(profile=StartupProfile(_started) if profile else None)
 
     try:
         app.run()
     except AppExit:
         pass
+    finally:
+        app.close()
@@ -0,0 +1,280 @@
+"""
+A local SQLite index of archive metadata, for answering queries without pulling the full listing
+"""
+
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from pathlib import Path
+
+
+# Words that mark the language before them as audio or subtitles, e.g. "japanese audio and english subs"
+AUDIO_WORDS = {'audio', 'dub', 'dubs', 'dubbed'}
+SUBTITLE_WORDS = {'sub', 'subs', 'subbed', 'subtitle', 'subtitles', 'subtitled'}
+
+# Words that don't narrow a query down
+STOP_WORDS = {'and', 'with', 'anime', 'in', 'the'}
+
+# Short names for the sites in an anime's external links
+SITE_ALIASES = {'mal': 'myanimelist'}
+
+# The sites in an anime's external links; "<site>:<id>" only filters by ID for these
+EXTERNAL_SITES = {'myanimelist', 'anilist', 'jikan'}
+
+
+def parse_query(text: str) -> dict:
+    """
+    Turn a query like "japanese audio and english subs" into keyword arguments for ArchiveIndex.query().
+
+    Understands:
+        "<language> audio/dub", "<language> subs/subtitles", "audio:<language>", "subs:<language>",
+        "<site>:<id>" for external IDs (myanimelist, mal, anilist or jikan),
+        and anything else is matched against titles, including other words with colons like "re:zero".
+    """
+    words = re.findall(r'[\w:-]+', text.casefold())
+
+    title = []
+    audio = []
+    subtitles = []
+    external = {}
+
+    n = 0
+    while n < len(words):
+        word = words[n]
+        following = words[n + 1] if n + 1 < len(words) else None
+
+        key, _, value = word.partition(':')
+        site = SITE_ALIASES.get(key, key)
+
+        if value and key in AUDIO_WORDS:
+            audio.append(value)
+        elif value and key in SUBTITLE_WORDS:
+            subtitles.append(value)
+        elif value and site in EXTERNAL_SITES:
+            external[site] = value
+        elif ':' in word:
+            # Part of a title, e.g. "re:zero" or "steins;gate 0: ..."
+            title += [part for part in word.split(':') if part]
+
+        elif following in AUDIO_WORDS:
+            audio.append(word)
+            n += 1
+        elif following in SUBTITLE_WORDS:
+            subtitles.append(word)
+            n += 1
+        elif word not in STOP_WORDS:
+            title.append(word)
+
+        n += 1
+
+    return {
+        'title': ' '.join(title) or None,
+        'audio': audio,
+        'subtitles': subtitles,
+        'external': external
+    }
+
+
+def external_id(url: str) -> str:
+    """Get the ID at the end of an external link, e.g. "https://anilist.co/anime/21" -> "21"."""
+    return str(url).rstrip('/').rsplit('/', 1)[-1]
+
+
+class ArchiveIndex:
+    """
+    Archive entries stored in SQLite, with their titles in a full-text index
+    and their languages and external IDs in tables of their own.
+
+    sync() only rewrites entries whose metadata changed, so keeping the index current is cheap.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS languages (
+            id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            language TEXT NOT NULL,
+            PRIMARY KEY (kind, language, id)
+        );
+        CREATE TABLE IF NOT EXISTS externals (
+            id TEXT NOT NULL,
+            site TEXT NOT NULL,
+            external_id TEXT NOT NULL,
+            PRIMARY KEY (site, external_id, id)
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS titles USING fts5(
+            id UNINDEXED,
+            title,
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        );
+    """
+
+    def __init__(self, path: Path | str = ':memory:'):
+        """
+        :param path: The database file, or ':memory:' for an index that only lasts as long as the process
+        """
+        if path != ':memory:':
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.db:
+            self.db.executescript(self.SCHEMA)
+
+    @staticmethod
+    def digest(info: dict) -> str:
+        return hashlib.sha1(json.dumps(info, sort_keys=True).encode()).hexdigest()
+
+    @property
+    def synced(self) -> float:
+        """When the index was last synced with the archive, as a timestamp."""
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'synced'").fetchone()
+
+        return row[0] if row else 0
+
+    def expire(self):
+        """Mark the index as out of date, so it's synced before the next query."""
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM meta WHERE key = 'synced'")
+
+    def _put(self, _id: str, info: dict, digest: str):
+        self._remove(_id)
+
+        self.db.execute(
+            "INSERT INTO entries (id, title, digest, data) VALUES (?, ?, ?, ?)",
+            (_id, info.get('title', ''), digest, json.dumps(info))
+        )
+        self.db.execute("INSERT INTO titles (id, title) VALUES (?, ?)", (_id, info.get('title', '')))
+
+        self.db.executemany(
+            "INSERT OR IGNORE INTO languages (id, kind, language) VALUES (?, ?, ?)",
+            [(_id, kind, lang.casefold()) for kind in ('audio', 'subtitles') for lang in info.get(kind) or ()]
+        )
+        self.db.executemany(
+            "INSERT OR IGNORE INTO externals (id, site, external_id) VALUES (?, ?, ?)",
+            [(_id, site, external_id(url)) for site, url in (info.get('external') or {}).items() if url]
+        )
+
+    def _remove(self, _id: str):
+        for table in ('entries', 'titles', 'languages', 'externals'):
+            self.db.execute(f"DELETE FROM {table} WHERE id = ?", (_id,))
+
+    def put(self, _id, info: dict):
+        """Add or update a single entry."""
+        with self.lock, self.db:
+            self._put(str(_id), info, self.digest(info))
+
+    def remove(self, _id):
+        with self.lock, self.db:
+            self._remove(str(_id))
+
+    def sync(self, catalog: dict[str, dict]) -> tuple[int, int]:
+        """
+        Bring the index in line with the archive
+        :param catalog: Information on every entry by ID, as returned by all_info()
+        :return: How many entries were added or changed, and how many were removed
+        """
+        with self.lock, self.db:
+            known = dict(self.db.execute("SELECT id, digest FROM entries"))
+
+            changed = 0
+            for _id, info in catalog.items():
+                digest = self.digest(info)
+
+                if known.pop(str(_id), None) != digest:
+                    self._put(str(_id), info, digest)
+                    changed += 1
+
+            # Whatever is left is no longer in the archive
+            for _id in known:
+                self._remove(_id)
+
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced', ?)", (time.time(),))
+
+        return changed, len(known)
+
+    def get(self, _id) -> dict | None:
+        with self.lock:
+            row = self.db.execute("SELECT data FROM entries WHERE id = ?", (str(_id),)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def query(
+            self,
+            title: str = None,
+            audio: list[str] = (),
+            subtitles: list[str] = (),
+            external: dict[str, str] = None,
+            limit: int = None
+    ) -> dict[str, dict]:
+        """
+        Find entries matching every given filter
+        :param title: Words that must start words of the title, e.g. "revue star"
+        :param audio: Languages that must all be available as audio
+        :param subtitles: Languages that must all be available as subtitles
+        :param external: External IDs by site, e.g. {'myanimelist': '21'}
+        :param limit: The most entries to return
+        :return: Information on the matching entries by ID, best title match first
+        """
+        sql = "SELECT entries.id, entries.data FROM entries"
+        where = []
+        params = []
+
+        if title:
+            # Quote every word so that user input can't be read as FTS syntax
+            terms = ' '.join('"%s"*' % word.replace('"', '""') for word in title.split())
+
+            sql += " JOIN titles ON titles.id = entries.id"
+            where.append("titles MATCH ?")
+            params.append(terms)
+
+        for kind, languages in (('audio', audio), ('subtitles', subtitles)):
+            for language in languages:
+                where.append("entries.id IN (SELECT id FROM languages WHERE kind = ? AND language = ?)")
+                params += [kind, language.casefold()]
+
+        for site, _id in (external or {}).items():
+            where.append("entries.id IN (SELECT id FROM externals WHERE site = ? AND external_id = ?)")
+            params += [site, str(_id)]
+
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+
+        sql += " ORDER BY titles.rank" if title else " ORDER BY entries.title"
+
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+
+        return {_id: json.loads(data) for _id, data in rows}
+
+    def search(self, text: str, limit: int = None) -> dict[str, dict]:
+        """
+        Find entries matching a query like "japanese audio and english subs", see parse_query()
+        """
+        return self.query(**parse_query(text), limit=limit)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,10 +1,19 @@
 import requests
 import urllib3
 import hashlib
-import keyring
-import io
+import time
+import contextvars
 
-from typing import Optional
+from typing import Optional, Callable
+from functools import partial
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import MetadataCache
+from archive_index import ArchiveIndex, parse_query
+from sync import CatalogSnapshot, CatalogSync
+from uploads import MultipartBody, ResumableUpload, UploadSource
+from transport import Transport, IDEMPOTENT_METHODS
 
 # Metadata
 __version__ = "1.0"
@@ -15,6 +24,7 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # Helper Exceptions
 class APIKeyError(ValueError): """The API key is invalid or hasn't been set"""
 class ServerNameError(ValueError): """The server hasn't been set"""
+class OfflineError(requests.ConnectionError): """The request needs the server, but the wrapper is offline"""
 
 # User information helpers
 def get_user_id(api_key: str) -> int:
@@ -29,17 +39,30 @@ def get_user_id(api_key: str) -> int:
         base=16
     )
 
-def get_user_info(base_url: str, user_id: int) -> Optional[dict]:
+def get_user_info(base_url: str, user_id: int, session: requests.Session = None, timeout: float = None) -> Optional[dict]:
     """
     Get information on a user
+    :param session: An optional session to reuse pooled connections from
+    :param timeout: How many seconds to wait for the server before giving up
     :return: If user exists then return a dict, else None.
     """
+    if session is None:
+        # A one-off session, so the request still gets a timeout, retries and a circuit breaker
+        with requests.Session() as session:
+            session.mount('http://', Transport())
+            session.mount('https://', Transport())
+
+            return get_user_info(base_url, user_id, session, timeout)
+
     url = f"{base_url}/user/{user_id}"
-    r = requests.get(url, verify=False)
+    r = session.get(url, verify=False, timeout=timeout)
 
-    if r.status_code == 404:
+    # The key doesn't point to a user, or isn't accepted
+    if r.status_code in (401, 403, 404):
         return None
 
+    r.raise_for_status()
+
     return r.json()
 
 
@@ -48,7 +71,25 @@ class Breadbox:
     SERVER = None
     SERVICE_NAME = 'Breadbox'
 
-    def __init__(self, base_url_override: str = None, api_key_override: str = None):
+    def __init__(
+            self,
+            base_url_override: str = None,
+            api_key_override: str = None,
+            pool_size: int = 10,
+            keep_alive: bool = True,
+            cache_folder: Path = None,
+            timeout: float | tuple[float, float] = (5, 30),
+            retries: int = 3
+    ):
+        """
+        :param base_url_override: Use this server instead of Breadbox.SERVER
+        :param api_key_override: Use this API key instead of the one in the system keyring
+        :param pool_size: The maximum number of connections kept open to the server
+        :param keep_alive: If false, connections are closed after every request
+        :param cache_folder: If set, archive metadata is cached in this folder
+        :param timeout: How many seconds to wait for the server: to connect and between bytes, or (connect, read)
+        :param retries: How many times a request that failed on the way is tried again
+        """
         if base_url_override:
             self.base_url = base_url_override
         elif Breadbox.SERVER:
@@ -60,12 +101,45 @@ class Breadbox:
         if api_key_override:
             self.api_key = api_key_override
         else:
+            # Imported here because finding a keyring backend is slow, and not needed with an API key override
+            import keyring
+
             self.api_key = keyring.get_password(Breadbox.SERVICE_NAME, 'ApiKey')
             if not self.api_key:
                 raise APIKeyError("You need to set an API key")
 
         self.user_id = get_user_id(self.api_key)
 
+        # Set up a long-lived requests session for Breadbox
+        self.session = requests.Session()
+        self.session.verify = False  # Disabled because Breadbox's certificate is self-signed.
+        self.session.headers.update({'X-API-KEY': self.api_key})
+
+        if not keep_alive:
+            self.session.headers.update({'Connection': 'close'})
+
+        # Pool connections so that every request doesn't pay for a new TCP and TLS handshake,
+        # and give up on a server that's down instead of waiting for it forever.
+        # Metadata patches set fields to the values given, so sending one twice is harmless.
+        adapter = Transport(
+            timeout=timeout,
+            retries=retries,
+            methods=IDEMPOTENT_METHODS | {'PATCH'},
+            pool_connections=1,
+            pool_maxsize=pool_size
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.pool_size = pool_size
+
+        # While offline, metadata is served from the cache however old it is, and nothing else is requested
+        self.offline = False
+
+        # Set up the metadata cache
+        self.cache_folder = Path(cache_folder) if cache_folder else None
+        self.cache = MetadataCache(cache_folder) if cache_folder else None
+
         self.anime = _AnimeArchive(self)
         #self.games = _GamesArchive(self)
         #self.linux = _LinuxArchive(self)
@@ -78,10 +152,8 @@ class Breadbox:
         Useful for interfacing with VLC.
         :return:
         """
-        # Set up a requests session for Breadbox
-        s = requests.Session()
-        s.verify = False  # Disabled because Breadbox's certificate is self-signed.
-        s.headers.update({'X-API-KEY': self.api_key})
+        if self.offline:
+            raise OfflineError(f"{relative_url} isn't available offline")
 
         # Build URL
         url = self.base_url + relative_url
@@ -90,7 +162,7 @@ class Breadbox:
             url += '?signUrl'
 
         # Return the get request
-        return s.get(url, **kwargs)
+        return self.session.get(url, **kwargs)
 
     def patch(self, relative_url, data: dict, **kwargs):
         """
@@ -100,56 +172,83 @@ class Breadbox:
         :return:
         """
 
-        # Set up a requests session for Breadbox
-        s = requests.Session()
-        s.verify = False  # Disabled because Breadbox's certificate is self-signed.
-        s.headers.update({'X-API-KEY': self.api_key})
-
         # Build URL
         url = self.base_url + relative_url
 
         # Return the patch request
-        return s.patch(url, json=data, **kwargs)
+        return self.session.patch(url, json=data, **kwargs)
 
-    def upload(self, relative_url, content: bytes, filename: str, mimetype: str, **kwargs):
+    def upload(self, relative_url, content: UploadSource, filename: str, mimetype: str, size: int = None, **kwargs):
         """
-        Uploads a file to breadbox.
+        Uploads a file to breadbox. The file is streamed, so only a small piece of it is in memory at a time.
         :param relative_url: The URL relative to breadbox
-        :param content: The file content to upload
+        :param content: The file content to upload: bytes, a file path, a binary file object or an iterable of bytes
         :param filename: The name of the file
         :param mimetype: The mimetype of the file
+        :param size: The content's size, if it can't be worked out (i.e. for iterables); otherwise it's sent chunked
         :return:
         """
 
-        # Set up a requests session for Breadbox
-        s = requests.Session()
-        s.verify = False  # Disabled because Breadbox's certificate is self-signed.
-        s.headers.update({'X-API-KEY': self.api_key})
-
         # Build URL
         url = self.base_url + relative_url
 
-        # IO
-        file = io.BytesIO(content)
+        # Stream the multipart body instead of building it in memory
+        body = MultipartBody('file', filename, content, mimetype, size=size)
+        headers = {**kwargs.pop('headers', {}), 'Content-Type': body.content_type}
 
-        # Return the put request
-        return s.put(url, files={'file': (filename, file, mimetype)}, **kwargs)
+        try:
+            # Return the put request
+            return self.session.put(url, data=body if body.length is not None else iter(body), headers=headers, **kwargs)
+        finally:
+            body.close()
 
-    def user_info(self) -> Optional[dict]:
+    def upload_resumable(self, relative_url, file: str | Path, mimetype: str, **kwargs) -> requests.Response:
+        """
+        Uploads a large file to breadbox in pieces, resuming after interruptions, see ResumableUpload.
+        The server has to support Content-Range uploads.
+        :param relative_url: The URL relative to breadbox
+        :param file: The path of the file to upload
+        :param mimetype: The mimetype of the file
+        :param kwargs: Passed on to ResumableUpload, e.g. chunk_size, progress, cancel and resume
+        :return: The server's response to the last piece
+        """
+        url = self.base_url + relative_url
+
+        return ResumableUpload(partial(self.session.put, url), file, mimetype, **kwargs).upload()
+
+    def user_info(self, timeout: float = None) -> Optional[dict]:
         """
         Get information on your user
+        :param timeout: How many seconds to wait for the server before giving up
         :return: If user exists then return a dict, else None.
         """
         return get_user_info(
             base_url=self.base_url,
-            user_id=self.user_id
+            user_id=self.user_id,
+            session=self.session,
+            timeout=timeout
         )
 
+    def close(self):
+        """
+        Close the session and every pooled connection.
+        """
+        self.session.close()
+        self.anime.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
     @staticmethod
     def login(api_key: str):
         """
         Set the API key stored in the system keyring.
         """
+        import keyring
+
         keyring.set_password(
             service_name=Breadbox.SERVICE_NAME,
             username='ApiKey',
@@ -161,68 +260,304 @@ class Breadbox:
         """
         Delete the API key from the system keyring.
         """
+        import keyring
+
         keyring.delete_password(
             service_name=Breadbox.SERVICE_NAME,
             username='ApiKey'
         )
 
     @staticmethod
-    def check_key(api_key: str) -> bool:
+    def check_key(api_key: str, timeout: float | tuple[float, float] = (5, 30)) -> bool:
         """
         Check if an API key actually points to a user.
+        :param timeout: How many seconds to wait for the server: to connect and between bytes, or (connect, read)
         """
         if not api_key:
             return False
-        elif get_user_info(Breadbox.SERVER, get_user_id(api_key)):
-            return True
-        else:
-            return False
+
+        # A temporary wrapper, so the check goes through the same timeouts and retries as everything else
+        with Breadbox(api_key_override=api_key, pool_size=1, timeout=timeout) as breadbox:
+            return breadbox.user_info() is not None
 
 
 # Abstract archive wrapper
 class _AbstractArchive:
+    # How many seconds a cached response from each endpoint stays fresh
+    CACHE_TTL = {
+        'ids': 60,
+        'size': 60,
+        'all': 300,
+        'info': 3600,
+    }
+
+    # How many seconds the local snapshot of the listing is trusted before it's synced
+    SYNC_INTERVAL = 60
+
     def __init__(self, breadbox: Breadbox, name: str):
         self.breadbox = breadbox
+        self.name = name
         self.url_prefix = '/archive/' + name
 
+        self._sync: Optional[CatalogSync] = None
+
+    def local_file(self, suffix: str) -> Optional[Path]:
+        """
+        A file for storing this archive's data locally, next to the metadata cache
+        :return: The path, or None if there's no cache folder
+        """
+        if folder := self.breadbox.cache_folder:
+            # Different servers have different archives
+            server = hashlib.sha256(self.breadbox.base_url.encode()).hexdigest()[:12]
+            return folder / f'{self.name}-{server}{suffix}'
+
+        return None
+
+    @property
+    def sync(self) -> CatalogSync:
+        """Keeps a local snapshot of the listing up to date"""
+        if self._sync is None:
+            self._sync = CatalogSync(
+                self,
+                CatalogSnapshot(self.local_file('.json.gz')),
+                workers=self.breadbox.pool_size,
+                max_age=self.SYNC_INTERVAL
+            )
+
+        return self._sync
+
     def fetch(self, relative_url: str, sign_url: bool = False, **kwargs):
         return self.breadbox.fetch(self.url_prefix + relative_url, sign_url, **kwargs)
 
+    def fetch_json(self, relative_url: str, endpoint: str, fresh: bool = False, strict: bool = False):
+        """
+        Gets JSON from the archive, going through the metadata cache if there is one.
+        Stale entries are revalidated with a conditional request, so unchanged data costs a 304.
+        :param relative_url: The URL relative to the archive
+        :param endpoint: The key in CACHE_TTL that decides how long the response stays fresh
+        :param fresh: Revalidate the cached response even if it's still fresh, e.g. before changing the entry.
+                      The cache is never used in place of the server, so errors are raised instead.
+        :param strict: Raise for error responses, e.g. for an unknown ID, instead of returning the error's JSON
+        :return:
+        """
+        cache = self.breadbox.cache
+
+        if cache is None:
+            r = self.fetch(relative_url)
+
+            # An error page isn't the entry, and a fresh copy is wanted to decide what to change
+            if (fresh and r.status_code >= 500) or strict:
+                r.raise_for_status()
+
+            return r.json()
+
+        url = self.breadbox.base_url + self.url_prefix + relative_url
+        entry = cache.get(url)
+
+        # Old data beats no data when there's no connection
+        if entry and not fresh and (self.breadbox.offline or entry.age < self.CACHE_TTL.get(endpoint, 0)):
+            return entry.data
+
+        try:
+            r = self.fetch(relative_url, headers=entry.validators() if entry else None)
+        except (requests.ConnectionError, requests.Timeout):
+            # The same goes for when the server is down
+            if entry and not fresh:
+                return entry.data
+
+            raise
+
+        if r.status_code == 304 and entry:
+            cache.touch(url)
+            return entry.data
+
+        if r.status_code >= 500:
+            if entry and not fresh:
+                return entry.data
+
+            if fresh:
+                r.raise_for_status()
+
+        if strict:
+            r.raise_for_status()
+
+        data = r.json()
+
+        if r.ok:
+            cache.put(url, data, r.headers.get('ETag'), r.headers.get('Last-Modified'))
+
+        return data
+
+    def cached(self, relative_url: str, endpoint: str):
+        """
+        Get JSON from the metadata cache without making any requests
+        :return: The cached data if it's still fresh, else None.
+        """
+        if cache := self.breadbox.cache:
+            entry = cache.get(self.breadbox.base_url + self.url_prefix + relative_url)
+
+            if entry and entry.age < self.CACHE_TTL.get(endpoint, 0):
+                return entry.data
+
+        return None
+
+    def invalidate(self, relative_url: str):
+        """
+        Drop cached responses that a change to relative_url would make outdated.
+        """
+        if cache := self.breadbox.cache:
+            cache.invalidate_entry(self.breadbox.base_url + self.url_prefix, relative_url)
+
+        # Have the snapshot fetch the entry again
+        if self._sync is not None:
+            self._sync.forget(relative_url.strip('/').split('/')[0])
+
     def patch(self, relative_url: str, data: dict, **kwargs):
+        self.invalidate(relative_url)
         return self.breadbox.patch(self.url_prefix + relative_url, data, **kwargs)
 
-    def upload(self, relative_url: str, content: bytes, filename: str, mimetype: str, **kwargs):
+    def upload(self, relative_url: str, content: UploadSource, filename: str, mimetype: str, **kwargs):
         return self.breadbox.upload(self.url_prefix + relative_url, content, filename, mimetype, **kwargs)
 
-    def list_ids(self):
-        return self.fetch('/').json()
+    def upload_resumable(self, relative_url: str, file: str | Path, mimetype: str, **kwargs):
+        return self.breadbox.upload_resumable(self.url_prefix + relative_url, file, mimetype, **kwargs)
+
+    def list_ids(self, fresh: bool = False):
+        return self.fetch_json('/', 'ids', fresh)
 
     # noinspection PyShadowingBuiltins
-    def info(self, id: int):
-        return self.fetch('/' + str(id)).json()
+    def info(self, id: int, fresh: bool = False, strict: bool = False):
+        return self.fetch_json('/' + str(id), 'info', fresh, strict)
+
+    def all_info(self, fresh: bool = False):
+        return self.fetch_json('/all', 'all', fresh)
+
+    def size(self, fresh: bool = False):
+        return self.fetch_json('/size', 'size', fresh)
+
+    def changes(self, since: float | str) -> Optional[dict]:
+        """
+        Ask the server which entries changed since a point in time
+        :param since: A Unix timestamp by the server's clock, or a cursor from an earlier response
+        :return: {'changed': [IDs], 'removed': [IDs]} and optionally the 'cursor' to ask from next time,
+                 or None if the server has no changes endpoint
+        """
+        r = self.fetch('/changes', params={'since': since if isinstance(since, str) else int(since)})
+
+        if r.status_code in (400, 404, 405, 422, 501):
+            return None
+
+        r.raise_for_status()
+
+        return r.json()
+
+    def catalog(self, force: bool = False) -> dict:
+        """
+        Information on every entry, like all_info(), but kept up to date by fetching only what changed
+        :param force: Check the archive for changes even if the snapshot was synced recently
+        """
+        if self.breadbox.offline:
+            return self.sync.snapshot.entries or self.all_info()
 
-    def all_info(self):
-        return self.fetch('/all').json()
+        return self.sync.refresh(force)
 
-    def size(self):
-        return self.fetch('/size').json()
+    def close(self):
+        """Release anything the archive keeps open."""
 
 
 # Populated archive wrappers
 
 # noinspection PyShadowingBuiltins
 class _AnimeArchive(_AbstractArchive):
+    CACHE_TTL = _AbstractArchive.CACHE_TTL | {
+        'media': 600,
+    }
+
+    # The info fields an anime's screen needs; if the full listing has them, info() is skipped
+    OVERVIEW_FIELDS = ('title', 'external')
+
     def __init__(self, breadbox: Breadbox):
         super().__init__(breadbox, 'anime')
 
-    def list_media(self, id):
-        return self.fetch('/' + str(id) + '/media').json()
+        self._index: Optional[ArchiveIndex] = None
+
+    @property
+    def index(self) -> ArchiveIndex:
+        """
+        The local search index, kept next to the metadata cache (or in memory without one).
+        It's only opened when it's first needed.
+        """
+        if self._index is None:
+            self._index = ArchiveIndex(self.local_file('.sqlite') or ':memory:')
+
+        return self._index
+
+    def invalidate(self, relative_url: str):
+        super().invalidate(relative_url)
+
+        if self._index is not None:
+            self._index.expire()
+
+    def refresh_index(self, force: bool = False):
+        """
+        Sync the local index with the catalog snapshot if it's older than the full listing's cache lifetime.
+        Only entries that changed are rewritten.
+        """
+        if self.breadbox.offline:
+            return
+
+        if force or time.time() - self.index.synced > self.CACHE_TTL['all']:
+            self.index.sync(self.catalog(force))
+
+    def query(self, text: str = '', limit: int = None, **filters) -> dict:
+        """
+        Search the archive locally, e.g. query("japanese audio and english subs")
+        :param text: A query, see archive_index.parse_query
+        :param filters: Overrides for the parsed query: title, audio, subtitles or external
+        :return: Information on the matching anime by ID
+        """
+        self.refresh_index()
+        return self.index.query(**(parse_query(text) | filters), limit=limit)
+
+    def list_media(self, id, strict: bool = False):
+        return self.fetch_json('/' + str(id) + '/media', 'media', strict=strict)
+
+    def overview(self, id, episode_titles: Callable[[dict], dict] = None) -> dict:
+        """
+        Gather everything an anime's screen needs with as few sequential round-trips as possible.
+        The media list is fetched concurrently with the info, and the episode titles as soon as the info is known.
+        :param episode_titles: Given the anime's info, returns its episode titles, e.g. from Jikan
+        :return: A dict with the anime's 'info', 'media' and 'episodes' (empty if episode_titles isn't set)
+        """
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            # In the caller's context, so the request counts wherever the caller is measuring, see transport.measure()
+            media = pool.submit(contextvars.copy_context().run, self.list_media, id)
+
+            # Reuse the full listing if it's cached and has everything we need
+            listing = self.cached('/all', 'all') or (self._sync.snapshot.entries if self._sync else {})
+            info = listing.get(str(id))
+
+            if not info or any(field not in info for field in self.OVERVIEW_FIELDS):
+                info = self.info(id)
+
+            episodes = episode_titles(info) if episode_titles else {}
+
+            return {
+                'info': info,
+                'media': media.result(),
+                'episodes': episodes
+            }
 
     def get_media_url(self, id, media):
         return self.breadbox.base_url + self.fetch('/' + str(id) + '/media/' + str(media), sign_url=True).json()['url']
 
-    def download_media(self, id, media):
-        return self.fetch('/' + str(id) + '/media/' + str(media), stream=True)
+    def download_media(self, id, media, **kwargs):
+        return self.fetch('/' + str(id) + '/media/' + str(media), stream=True, **kwargs)
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
 
 # noinspection PyShadowingBuiltins
 class _LinuxArchive(_AbstractArchive):
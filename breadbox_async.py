@@ -0,0 +1,382 @@
+"""
+An asyncio counterpart to the Breadbox wrapper, for fanning out many requests at once
+"""
+
+import asyncio
+import aiohttp
+
+from pathlib import Path
+from typing import Optional, AsyncIterator
+from urllib.parse import urlsplit
+
+from cache import MetadataCache
+from breadbox import Breadbox, APIKeyError, ServerNameError, get_user_id, _AbstractArchive, _AnimeArchive
+from transport import CircuitBreaker, RETRY_STATUSES, backoff_delay, retry_after
+from uploads import UploadSource, open_source
+
+
+# Helper Exceptions
+class CircuitOpenError(aiohttp.ClientConnectionError): """The host kept failing, so requests to it fail fast for a while"""
+
+
+# Failures that say the host is unreachable or stopped answering, before or in the middle of a response
+NETWORK_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+
+class AsyncBreadbox:
+    """
+    The same surface as Breadbox, built on aiohttp.
+
+    Use it as an async context manager:
+        async with AsyncBreadbox() as breadbox:
+            infos = await breadbox.anime.info_many(await breadbox.anime.list_ids())
+    """
+    def __init__(
+            self,
+            base_url_override: str = None,
+            api_key_override: str = None,
+            pool_size: int = 10,
+            keep_alive: bool = True,
+            max_concurrency: int = 32,
+            cache_folder: Path = None,
+            timeout: float | tuple[float, float] = (5, 30),
+            retries: int = 3,
+            backoff: float = 0.5,
+            max_wait: float = 60
+    ):
+        """
+        :param base_url_override: Use this server instead of Breadbox.SERVER
+        :param api_key_override: Use this API key instead of the one in the system keyring
+        :param pool_size: The maximum number of connections kept open to the server
+        :param keep_alive: If false, connections are closed after every request
+        :param max_concurrency: The maximum number of requests in flight at once
+        :param cache_folder: If set, archive metadata is cached in this folder
+        :param timeout: How many seconds to wait for the server: to connect and between bytes, or (connect, read)
+        :param retries: How many times a request that failed on the way is tried again
+        :param backoff: The longest wait after the first failure; it doubles with every retry
+        :param max_wait: The longest wait between retries, in seconds
+        """
+        if base_url_override:
+            self.base_url = base_url_override
+        elif Breadbox.SERVER:
+            self.base_url = Breadbox.SERVER
+        else:
+            raise ServerNameError("You need to set a server")
+
+        if api_key_override:
+            self.api_key = api_key_override
+        else:
+            # Imported here because finding a keyring backend is slow, and not needed with an API key override
+            import keyring
+
+            self.api_key = keyring.get_password(Breadbox.SERVICE_NAME, 'ApiKey')
+            if not self.api_key:
+                raise APIKeyError("You need to set an API key")
+
+        self.user_id = get_user_id(self.api_key)
+
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.cache = MetadataCache(cache_folder) if cache_folder else None
+
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+
+        # Like the blocking wrapper's Transport, stop sending anything to a host that keeps failing
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+        # aiohttp sessions have to be created inside a running event loop
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        self.anime = _AsyncAnimeArchive(self)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                headers={'X-API-KEY': self.api_key},
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(
+                    limit=self.pool_size,
+                    ssl=False,  # Disabled because Breadbox's certificate is self-signed.
+                    force_close=not self.keep_alive
+                )
+            )
+
+        return self._session
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """The circuit breaker for a URL's host"""
+        host = urlsplit(url).netloc
+
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker()
+
+        return self.breakers[host]
+
+    def allow(self, url: str) -> CircuitBreaker:
+        """
+        Get the circuit breaker for a request
+        :raises CircuitOpenError: If the host is refusing requests for now
+        """
+        breaker = self.breaker(url)
+
+        if not breaker.allow():
+            raise CircuitOpenError(f"{urlsplit(url).netloc} isn't responding, trying again in {breaker.retry_in():.0f}s")
+
+        return breaker
+
+    async def request(self, method: str, url: str, retry: bool = True, **kwargs) -> aiohttp.ClientResponse:
+        """
+        Send a request and read its body, trying again after network errors and RETRY_STATUSES
+        :param retry: Whether the request is safe to send again; bodies that are streamed from a file aren't
+        :return: The response, with its body already read
+        """
+        retries = self.retries if retry else 0
+        attempt = 0
+
+        while True:
+            breaker = self.allow(url)
+
+            try:
+                async with self.semaphore:
+                    async with self.session.request(method, url, **kwargs) as r:
+                        await r.read()
+            except NETWORK_ERRORS:
+                breaker.failure()
+
+                if attempt >= retries:
+                    raise
+
+                wait = backoff_delay(attempt, self.backoff, self.max_wait)
+            except BaseException:
+                # E.g. cancellation, which says nothing about the host but mustn't leave it blocked
+                breaker.release()
+                raise
+            else:
+                # Rate limiting and client errors don't mean the host is down
+                if r.status >= 500:
+                    breaker.failure()
+                else:
+                    breaker.success()
+
+                if r.status not in RETRY_STATUSES or attempt >= retries:
+                    return r
+
+                wait = retry_after(r)
+
+                if wait is None:
+                    wait = backoff_delay(attempt, self.backoff, self.max_wait)
+                elif wait > self.max_wait:
+                    return r
+
+            await asyncio.sleep(wait)
+            attempt += 1
+
+    async def fetch(self, relative_url, sign_url: bool = False, **kwargs) -> aiohttp.ClientResponse:
+        """
+        Gets information or images from Breadbox
+        :param relative_url: The URL relative to breadbox
+        :param sign_url: If true, return a signed URL pointing to the content instead of the content itself.
+        :return: The response, with its body already read
+        """
+        url = self.base_url + relative_url
+
+        if sign_url:
+            url += '?signUrl'
+
+        return await self.request('GET', url, **kwargs)
+
+    async def stream(self, relative_url, chunk_size: int = 1024 * 1024, **kwargs) -> AsyncIterator[bytes]:
+        """
+        Streams media from Breadbox without loading it into memory
+        :param relative_url: The URL relative to breadbox
+        :param chunk_size: How many bytes are yielded at a time
+        """
+        url = self.base_url + relative_url
+        breaker = self.allow(url)
+
+        # Not retried, since part of the file may already have been handed to the caller
+        try:
+            async with self.semaphore:
+                async with self.session.get(url, **kwargs) as r:
+                    if r.status >= 500:
+                        breaker.failure()
+                    else:
+                        breaker.success()
+
+                    r.raise_for_status()
+
+                    async for chunk in r.content.iter_chunked(chunk_size):
+                        yield chunk
+        except NETWORK_ERRORS:
+            breaker.failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+
+    async def patch(self, relative_url, data: dict, **kwargs) -> aiohttp.ClientResponse:
+        """
+        Uploads information to breadbox.
+        :param relative_url: The URL relative to breadbox
+        :param data: The data to upload
+        :return: The response, with its body already read
+        """
+        # Metadata patches set fields to the values given, so sending one twice is harmless
+        return await self.request('PATCH', self.base_url + relative_url, json=data, **kwargs)
+
+    async def upload(self, relative_url, content: UploadSource, filename: str, mimetype: str, **kwargs) -> aiohttp.ClientResponse:
+        """
+        Uploads a file to breadbox. File contents are streamed, not read into memory first.
+        :param relative_url: The URL relative to breadbox
+        :param content: The file content to upload: bytes, a file path, a binary file object or an iterable of bytes
+        :param filename: The name of the file
+        :param mimetype: The mimetype of the file
+        :return: The response, with its body already read
+        """
+        file, _, owned = open_source(content)
+
+        form = aiohttp.FormData()
+        form.add_field('file', file, filename=filename, content_type=mimetype)
+
+        try:
+            return await self.request('PUT', self.base_url + relative_url, retry=False, data=form, **kwargs)
+        finally:
+            if owned:
+                file.close()
+
+    async def user_info(self) -> Optional[dict]:
+        """
+        Get information on your user
+        :return: If user exists then return a dict, else None.
+        """
+        r = await self.fetch(f'/user/{self.user_id}')
+
+        # The key doesn't point to a user, or isn't accepted
+        if r.status in (401, 403, 404):
+            return None
+
+        r.raise_for_status()
+
+        return await r.json(content_type=None)
+
+    async def close(self):
+        """
+        Close the session and every pooled connection.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+
+# Abstract archive wrapper
+class _AsyncAbstractArchive:
+    CACHE_TTL = _AbstractArchive.CACHE_TTL
+
+    def __init__(self, breadbox: AsyncBreadbox, name: str):
+        self.breadbox = breadbox
+        self.url_prefix = '/archive/' + name
+
+    async def fetch(self, relative_url: str, sign_url: bool = False, **kwargs):
+        return await self.breadbox.fetch(self.url_prefix + relative_url, sign_url, **kwargs)
+
+    async def fetch_json(self, relative_url: str, endpoint: str):
+        """
+        Gets JSON from the archive, going through the metadata cache if there is one.
+        Stale entries are revalidated with a conditional request, so unchanged data costs a 304.
+        The cache lives in files, so it's read and written in a thread to keep the event loop free.
+        """
+        cache = self.breadbox.cache
+
+        if cache is None:
+            return await (await self.fetch(relative_url)).json(content_type=None)
+
+        url = self.breadbox.base_url + self.url_prefix + relative_url
+        entry = await asyncio.to_thread(cache.get, url)
+
+        if entry and entry.age < self.CACHE_TTL.get(endpoint, 0):
+            return entry.data
+
+        r = await self.fetch(relative_url, headers=entry.validators() if entry else None)
+
+        if r.status == 304 and entry:
+            await asyncio.to_thread(cache.touch, url)
+            return entry.data
+
+        data = await r.json(content_type=None)
+
+        if r.ok:
+            await asyncio.to_thread(cache.put, url, data, r.headers.get('ETag'), r.headers.get('Last-Modified'))
+
+        return data
+
+    async def invalidate(self, relative_url: str):
+        """
+        Drop cached responses that a change to relative_url would make outdated.
+        The cache lives in files, so it's done in a thread.
+        """
+        if cache := self.breadbox.cache:
+            await asyncio.to_thread(cache.invalidate_entry, self.breadbox.base_url + self.url_prefix, relative_url)
+
+    async def patch(self, relative_url: str, data: dict, **kwargs):
+        await self.invalidate(relative_url)
+        return await self.breadbox.patch(self.url_prefix + relative_url, data, **kwargs)
+
+    async def upload(self, relative_url: str, content: UploadSource, filename: str, mimetype: str, **kwargs):
+        return await self.breadbox.upload(self.url_prefix + relative_url, content, filename, mimetype, **kwargs)
+
+    async def list_ids(self):
+        return await self.fetch_json('/', 'ids')
+
+    # noinspection PyShadowingBuiltins
+    async def info(self, id: int):
+        return await self.fetch_json('/' + str(id), 'info')
+
+    async def info_many(self, ids) -> dict:
+        """
+        Get information on many entries at once
+        :return: A dict mapping each ID to its information
+        """
+        ids = list(ids)
+        return dict(zip(ids, await asyncio.gather(*(self.info(_id) for _id in ids))))
+
+    async def all_info(self):
+        return await self.fetch_json('/all', 'all')
+
+    async def size(self):
+        return await self.fetch_json('/size', 'size')
+
+
+# Populated archive wrappers
+
+# noinspection PyShadowingBuiltins
+class _AsyncAnimeArchive(_AsyncAbstractArchive):
+    CACHE_TTL = _AnimeArchive.CACHE_TTL
+
+    def __init__(self, breadbox: AsyncBreadbox):
+        super().__init__(breadbox, 'anime')
+
+    async def list_media(self, id):
+        return await self.fetch_json('/' + str(id) + '/media', 'media')
+
+    async def get_media_url(self, id, media):
+        r = await self.fetch('/' + str(id) + '/media/' + str(media), sign_url=True)
+        return self.breadbox.base_url + (await r.json(content_type=None))['url']
+
+    def download_media(self, id, media, chunk_size: int = 1024 * 1024, **kwargs) -> AsyncIterator[bytes]:
+        """
+        Stream an episode or bonus file
+            async for chunk in breadbox.anime.download_media(12, 1): ...
+        """
+        return self.breadbox.stream(self.url_prefix + '/' + str(id) + '/media/' + str(media), chunk_size, **kwargs)
@@ -0,0 +1,135 @@
+"""
+A small persistent cache for metadata fetched from Breadbox
+"""
+
+import json
+import time
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+
+class CacheEntry:
+    """
+    A single cached response
+    """
+    def __init__(self, url: str, data, etag: str = None, last_modified: str = None, stored: float = None):
+        self.url = url
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored = stored if stored is not None else time.time()
+
+    @property
+    def age(self) -> float:
+        """How many seconds ago the entry was stored or last revalidated."""
+        return time.time() - self.stored
+
+    def validators(self) -> dict:
+        """Headers for revalidating the entry with a conditional request."""
+        headers = {}
+
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        return headers
+
+    def to_dict(self) -> dict:
+        return {
+            'url': self.url,
+            'data': self.data,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'stored': self.stored
+        }
+
+
+class MetadataCache:
+    """
+    Cached JSON responses keyed by URL, kept in memory and mirrored to disk.
+    """
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        self.entries: dict[str, CacheEntry] = {}
+
+    def path(self, url: str) -> Path:
+        """The file that an entry for this URL is stored in."""
+        return self.folder / (hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """
+        Look up a cached response
+        :return: The entry if one exists (fresh or not), else None.
+        """
+        if url in self.entries:
+            return self.entries[url]
+
+        try:
+            with open(self.path(url), 'r') as f:
+                entry = CacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+        self.entries[url] = entry
+        return entry
+
+    def put(self, url: str, data, etag: str = None, last_modified: str = None) -> CacheEntry:
+        """
+        Store a response
+        """
+        entry = CacheEntry(url, data, etag, last_modified)
+        self.entries[url] = entry
+        self.save(entry)
+        return entry
+
+    def touch(self, url: str):
+        """
+        Mark an entry as fresh again, i.e. after the server answered 304 Not Modified.
+        """
+        if entry := self.get(url):
+            entry.stored = time.time()
+            self.save(entry)
+
+    def invalidate(self, url: str):
+        """
+        Forget a cached response
+        """
+        self.entries.pop(url, None)
+        self.path(url).unlink(missing_ok=True)
+
+    def invalidate_entry(self, archive_url: str, relative_url: str):
+        """
+        Forget the cached responses that a change to an archive entry makes outdated:
+        the entry's own, and the listings that include it
+        :param archive_url: The archive's URL, e.g. https://api.example.com/archive/anime
+        :param relative_url: The changed entry's URL relative to the archive
+        """
+        for _url in (relative_url, '/all', '/', '/size'):
+            self.invalidate(archive_url + _url)
+
+    def clear(self):
+        """
+        Forget every cached response
+        """
+        self.entries.clear()
+
+        if self.folder.is_dir():
+            for fil in self.folder.glob('*.json'):
+                fil.unlink(missing_ok=True)
+
+    def save(self, entry: CacheEntry):
+        # Create the cache folder if it doesn't exist
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first so a crash never leaves a half-written entry behind.
+        # Its name is unique, since prefetching and the UI can save the same URL at the same time.
+        path = self.path(entry.url)
+
+        with tempfile.NamedTemporaryFile('w', dir=self.folder, suffix='.tmp', delete=False) as f:
+            json.dump(entry.to_dict(), f)
+
+        Path(f.name).replace(path)
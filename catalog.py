@@ -0,0 +1,130 @@
+"""
+An in-memory search index over the archive's catalog, fast enough to filter on every keystroke
+"""
+
+import re
+import unicodedata
+
+from collections import Counter
+
+
+def normalize(text: str) -> str:
+    """
+    Reduce a title to lowercase letters and digits separated by single spaces,
+    so "Shōjo  Kageki: Revue" and "shojo kageki revue" compare equal.
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+
+    return ' '.join(re.split(r'[\W_]+', text.casefold())).strip()
+
+
+def trigrams(text: str) -> set[str]:
+    """Every three character slice of a normalized string, padded so word starts count extra"""
+    text = f'  {text} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CatalogIndex:
+    """
+    Ranks anime by how well their titles match a query.
+
+    Matches are ranked, best first:
+        the whole title, the start of the title, the start of every query word,
+        anywhere in the title, and finally titles sharing most of the query's trigrams (typos).
+    """
+    EXACT, PREFIX, WORDS, SUBSTRING, FUZZY = range(5)
+
+    # How many of the query's trigrams a title needs to count as a fuzzy match
+    FUZZY_THRESHOLD = 0.5
+
+    # Queries shorter than this scan every title, since they have too few trigrams to narrow anything down
+    SCAN_BELOW = 4
+
+    def __init__(self, catalog: dict[str, dict]):
+        """
+        :param catalog: Information on every anime by ID, as returned by all_info()
+        """
+        self.catalog = catalog
+
+        self.ids = list(catalog)
+        self.titles = [catalog[_id]['title'] for _id in self.ids]
+        self.normalized = [normalize(title) for title in self.titles]
+        self.words = [title.split() for title in self.normalized]
+
+        # Trigram -> the positions of every title containing it
+        self.postings: dict[str, list[int]] = {}
+
+        for n, title in enumerate(self.normalized):
+            for gram in trigrams(title):
+                self.postings.setdefault(gram, []).append(n)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _tier(self, n: int, query: str, query_words: list[str]) -> int | None:
+        """How well a title matches, or None if it doesn't"""
+        title = self.normalized[n]
+
+        # Every tier needs every query word somewhere in the title, which is quick to rule out
+        if not all(q in title for q in query_words):
+            return None
+
+        if title == query:
+            return self.EXACT
+        if title.startswith(query):
+            return self.PREFIX
+        if all(any(word.startswith(q) for word in self.words[n]) for q in query_words):
+            return self.WORDS
+        if query in title:
+            return self.SUBSTRING
+
+        return None
+
+    def search(self, query: str, limit: int = None) -> list[str]:
+        """
+        Find the anime matching a query
+        :param limit: The most results to return, or None for all of them
+        :return: Anime IDs, best match first. An empty query matches everything, in catalog order.
+        """
+        query = normalize(query)
+
+        if not query:
+            return self.ids[:limit]
+
+        query_words = query.split()
+        ranked = []
+
+        # Titles that share trigrams with the query, and how many
+        grams = trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        if len(query) < self.SCAN_BELOW:
+            candidates = range(len(self.ids))
+        else:
+            needed = len(grams) * self.FUZZY_THRESHOLD
+            candidates = [n for n, count in shared.items() if count >= needed]
+
+        for n in candidates:
+            tier = self._tier(n, query, query_words)
+
+            if tier is None:
+                if len(query) < self.SCAN_BELOW:
+                    continue
+                tier = self.FUZZY
+
+            # Within a tier, closer and shorter titles come first
+            ranked.append((tier, -shared[n], len(self.normalized[n]), n))
+
+        ranked.sort()
+
+        return [self.ids[n] for *_, n in ranked[:limit]]
+
+    def choices(self, query: str, limit: int = None) -> list[tuple[str, str]]:
+        """
+        Search, returning menu items
+        :return: (ID, title) pairs, best match first
+        """
+        return [(_id, self.catalog[_id]['title']) for _id in self.search(query, limit)]
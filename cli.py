@@ -0,0 +1,242 @@
+"""
+A headless command line interface for scripting the Breadbox archive
+
+Every command prints JSON to stdout, e.g.
+    python app.py list
+    python app.py info 12 13
+    python app.py query japanese audio and english subs
+    python app.py url 12 1 2 3
+    python app.py download 12 --all
+    python app.py library --duplicates
+    python app.py thumbnails --all --max-size 600
+    python app.py nyaa revue starlight --limit 12
+    python app.py import backlog.csv --workers 8
+"""
+
+import os
+import sys
+import json
+import argparse
+import requests
+
+from breadbox import Breadbox, APIKeyError, ServerNameError
+from importer import ManifestError
+from nyaa import NyaaError
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='itadakimasu',
+        description="Query and download from the Breadbox archive without the interactive menus."
+    )
+
+    parser.add_argument('--server', default=os.environ.get('ITADAKIMASU_SERVER'),
+                        help="Breadbox server URL (default: the configured server)")
+    parser.add_argument('--api-key', default=os.environ.get('ITADAKIMASU_API_KEY'),
+                        help="API key (default: the key stored in the system keyring)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't read or write the metadata cache")
+    parser.add_argument('--offline', action='store_true',
+                        help="Answer from cached metadata only, without contacting the server")
+    parser.add_argument('--pretty', action='store_true',
+                        help="Indent the JSON output")
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list', help="Information on every anime in the archive")
+
+    cmd = commands.add_parser('info', help="Information on one or more anime")
+    cmd.add_argument('ids', nargs='+', metavar='ID')
+
+    cmd = commands.add_parser('query', help="Search the archive locally, e.g. \"japanese audio and english subs\"")
+    cmd.add_argument('words', nargs='+', metavar='WORD',
+                     help="Title words, \"<language> audio\", \"<language> subs\" or \"<site>:<id>\", e.g. mal:21")
+    cmd.add_argument('--limit', type=int, help="Return at most this many anime")
+    cmd.add_argument('--refresh', action='store_true', help="Sync the local index with the archive first")
+
+    cmd = commands.add_parser('media', help="The episodes and bonus content of one or more anime")
+    cmd.add_argument('ids', nargs='+', metavar='ID')
+
+    cmd = commands.add_parser('url', help="Signed streaming URLs for episodes or bonus content")
+    cmd.add_argument('id', metavar='ID')
+    cmd.add_argument('media', nargs='+', metavar='EP')
+
+    cmd = commands.add_parser('download', help="Download episodes or bonus content to the downloads folder")
+    cmd.add_argument('id', metavar='ID')
+    cmd.add_argument('media', nargs='*', metavar='EP')
+    cmd.add_argument('--all', action='store_true', help="Download every episode")
+    cmd.add_argument('--bonus', action='store_true', help="With --all, download the bonus content too")
+
+    cmd = commands.add_parser('library', help="Index the downloads folder and match the files to the archive")
+    cmd.add_argument('--duplicates', action='store_true', help="List groups of identical files instead")
+
+    cmd = commands.add_parser('thumbnails', help="Copy thumbnails from MyAnimeList to the archive")
+    cmd.add_argument('ids', nargs='*', metavar='ID')
+    cmd.add_argument('--all', action='store_true', help="Every anime in the archive")
+    cmd.add_argument('--workers', type=int, help="How many thumbnails are processed at once")
+    cmd.add_argument('--max-size', type=int, help="Scale images down to fit in a square this many pixels wide (needs Pillow)")
+    cmd.add_argument('--quality', type=int, help="Recompress images as JPEG at this quality (needs Pillow)")
+
+    cmd = commands.add_parser('nyaa', help="Search Nyaa.si for an anime's torrents, best match first")
+    cmd.add_argument('words', nargs='+', metavar='WORD', help="The anime's title")
+    cmd.add_argument('--limit', type=int, help="Return at most this many torrents")
+    cmd.add_argument('--trusted', action='store_true', help="Only torrents from trusted uploaders")
+
+    cmd = commands.add_parser('import', help="Contribute every anime in a JSON or CSV manifest")
+    cmd.add_argument('manifest', help="Rows with id, title, mal_id, anilist_id, nyaa_ids, audio and subtitles")
+    cmd.add_argument('--workers', type=int, default=4, help="How many anime are uploaded at once")
+    cmd.add_argument('--retries', type=int, default=3, help="How many times a failed thumbnail upload is tried again")
+    cmd.add_argument('--check', action='store_true', help="Only check the manifest, without contributing anything")
+
+    return parser
+
+
+def run_command(args: argparse.Namespace, app) -> tuple[object, int]:
+    """
+    Run a parsed command
+    :return: The JSON-serializable result and the exit code
+    """
+    anime = app.breadbox.anime
+
+    match args.command:
+        case 'list':
+            return anime.catalog(), 0
+
+        case 'info':
+            # An unknown ID is an error, not an entry
+            return {_id: anime.info(_id, strict=True) for _id in args.ids}, 0
+
+        case 'query':
+            if args.refresh:
+                anime.refresh_index(force=True)
+
+            return anime.query(' '.join(args.words), limit=args.limit), 0
+
+        case 'media':
+            return {_id: anime.list_media(_id, strict=True) for _id in args.ids}, 0
+
+        case 'url':
+            return {media: anime.get_media_url(args.id, media) for media in args.media}, 0
+
+        case 'download':
+            # Media that's already downloaded is skipped
+            app.library.scan()
+            downloads = app.download_manager()
+
+            try:
+                info = anime.info(args.id)
+                media_ids = downloads.media_ids(args.id, args.bonus) if args.all else args.media
+                jobs = {media: downloads.enqueue(args.id, media, info['title']) for media in media_ids}
+
+                downloads.wait()
+            finally:
+                downloads.close()
+
+            failed = any(job and job.status != job.DONE for job in jobs.values())
+
+            # Files that are already downloaded aren't added again, but they're still reported
+            return [
+                job.to_dict() if job else {'anime_id': args.id, 'media_id': media, 'status': 'skipped'}
+                for media, job in jobs.items()
+            ], 1 if failed else 0
+
+        case 'library':
+            app.index_library(anime.catalog())
+
+            if args.duplicates:
+                return app.library.duplicates(), 0
+
+            return [file.to_dict() for file in app.library.status()], 0
+
+        case 'thumbnails':
+            for option in ('workers', 'max_size', 'quality'):
+                if (value := getattr(args, option)) is not None:
+                    app.config['thumbnail_' + option] = value
+
+            thumbnails = app.thumbnail_pipeline()
+
+            try:
+                results = thumbnails.run(list(anime.catalog()) if args.all else args.ids)
+            finally:
+                thumbnails.close()
+
+            failed = any(result not in (thumbnails.UPLOADED, thumbnails.UNCHANGED) for result in results.values())
+
+            return results, 1 if failed else 0
+
+        case 'import':
+            from app import Languages
+            from importer import ContributionImporter, check_manifest, read_manifest
+
+            rows = read_manifest(args.manifest)
+
+            if args.check:
+                reports = [
+                    {'row': n, 'errors': errors}
+                    for n, (_, errors) in enumerate(check_manifest(rows, Languages), start=1)
+                    if errors
+                ]
+
+                return reports, 1 if reports else 0
+
+            thumbnails = app.thumbnail_pipeline()
+
+            try:
+                reports = ContributionImporter(
+                    app.breadbox, app.nyaa, thumbnails, workers=args.workers, retries=args.retries
+                ).run(rows, Languages)
+            finally:
+                thumbnails.close()
+
+            return reports, 0 if all(report['status'] == ContributionImporter.IMPORTED for report in reports) else 1
+
+        case 'nyaa':
+            results = app.nyaa.search_anime(' '.join(args.words), trusted_only=args.trusted)
+
+            return [result.to_dict() for result in results[:args.limit]], 0
+
+
+def main(argv: list[str] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == 'download' and not (args.media or args.all):
+        parser.error("download needs episode IDs or --all")
+
+    # Import here so that app.py can hand over to the CLI before setting up any UI
+    from app import App
+
+    app = App()
+
+    if args.server:
+        app.config['server'] = args.server
+
+    if args.no_cache:
+        app.config['enable_cache'] = False
+
+    Breadbox.SERVER = app.config.get('server')
+
+    try:
+        app.breadbox = app.connect(api_key=args.api_key)
+    except (APIKeyError, ServerNameError) as e:
+        print(f"itadakimasu: {e}", file=sys.stderr)
+        return 2
+
+    app.breadbox.offline = app.jikan.offline = args.offline
+
+    try:
+        result, code = run_command(args, app)
+    except (requests.RequestException, ManifestError, NyaaError) as e:
+        print(f"itadakimasu: {e}", file=sys.stderr)
+        return 1
+    finally:
+        app.close()
+
+    json.dump(result, sys.stdout, indent=2 if args.pretty else None)
+    sys.stdout.write('\n')
+
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Sends contributions to the archive, changing only what's actually different from what it already has
+"""
+
+import json
+
+from typing import Any
+
+from breadbox import Breadbox
+from thumbnails import ThumbnailPipeline
+
+
+def canonical(value: Any) -> Any:
+    """
+    A form of a JSON value that compares equal to any other form of the same data.
+    Keys are sorted, and so are lists, since the order of e.g. languages or torrents doesn't matter to the archive.
+    """
+    if isinstance(value, dict):
+        return {str(key): canonical(item) for key, item in sorted(value.items(), key=lambda pair: str(pair[0]))}
+
+    if isinstance(value, (list, tuple)):
+        return sorted((canonical(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+
+    return value
+
+
+def diff_metadata(current: dict, proposed: dict) -> dict:
+    """
+    Work out which of an entry's fields a contribution changes
+    :param current: The entry as the archive has it
+    :param proposed: The contributed fields; fields it leaves out are left alone
+    :return: The fields to send, or {} if nothing changed
+    """
+    changes = {}
+
+    for key, value in proposed.items():
+        old = current.get(key)
+
+        if canonical(old) == canonical(value):
+            continue
+
+        # The archive replaces whole fields, so a changed object keeps the keys the contribution doesn't mention
+        if isinstance(old, dict) and isinstance(value, dict):
+            value = {**old, **value}
+
+        changes[key] = value
+
+    return changes
+
+
+class ContributionEngine:
+    """
+    Contributes an anime's metadata and thumbnail, sending only what the archive doesn't have already.
+
+    The entry is revalidated before it's compared, so the diff isn't against a stale cached copy,
+    and if nothing changed no PATCH is made at all.
+    """
+    def __init__(self, breadbox: Breadbox, thumbnails: ThumbnailPipeline = None):
+        """
+        :param thumbnails: Brings the thumbnail up to date after the metadata; if None, thumbnails are left alone
+        """
+        self.breadbox = breadbox
+        self.thumbnails = thumbnails
+
+    def current(self, anime_id) -> dict:
+        """The entry as the archive has it right now, or {} if it doesn't have one yet"""
+        info = self.breadbox.anime.info(anime_id, fresh=True)
+
+        # Missing entries come back as an error message instead of an entry
+        return info if isinstance(info, dict) and 'title' in info else {}
+
+    def changes(self, anime_id, metadata: dict) -> dict:
+        """
+        The fields a contribution would change
+        :param metadata: See ManifestRow.metadata()
+        """
+        return diff_metadata(self.current(anime_id), metadata)
+
+    def patch(self, anime_id, changes: dict):
+        """
+        Send changed fields to the archive
+        :param changes: See changes()
+        :return: The archive's response, or None if there was nothing to send
+        """
+        if not changes:
+            return None
+
+        r = self.breadbox.anime.patch('/' + str(anime_id), data=changes)
+        r.raise_for_status()
+
+        return r.json()
+
+    def contribute(self, anime_id, metadata: dict) -> dict:
+        """
+        Bring an entry's metadata and thumbnail up to date
+        :return: The fields that changed, the archive's response (None if nothing was sent),
+                 and what happened to the thumbnail
+        """
+        changes = self.changes(anime_id, metadata)
+
+        report = {'changed': sorted(changes), 'response': self.patch(anime_id, changes)}
+
+        if self.thumbnails:
+            report['thumbnail'] = self.thumbnails.process(anime_id)
+
+        return report
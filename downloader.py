@@ -0,0 +1,547 @@
+"""
+A download engine that fetches large files over several connections at once
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+import requests
+
+from pathlib import Path
+from contextlib import nullcontext
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor, wait
+
+MiB = 1024 * 1024
+
+
+# Helper exception
+class IntegrityError(ValueError): """The downloaded file doesn't match what the server said it should be"""
+class DownloadCancelled(Exception): """The download was stopped before it finished"""
+
+
+class DownloadProgress:
+    """
+    Aggregate progress of a download across all of its connections
+    """
+    def __init__(self, total: Optional[int] = None, resumed: int = 0):
+        self.total = total
+        self.done = resumed
+        self.resumed = resumed
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, amount: int):
+        with self.lock:
+            self.done += amount
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        """Average throughput of this session in bytes per second."""
+        return (self.done - self.resumed) / self.elapsed if self.elapsed > 0 else 0
+
+    def __str__(self):
+        done = self.done / MiB
+        rate = self.rate / MiB
+
+        if self.total:
+            return f"{done:.1f}/{self.total / MiB:.1f} MiB ({self.done / self.total:.0%}) @ {rate:.1f} MiB/s"
+        else:
+            return f"{done:.1f} MiB @ {rate:.1f} MiB/s"
+
+
+class DownloadJournal:
+    """
+    A sidecar file recording which byte ranges of a partial download are already on disk
+    """
+    def __init__(self, path: Path, total: int, etag: str = None, last_modified: str = None, done: list = None):
+        self.path = Path(path)
+        self.total = total
+        self.etag = etag
+        self.last_modified = last_modified
+        self.done: list[list[int]] = done or []  # Sorted, non-overlapping, inclusive [start, end] pairs
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['DownloadJournal']:
+        """
+        Read a journal
+        :return: The journal, or None if it doesn't exist or is unreadable.
+        """
+        try:
+            with open(path, 'r') as f:
+                return cls(path, **json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def matches(self, total: int, etag: str = None, last_modified: str = None) -> bool:
+        """Check if the journal was written for the same version of the file."""
+        if total != self.total:
+            return False
+
+        if etag or self.etag:
+            return etag == self.etag
+
+        return last_modified == self.last_modified
+
+    def add(self, start: int, end: int):
+        """Record that bytes start to end (inclusive) have been written."""
+        with self.lock:
+            ranges = []
+
+            for _start, _end in sorted(self.done + [[start, end]]):
+                if ranges and _start <= ranges[-1][1] + 1:
+                    ranges[-1][1] = max(ranges[-1][1], _end)
+                else:
+                    ranges.append([_start, _end])
+
+            self.done = ranges
+
+    @property
+    def completed(self) -> int:
+        """How many bytes have been written."""
+        with self.lock:
+            return sum(end - start + 1 for start, end in self.done)
+
+    def contiguous(self) -> int:
+        """How many bytes from the start of the file have been written without any gaps."""
+        with self.lock:
+            if self.done and self.done[0][0] == 0:
+                return self.done[0][1] + 1
+
+            return 0
+
+    def missing(self) -> list[tuple[int, int]]:
+        """Get the byte ranges (inclusive) that still need to be downloaded."""
+        with self.lock:
+            gaps = []
+            position = 0
+
+            for start, end in self.done:
+                if start > position:
+                    gaps.append((position, start - 1))
+                position = end + 1
+
+            if position < self.total:
+                gaps.append((position, self.total - 1))
+
+            return gaps
+
+    def save(self):
+        with self.lock:
+            data = {
+                'total': self.total,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+                'done': self.done
+            }
+
+        tmp = self.path.with_suffix('.tmp')
+
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+
+        tmp.replace(self.path)
+
+    def delete(self):
+        self.path.unlink(missing_ok=True)
+
+
+class ChecksumVerifier:
+    """
+    Hashes a file incrementally as its beginning becomes complete, and compares the result with a checksum.
+    """
+    # Digest algorithm names (RFC 9530) and their hashlib equivalents
+    ALGORITHMS = {
+        'sha-512': 'sha512',
+        'sha-256': 'sha256',
+        'sha': 'sha1',
+        'md5': 'md5',
+    }
+
+    def __init__(self, algorithm: str, expected: bytes):
+        self.algorithm = algorithm
+        self.expected = expected
+        self.hash = hashlib.new(algorithm)
+        self.position = 0
+
+    @classmethod
+    def from_headers(cls, headers) -> Optional['ChecksumVerifier']:
+        """
+        Find a checksum of the whole file in a response's headers
+        :return: A verifier, or None if the server didn't send a usable checksum.
+        """
+        # Repr-Digest (RFC 9530) and Digest (RFC 3230) both describe the whole file, even in a 206 response
+        for header in ('Repr-Digest', 'Digest'):
+            for item in headers.get(header, '').split(','):
+                name, _, value = item.strip().partition('=')
+
+                if (algorithm := cls.ALGORITHMS.get(name.lower())) and value:
+                    try:
+                        return cls(algorithm, base64.b64decode(value.strip(':')))
+                    except ValueError:
+                        continue
+
+        # Common non-standard headers with hex digests
+        for name, algorithm in (('X-Checksum-Sha256', 'sha256'), ('X-Checksum-Sha1', 'sha1'), ('X-Checksum-Md5', 'md5')):
+            if value := headers.get(name):
+                try:
+                    return cls(algorithm, bytes.fromhex(value))
+                except ValueError:
+                    continue
+
+        return None
+
+    def update(self, data: bytes):
+        """Hash data that follows directly after everything hashed so far."""
+        self.hash.update(data)
+        self.position += len(data)
+
+    def advance(self, fd: int, upto: int, chunk_size: int = MiB):
+        """Hash the file from where hashing last stopped up to byte upto (exclusive)."""
+        while self.position < upto:
+            data = read_at(fd, min(chunk_size, upto - self.position), self.position)
+
+            if not data:
+                break
+
+            self.update(data)
+
+    def verify(self):
+        if self.hash.digest() != self.expected:
+            raise IntegrityError(
+                f"{self.algorithm} checksum mismatch: expected {self.expected.hex()}, got {self.hash.hexdigest()}"
+            )
+
+
+class Downloader:
+    """
+    Downloads a file by splitting it into segments that are fetched concurrently with Range requests
+    and written straight to their place in a preallocated file.
+    Falls back to a single stream if the server doesn't support ranges.
+
+    The file is written to "<destination>.part" next to a "<destination>.part.json" journal of completed ranges,
+    so an interrupted download continues where it left off the next time it's started.
+    """
+    def __init__(
+            self,
+            request: Callable[..., requests.Response],
+            segment_size: int = 32 * MiB,
+            workers: int = 4,
+            chunk_size: int = 1 * MiB,
+            progress: Callable[[DownloadProgress], None] = None,
+            progress_interval: float = 0.5,
+            checkpoint_interval: float = 5,
+            connections: threading.Semaphore = None,
+            cancel: threading.Event = None
+    ):
+        """
+        :param request: Makes a streaming GET request for the file, passing on any keyword arguments (i.e. headers)
+        :param segment_size: How many bytes each Range request asks for
+        :param workers: How many segments are fetched at once
+        :param chunk_size: How many bytes are read from a response at a time
+        :param progress: Called with the download's progress every progress_interval seconds
+        :param checkpoint_interval: How often (in seconds) written data is flushed and the journal is saved
+        :param connections: If set, every connection to the server has to hold one of its slots
+        :param cancel: If set, the download stops (and can be resumed later) once this event is set
+        """
+        self.request = request
+        self.segment_size = segment_size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.connections = connections or nullcontext()
+        self.cancel = cancel or threading.Event()
+
+        self._reported = 0
+        self._report_lock = threading.Lock()
+
+    @staticmethod
+    def partial_paths(destination: Path) -> tuple[Path, Path]:
+        """Get the paths of the partial file and its journal."""
+        destination = Path(destination)
+        return destination.with_name(destination.name + '.part'), destination.with_name(destination.name + '.part.json')
+
+    def download(self, destination: Path) -> DownloadProgress:
+        """
+        Download the file to destination, resuming an earlier attempt if possible
+        :return: The final progress of the download
+        """
+        part, journal_path = self.partial_paths(destination)
+
+        with self.connections:
+            # Probe for range support with a request for the first byte
+            r = self.request(headers={'Range': 'bytes=0-0'})
+            r.raise_for_status()
+
+            total = self._total_size(r)
+            verifier = ChecksumVerifier.from_headers(r.headers)
+
+            if r.status_code == 206 and total is None:
+                # The server can send ranges but won't say how big the file is, so it can't be split up
+                r.close()
+
+                r = self.request()
+                r.raise_for_status()
+
+                verifier = ChecksumVerifier.from_headers(r.headers)
+
+            if r.status_code != 206:
+                # The server ignored the range and sent the whole file, so just use this response.
+                progress = self._download_single(r, part, verifier)
+                journal_path.unlink(missing_ok=True)
+
+                part.replace(destination)
+                return progress
+
+            r.close()
+
+        etag = r.headers.get('ETag')
+        last_modified = r.headers.get('Last-Modified')
+
+        # Only resume if the file on the server is still the one the journal was written for
+        journal = DownloadJournal.load(journal_path)
+
+        if not (journal and part.is_file() and journal.matches(total, etag, last_modified)):
+            journal = DownloadJournal(journal_path, total, etag, last_modified)
+
+        progress = self._download_segmented(journal, part, verifier)
+        journal.delete()
+
+        part.replace(destination)
+        return progress
+
+    @staticmethod
+    def _total_size(r: requests.Response) -> Optional[int]:
+        """Get the complete size of a file from a 206 response's Content-Range header."""
+        content_range = r.headers.get('Content-Range', '')
+
+        if not content_range.startswith('bytes ') or content_range.endswith('/*'):
+            return None
+
+        return int(content_range.rsplit('/', 1)[1])
+
+    def _download_single(self, r: requests.Response, destination: Path, verifier: ChecksumVerifier = None) -> DownloadProgress:
+        length = r.headers.get('Content-Length')
+        progress = DownloadProgress(int(length) if length else None)
+
+        with r, open(destination, 'wb') as fp:
+            for chunk in r.iter_content(chunk_size=self.chunk_size):
+                fp.write(chunk)
+                progress.add(len(chunk))
+                self._report(progress)
+
+                if verifier:
+                    verifier.update(chunk)
+
+                if self.cancel.is_set():
+                    raise DownloadCancelled()
+
+        self._report(progress, force=True)
+
+        if progress.total is not None and progress.done != progress.total:
+            # A single stream can't be resumed, so what arrived is no use
+            destination.unlink(missing_ok=True)
+
+            raise IntegrityError(f"Expected {progress.total} bytes, got {progress.done}")
+
+        if verifier:
+            self._verify(verifier, destination)
+
+        return progress
+
+    def _download_segmented(self, journal: DownloadJournal, destination: Path, verifier: ChecksumVerifier = None) -> DownloadProgress:
+        resuming = bool(journal.done)
+        progress = DownloadProgress(journal.total, resumed=journal.completed)
+
+        # Split whatever is missing into segments
+        segments = [
+            (start, min(start + self.segment_size - 1, end))
+            for gap_start, end in journal.missing()
+            for start in range(gap_start, end + 1, self.segment_size)
+        ]
+
+        # Resend the validator with every range, so a file that changes mid-download is caught
+        if journal.etag and not journal.etag.startswith('W/'):
+            if_range = journal.etag
+        else:
+            if_range = journal.last_modified
+
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        fd = os.open(destination, flags if resuming else flags | os.O_TRUNC, 0o644)
+
+        try:
+            if not resuming:
+                preallocate(fd, journal.total)
+                journal.save()
+
+            stop = threading.Event()
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [
+                    pool.submit(self._download_segment, fd, start, end, if_range, journal, progress, stop)
+                    for start, end in segments
+                ]
+
+                try:
+                    # Checkpoint periodically until every segment is finished or one of them fails
+                    while wait(futures, timeout=self.checkpoint_interval).not_done:
+                        self._checkpoint(fd, journal, verifier)
+
+                        if self.cancel.is_set() or any(f.done() and f.exception() for f in futures):
+                            break
+                finally:
+                    # Stop the other segments early, i.e. after an error or Ctrl+C
+                    stop.set()
+                    for future in futures:
+                        future.cancel()
+
+            # Save whatever made it to disk, so the next attempt can resume from here
+            self._checkpoint(fd, journal, verifier)
+
+            if self.cancel.is_set():
+                raise DownloadCancelled()
+
+            # Re-raise the first exception from any segment
+            for future in futures:
+                if not future.cancelled() and (exc := future.exception()):
+                    raise exc
+
+            if verifier:
+                verifier.advance(fd, journal.total)
+        finally:
+            os.close(fd)
+
+        self._report(progress, force=True)
+
+        # What did arrive is in the journal, so the next attempt only fetches the rest
+        if journal.missing():
+            raise requests.ConnectionError(f"Download finished with missing ranges: {journal.missing()}")
+
+        if verifier:
+            self._verify(verifier, destination, journal)
+
+        return progress
+
+    def _download_segment(
+            self,
+            fd: int,
+            start: int,
+            end: int,
+            if_range: Optional[str],
+            journal: DownloadJournal,
+            progress: DownloadProgress,
+            stop: threading.Event
+    ):
+        headers = {'Range': f'bytes={start}-{end}'}
+
+        if if_range:
+            headers['If-Range'] = if_range
+
+        with self.connections, self.request(headers=headers) as r:
+            r.raise_for_status()
+
+            if r.status_code != 206:
+                raise requests.HTTPError(
+                    f"Expected a partial response for bytes {start}-{end}; the file may have changed on the server",
+                    response=r
+                )
+
+            offset = start
+            for chunk in r.iter_content(chunk_size=self.chunk_size):
+                write_at(fd, chunk, offset)
+                journal.add(offset, offset + len(chunk) - 1)
+                offset += len(chunk)
+                progress.add(len(chunk))
+                self._report(progress)
+
+                if stop.is_set() or self.cancel.is_set():
+                    return
+
+        if offset != end + 1:
+            raise requests.ConnectionError(f"Segment {start}-{end} ended early at byte {offset}")
+
+    @staticmethod
+    def _checkpoint(fd: int, journal: DownloadJournal, verifier: ChecksumVerifier = None):
+        """Make written data durable before recording it in the journal, then hash any newly contiguous data."""
+        os.fsync(fd)
+        journal.save()
+
+        if verifier:
+            verifier.advance(fd, journal.contiguous())
+
+    @staticmethod
+    def _verify(verifier: ChecksumVerifier, destination: Path, journal: DownloadJournal = None):
+        """Check the checksum, throwing the download away if it's corrupt."""
+        try:
+            verifier.verify()
+        except IntegrityError:
+            destination.unlink(missing_ok=True)
+
+            if journal:
+                journal.delete()
+
+            raise
+
+    def _report(self, progress: DownloadProgress, force: bool = False):
+        """Call the progress callback, at most once every progress_interval seconds"""
+        if not self.progress:
+            return
+
+        with self._report_lock:
+            now = time.monotonic()
+
+            if not force and now - self._reported < self.progress_interval:
+                return
+
+            self._reported = now
+
+        self.progress(progress)
+
+
+# Windows doesn't have positional reads or writes, so serialise seek + read/write instead
+_seek_lock = threading.Lock()
+
+def write_at(fd: int, data: bytes, offset: int):
+    """Write data to a file descriptor at an offset without disturbing other writers"""
+    data = memoryview(data)
+
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while data:
+                data = data[os.write(fd, data):]
+
+def read_at(fd: int, size: int, offset: int) -> bytes:
+    """Read from a file descriptor at an offset without disturbing other readers or writers"""
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+def preallocate(fd: int, size: int):
+    """Reserve space for a file of the given size"""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass  # Not supported by this filesystem
+
+    os.ftruncate(fd, size)
@@ -0,0 +1,325 @@
+"""
+A persistent queue for downloading many files from the archive in the background
+"""
+
+import json
+import threading
+
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+
+import requests
+
+from breadbox import Breadbox
+from downloader import Downloader, DownloadCancelled
+from library import MediaLibrary
+
+
+def media_filename(title: str, media_id: str) -> str:
+    """The name a downloaded episode or bonus file is saved as"""
+    if media_id.isnumeric():
+        return f"%s - Episode %02d.mp4" % (title, int(media_id))
+    else:
+        return f"%s - %s" % (title, media_id)
+
+
+class DownloadJob:
+    """
+    A single queued file
+    """
+    QUEUED = 'queued'
+    DOWNLOADING = 'downloading'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(
+            self,
+            anime_id: str,
+            media_id: str,
+            title: str,
+            file: str,
+            status: str = QUEUED,
+            error: str = None
+    ):
+        self.anime_id = str(anime_id)
+        self.media_id = str(media_id)
+        self.title = title
+        self.file = file
+        self.status = status
+        self.error = error
+
+        # Only kept in memory
+        self.progress = None
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return self.anime_id, self.media_id
+
+    def describe(self) -> str:
+        """A one-line description of the job's state."""
+        name = Path(self.file).name
+
+        match self.status:
+            case DownloadJob.DOWNLOADING if self.progress:
+                return f"[{self.progress}] {name}"
+            case DownloadJob.FAILED:
+                return f"[failed: {self.error}] {name}"
+            case _:
+                return f"[{self.status}] {name}"
+
+    def to_dict(self) -> dict:
+        return {
+            'anime_id': self.anime_id,
+            'media_id': self.media_id,
+            'title': self.title,
+            'file': self.file,
+            'status': self.status,
+            'error': self.error
+        }
+
+
+class DownloadManager:
+    """
+    Runs queued downloads in the background with a limit on how many files download at once
+    and how many connections are open to each server.
+
+    The queue is saved to disk whenever it changes, so unfinished downloads continue after a restart.
+    """
+    def __init__(
+            self,
+            breadbox: Breadbox,
+            queue_file: Path,
+            downloads_folder: Path,
+            max_downloads: int = 2,
+            max_connections_per_server: int = 8,
+            library: MediaLibrary = None,
+            **downloader_options
+    ):
+        """
+        :param queue_file: Where the queue is stored between runs
+        :param downloads_folder: The folder files are saved to
+        :param max_downloads: How many files download at once
+        :param max_connections_per_server: How many connections all downloads together can have open to one server
+        :param library: If set, media with an intact local copy isn't downloaded again, and finished files are indexed
+        :param downloader_options: Passed on to every Downloader, i.e. segment_size, workers and chunk_size
+        """
+        self.breadbox = breadbox
+        self.queue_file = Path(queue_file)
+        self.downloads_folder = Path(downloads_folder).expanduser()
+        self.max_connections_per_server = max_connections_per_server
+        self.library = library
+        self.downloader_options = downloader_options
+
+        self.jobs: list[DownloadJob] = []
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.cancel = threading.Event()
+        self.server_connections: dict[str, threading.Semaphore] = {}
+        self.futures: list[Future] = []
+
+        # The jobs this manager has handed to the pool and that haven't finished, by key
+        self.active: set[tuple[str, str]] = set()
+
+        self.pool = ThreadPoolExecutor(max_workers=max_downloads, thread_name_prefix='download')
+
+        self.load()
+
+    def load(self):
+        """Read the queue from disk."""
+        try:
+            with open(self.queue_file, 'r') as f:
+                self.jobs = [DownloadJob(**job) for job in json.load(f)]
+        except (OSError, ValueError, TypeError):
+            self.jobs = []
+
+    def save(self):
+        """Write the queue to disk."""
+        with self.lock:
+            data = [job.to_dict() for job in self.jobs]
+
+        with self.save_lock:
+            self.queue_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.queue_file.with_suffix('.tmp')
+
+            with open(tmp, 'w') as f:
+                json.dump(data, f, indent=2)
+
+            tmp.replace(self.queue_file)
+
+    def resume(self):
+        """Start every download that didn't finish last time."""
+        with self.lock:
+            unfinished = [
+                job for job in self.jobs
+                if job.status in (DownloadJob.QUEUED, DownloadJob.DOWNLOADING) and job.key not in self.active
+            ]
+
+        for job in unfinished:
+            job.status = DownloadJob.QUEUED
+            self.submit(job)
+
+    def enqueue(self, anime_id, media_id, title: str) -> Optional[DownloadJob]:
+        """
+        Add a file to the queue
+        :return: The new job, or None if the file is downloading now or is already downloaded.
+        """
+        if self.library and self.library.find(anime_id, media_id):
+            return None
+
+        job = DownloadJob(
+            anime_id,
+            media_id,
+            title,
+            str(self.downloads_folder / media_filename(title, str(media_id)))
+        )
+
+        with self.lock:
+            if job.key in self.active:
+                return None
+
+            for existing in self.jobs:
+                if existing.key == job.key and existing.status == DownloadJob.DONE and Path(existing.file).is_file():
+                    return None
+
+            # Anything else is replaced: failed jobs, finished ones whose file is gone,
+            # and jobs left queued or downloading by a session that didn't close
+            self.jobs = [existing for existing in self.jobs if existing.key != job.key]
+            self.jobs.append(job)
+            self.active.add(job.key)
+
+        self.save()
+        self.submit(job)
+
+        return job
+
+    def enqueue_anime(self, anime_id, include_bonus: bool = False) -> list[DownloadJob]:
+        """
+        Add every episode of an anime to the queue
+        :param include_bonus: Also add the anime's bonus content
+        :return: The jobs that were added
+        """
+        info = self.breadbox.anime.info(anime_id)
+
+        jobs = []
+        for media_id in self.media_ids(anime_id, include_bonus):
+            if job := self.enqueue(anime_id, media_id, info['title']):
+                jobs.append(job)
+
+        return jobs
+
+    def media_ids(self, anime_id, include_bonus: bool = False) -> list[str]:
+        """
+        The media enqueue_anime() adds
+        :param include_bonus: Include the anime's bonus content
+        """
+        media = self.breadbox.anime.list_media(anime_id)
+
+        media_ids = [str(ep) for ep in media['episodes']]
+
+        if include_bonus:
+            media_ids += media['bonus']
+
+        return media_ids
+
+    def retry_failed(self) -> int:
+        """
+        Queue every failed download again
+        :return: How many downloads were queued
+        """
+        failed = [job for job in self.jobs if job.status == DownloadJob.FAILED]
+
+        for job in failed:
+            self.enqueue(job.anime_id, job.media_id, job.title)
+
+        return len(failed)
+
+    def clear_finished(self):
+        """Remove finished downloads from the queue."""
+        with self.lock:
+            self.jobs = [job for job in self.jobs if job.status != DownloadJob.DONE]
+
+        self.save()
+
+    def submit(self, job: DownloadJob):
+        """Hand a job to the download pool."""
+        with self.lock:
+            self.active.add(job.key)
+
+        future = self.pool.submit(self._run, job)
+
+        with self.lock:
+            self.futures = [f for f in self.futures if not f.done()] + [future]
+
+    def wait(self):
+        """Block until every submitted download has finished."""
+        while True:
+            with self.lock:
+                pending = [f for f in self.futures if not f.done()]
+
+            if not pending:
+                return
+
+            wait(pending)
+
+    def status(self) -> list[DownloadJob]:
+        """Get every job in the queue."""
+        with self.lock:
+            return list(self.jobs)
+
+    def connections(self, url: str) -> threading.Semaphore:
+        """Get the connection slots shared by every download from a server"""
+        host = urlparse(url).netloc
+
+        with self.lock:
+            if host not in self.server_connections:
+                self.server_connections[host] = threading.BoundedSemaphore(self.max_connections_per_server)
+
+            return self.server_connections[host]
+
+    def _run(self, job: DownloadJob):
+        try:
+            self._download(job)
+        finally:
+            with self.lock:
+                self.active.discard(job.key)
+
+    def _download(self, job: DownloadJob):
+        if self.cancel.is_set():
+            return
+
+        job.status = DownloadJob.DOWNLOADING
+        self.save()
+
+        def show_progress(progress):
+            job.progress = progress
+
+        try:
+            Path(job.file).parent.mkdir(parents=True, exist_ok=True)
+
+            Downloader(
+                lambda **kwargs: self.breadbox.anime.download_media(job.anime_id, job.media_id, **kwargs),
+                progress=show_progress,
+                connections=self.connections(self.breadbox.base_url),
+                cancel=self.cancel,
+                **self.downloader_options
+            ).download(Path(job.file))
+        except DownloadCancelled:
+            return  # Left as downloading, so it's resumed next time
+        except (requests.RequestException, OSError, ValueError) as e:
+            job.status = DownloadJob.FAILED
+            job.error = str(e)
+        else:
+            job.status = DownloadJob.DONE
+
+            if self.library:
+                self.library.add(job.file, job.anime_id, job.media_id)
+
+        self.save()
+
+    def close(self):
+        """Stop every download; unfinished ones are resumed next time."""
+        self.cancel.set()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.save()
@@ -0,0 +1,302 @@
+"""
+Contributes many anime to the archive at once from a JSON or CSV manifest
+"""
+
+import csv
+import json
+import time
+
+from pathlib import Path
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from breadbox import Breadbox
+from contributions import ContributionEngine
+from nyaa import NyaaClient, NyaaError
+from thumbnails import ThumbnailPipeline
+from transport import CircuitOpenError, RETRY_STATUSES, backoff_delay, retry_after
+
+
+# Helper Exceptions
+class ManifestError(ValueError): """The manifest can't be read"""
+
+
+def split_list(value) -> list[str]:
+    """Read a list from a manifest cell: a JSON list, or a string separated by spaces, commas or semicolons"""
+    if value is None:
+        return []
+
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+
+    return str(value).replace(';', ' ').replace(',', ' ').split()
+
+
+class ManifestRow:
+    """
+    One anime to contribute, as the contribution menu would collect it
+    """
+    def __init__(
+            self,
+            breadbox_id: int,
+            title: str,
+            mal_id: int,
+            anilist_id: int,
+            nyaa_ids: list[int],
+            audio: list[str],
+            subtitles: list[str]
+    ):
+        self.breadbox_id = breadbox_id
+        self.title = title
+        self.mal_id = mal_id
+        self.anilist_id = anilist_id
+        self.nyaa_ids = nyaa_ids
+        self.audio = audio
+        self.subtitles = subtitles
+
+    @classmethod
+    def parse(cls, row: dict, languages: list[str] = None) -> tuple[Optional['ManifestRow'], list[str]]:
+        """
+        Check a manifest row
+        :param row: The row's cells by column name
+        :param languages: The languages that are allowed, or None to allow any
+        :return: The row, or None if it's invalid, and everything that's wrong with it
+        """
+        errors = []
+
+        def number(*names: str) -> Optional[int]:
+            value = next((row[name] for name in names if row.get(name) not in (None, '')), None)
+
+            if value is None:
+                errors.append(f"{names[0]} is missing")
+            elif not str(value).strip().isnumeric():
+                errors.append(f"{names[0]} must be numeric, not {value!r}")
+            else:
+                return int(value)
+
+            return None
+
+        breadbox_id = number('id', 'breadbox_id')
+        mal_id = number('mal_id', 'myanimelist')
+        anilist_id = number('anilist_id', 'anilist')
+
+        title = str(row.get('title') or '').strip()
+        if not title:
+            errors.append("title is missing")
+
+        nyaa_ids = split_list(row.get('nyaa_ids', row.get('nyaa')))
+        if not nyaa_ids:
+            errors.append("nyaa_ids is missing")
+        elif bad := [_id for _id in nyaa_ids if not _id.isnumeric()]:
+            errors.append(f"nyaa_ids must be numeric, not {', '.join(bad)}")
+
+        audio = [language.lower() for language in split_list(row.get('audio'))]
+        subtitles = [language.lower() for language in split_list(row.get('subtitles'))]
+
+        if languages and (unknown := sorted(set(audio + subtitles) - set(languages))):
+            errors.append(f"unknown languages: {', '.join(unknown)}")
+
+        if errors:
+            return None, errors
+
+        return cls(breadbox_id, title, mal_id, anilist_id, [int(_id) for _id in nyaa_ids], audio, subtitles), []
+
+    def metadata(self, torrents: list[dict]) -> dict:
+        """
+        The anime's information in the form the archive takes
+        :param torrents: The resolved torrents, see NyaaTorrent.to_dict()
+        """
+        return {
+            "title": self.title,
+            "audio": self.audio,
+            "subtitles": self.subtitles,
+            "external": {
+                "myanimelist": f"https://myanimelist.net/anime/{self.mal_id}",
+                "jikan": f"https://api.jikan.moe/v4/anime/{self.mal_id}",
+                "anilist": f"https://anilist.co/anime/{self.anilist_id}"
+            },
+            "torrents": torrents
+        }
+
+
+def read_manifest(path: Path) -> list[dict]:
+    """
+    Read the rows of a manifest
+    :param path: A .json file holding a list of objects, or a .csv file with a header row
+    """
+    path = Path(path)
+
+    try:
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            if path.suffix.lower() == '.csv':
+                return list(csv.DictReader(f))
+
+            rows = json.load(f)
+    except (OSError, ValueError, csv.Error) as e:
+        raise ManifestError(f"Can't read {path}: {e}")
+
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ManifestError(f"{path} must hold a list of objects")
+
+    return rows
+
+
+def check_manifest(rows: list[dict], languages: list[str] = None) -> list[tuple[Optional[ManifestRow], list[str]]]:
+    """
+    Check every row of a manifest, including that no anime appears twice, since the later row would overwrite the earlier
+    :param languages: The languages that are allowed, or None to allow any
+    :return: Each row, or None if it's invalid, and everything that's wrong with it, in manifest order
+    """
+    checked = []
+    first_row: dict[int, int] = {}
+
+    for n, row in enumerate(rows, start=1):
+        entry, errors = ManifestRow.parse(row, languages)
+
+        if entry and (first := first_row.setdefault(entry.breadbox_id, n)) != n:
+            entry, errors = None, [f"id {entry.breadbox_id} is already on row {first}"]
+
+        checked.append((entry, errors))
+
+    return checked
+
+
+class ContributionImporter:
+    """
+    Contributes every row of a manifest, with a bounded number of anime in progress at once.
+
+    Every row is checked before anything is sent. Then all the Nyaa.si torrents are resolved together,
+    and every anime's metadata and thumbnail are uploaded on a thread pool.
+    Requests that can be repeated are retried by their session's Transport; only thumbnail uploads are retried here.
+    Only fields that differ from what the archive has are sent, so rerunning a manifest changes nothing.
+    """
+    IMPORTED = 'imported'
+    INVALID = 'invalid'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+
+    def __init__(
+            self,
+            breadbox: Breadbox,
+            nyaa: NyaaClient,
+            thumbnails: ThumbnailPipeline,
+            workers: int = 4,
+            retries: int = 3,
+            backoff: float = 1
+    ):
+        """
+        :param workers: How many anime are uploaded at once
+        :param retries: How many times a failed thumbnail upload is tried again
+        :param backoff: The longest wait before the first retry, in seconds; it doubles every time
+        """
+        self.breadbox = breadbox
+        self.nyaa = nyaa
+        self.thumbnails = thumbnails
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+
+        self.engine = ContributionEngine(breadbox, thumbnails)
+
+    def retry(self, action: Callable[[], object]):
+        """
+        Run an action, trying again after network errors and server errors.
+        Only for steps that send something the transport won't repeat, e.g. an upload;
+        retrying idempotent requests here too would multiply the transport's own retries.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return action()
+            except CircuitOpenError:
+                # The host is down, so waiting here would only hold up the other rows
+                raise
+            except requests.RequestException as e:
+                retryable = e.response is None or e.response.status_code in RETRY_STATUSES
+
+                if not retryable or attempt == self.retries:
+                    raise
+
+                wait = retry_after(e.response)
+
+            time.sleep(wait if wait is not None else backoff_delay(attempt, self.backoff, 60))
+
+    def run(
+            self,
+            rows: list[dict],
+            languages: list[str] = None,
+            progress: Callable[[dict], None] = None
+    ) -> list[dict]:
+        """
+        Import a manifest
+        :param rows: The manifest's rows, see read_manifest()
+        :param languages: The languages that are allowed, or None to allow any
+        :param progress: Called with each row's report as it finishes
+        :return: A report for every row, in manifest order
+        """
+        reports = [{'row': n, 'id': row.get('id') or row.get('breadbox_id')} for n, row in enumerate(rows, start=1)]
+
+        parsed = {}
+        for report, (entry, errors) in zip(reports, check_manifest(rows, languages)):
+            if errors:
+                report.update(status=self.INVALID, errors=errors)
+            else:
+                parsed[report['row']] = entry
+
+        # Nothing is sent unless the whole manifest is valid
+        if len(parsed) < len(rows):
+            for report in reports:
+                report.setdefault('status', self.SKIPPED)
+
+            return reports
+
+        # Resolve every torrent in one go, since rows often share them
+        torrents = {}
+        nyaa_ids = sorted({_id for entry in parsed.values() for _id in entry.nyaa_ids})
+
+        def resolve(nyaa_id: int):
+            try:
+                torrents[nyaa_id] = self.nyaa.resolve(nyaa_id).to_dict()
+            except (NyaaError, requests.RequestException) as e:
+                torrents[nyaa_id] = e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.nyaa.workers, len(nyaa_ids)))) as pool:
+            list(pool.map(resolve, nyaa_ids))
+
+        def work(n: int) -> dict:
+            report = reports[n - 1]
+            report.update(self._import(parsed[n], torrents))
+
+            if progress:
+                progress(report)
+
+            return report
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import') as pool:
+            list(pool.map(work, parsed))
+
+        return reports
+
+    def _import(self, entry: ManifestRow, torrents: dict[int, dict | Exception]) -> dict:
+        """Upload one anime's metadata and thumbnail"""
+        if failed := [f"Nyaa.si torrent {_id}: {torrents[_id]}" for _id in entry.nyaa_ids if isinstance(torrents[_id], Exception)]:
+            return {'status': self.FAILED, 'errors': failed}
+
+        metadata = entry.metadata([torrents[_id] for _id in entry.nyaa_ids])
+
+        def patch() -> tuple[list[str], dict]:
+            changes = self.engine.changes(entry.breadbox_id, metadata)
+            return sorted(changes), self.engine.patch(entry.breadbox_id, changes)
+
+        try:
+            changed, response = patch()
+        except (requests.RequestException, ValueError) as e:
+            return {'status': self.FAILED, 'errors': [f"metadata: {e}"]}
+
+        try:
+            thumbnail = self.retry(lambda: self.thumbnails.process(entry.breadbox_id))
+        except (requests.RequestException, OSError, ValueError, KeyError) as e:
+            return {'status': self.FAILED, 'changed': changed, 'response': response, 'errors': [f"thumbnail: {e}"]}
+
+        return {'status': self.IMPORTED, 'changed': changed, 'response': response, 'thumbnail': thumbnail}
@@ -0,0 +1,201 @@
+"""
+A small client for the Jikan (unofficial MyAnimeList) API
+"""
+
+import json
+import time
+import threading
+import contextvars
+import requests
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from ratelimit import TokenBucket, RateLimiter
+from transport import Transport
+
+
+class Jikan:
+    """
+    Looks up anime and episode information on Jikan.
+
+    Episode lists are fetched in full (every page), then memoized per MyAnimeList ID in memory and on disk.
+    All requests are queued through a rate limiter that respects Jikan's published limits,
+    and requests Jikan turns away anyway are tried again when its Retry-After says so.
+    """
+    BASE_URL = 'https://api.jikan.moe/v4'
+
+    # https://docs.api.jikan.moe/#section/Information/Rate-Limiting
+    REQUESTS_PER_SECOND = 3
+    REQUESTS_PER_MINUTE = 60
+
+    def __init__(
+            self,
+            cache_folder: Path = None,
+            ttl: float = 86400,
+            workers: int = 3,
+            timeout: float | tuple[float, float] = (5, 30)
+    ):
+        """
+        :param cache_folder: If set, episode lists are stored in this folder between runs
+        :param ttl: How many seconds a stored episode list is trusted before it is fetched again
+        :param workers: How many pages can be fetched at once
+        :param timeout: How many seconds to wait for Jikan: to connect and between bytes, or (connect, read)
+        """
+        self.cache_folder = Path(cache_folder) if cache_folder else None
+        self.ttl = ttl
+        self.workers = workers
+
+        self.limiter = RateLimiter(
+            TokenBucket(self.REQUESTS_PER_SECOND, self.REQUESTS_PER_SECOND),
+            TokenBucket(self.REQUESTS_PER_MINUTE / 60, self.REQUESTS_PER_MINUTE)
+        )
+
+        # Every attempt takes a token, retries included, so trying again never breaks Jikan's limits
+        self.session = requests.Session()
+        self.session.mount('https://', Transport(timeout=timeout, pool_maxsize=workers, throttle=self.limiter.acquire))
+
+        self.episode_index: dict[int, dict[int, str]] = {}
+
+        # One lock per anime, so a slow download doesn't hold up lookups of other anime
+        self.locks: dict[int, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+        # While offline, stored episode lists are used however old they are, and nothing is requested
+        self.offline = False
+
+    @staticmethod
+    def mal_id(anime: int | str) -> int:
+        """
+        Get a MyAnimeList ID from either the ID itself or a Jikan anime URL,
+        e.g. the "jikan" URL stored in an anime's external links.
+        """
+        if isinstance(anime, int):
+            return anime
+
+        return int(anime.rstrip('/').rsplit('/', 1)[-1])
+
+    def get(self, relative_url: str, **kwargs) -> dict:
+        """
+        Make a rate limited request to Jikan
+        :param relative_url: The URL relative to the Jikan API
+        :return: The decoded JSON response
+        """
+        r = self.session.get(self.BASE_URL + relative_url, **kwargs)
+        r.raise_for_status()
+
+        return r.json()
+
+    def anime(self, anime: int | str) -> dict:
+        """
+        Get the full information on an anime
+        """
+        return self.get(f'/anime/{self.mal_id(anime)}')['data']
+
+    def episodes(self, anime: int | str) -> dict[int, str]:
+        """
+        Get every episode title of an anime
+        :return: A dict mapping episode numbers to titles; empty if offline and the list was never stored
+        """
+        mal_id = self.mal_id(anime)
+
+        if (episodes := self.episode_index.get(mal_id)) is not None:
+            return episodes
+
+        with self.lock:
+            lock = self.locks.setdefault(mal_id, threading.Lock())
+
+        # Only one thread downloads a given episode list
+        with lock:
+            if (episodes := self.episode_index.get(mal_id)) is not None:
+                return episodes
+
+            episodes = self._load(mal_id, stale=self.offline)
+
+            if episodes is None:
+                if self.offline:
+                    return {}
+
+                try:
+                    episodes = self._download(mal_id)
+                except (requests.ConnectionError, requests.Timeout):
+                    # An old list beats none while Jikan is down; it isn't memoized, so it's fetched again later
+                    if (episodes := self._load(mal_id, stale=True)) is None:
+                        raise
+
+                    return episodes
+
+                self._save(mal_id, episodes)
+
+            self.episode_index[mal_id] = episodes
+
+        return episodes
+
+    def episode_title(self, anime: int | str, episode: int) -> str:
+        """
+        Get the title of a single episode
+        :return: The title, or a generic one if Jikan doesn't know about the episode.
+        """
+        return self.episodes(anime).get(int(episode), f"Episode {episode}")
+
+    def _download(self, mal_id: int) -> dict[int, str]:
+        """Fetch every page of an episode list"""
+        first = self.get(f'/anime/{mal_id}/episodes')
+        pages = [first]
+
+        last_page = first.get('pagination', {}).get('last_visible_page', 1)
+
+        if last_page > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                # In the caller's context, so the requests count wherever the caller is measuring, see transport.measure()
+                futures = [
+                    pool.submit(contextvars.copy_context().run, self.get, f'/anime/{mal_id}/episodes', params={'page': page})
+                    for page in range(2, last_page + 1)
+                ]
+
+                pages += [future.result() for future in futures]
+
+        episodes = {}
+        for page in pages:
+            for ep in page['data']:
+                episodes[ep['mal_id']] = ep['title']
+
+        return episodes
+
+    def _path(self, mal_id: int) -> Path:
+        return self.cache_folder / f'{mal_id}.json'
+
+    def _load(self, mal_id: int, stale: bool = False) -> dict[int, str] | None:
+        """Read an episode list from disk if it's still fresh, or at all if stale is set"""
+        if not self.cache_folder:
+            return None
+
+        try:
+            with open(self._path(mal_id), 'r') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not stale and time.time() - stored['fetched'] > self.ttl:
+            return None
+
+        # JSON keys are always strings
+        return {int(num): title for num, title in stored['episodes'].items()}
+
+    def _save(self, mal_id: int, episodes: dict[int, str]):
+        """Write an episode list to disk"""
+        if not self.cache_folder:
+            return
+
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+
+        path = self._path(mal_id)
+        tmp = path.with_suffix('.tmp')
+
+        with open(tmp, 'w') as f:
+            json.dump({'fetched': time.time(), 'episodes': episodes}, f)
+
+        tmp.replace(path)
+
+    def close(self):
+        self.session.close()
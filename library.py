@@ -0,0 +1,297 @@
+"""
+An index of the files in the downloads folder, matched back to the archive media they're copies of
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+
+from pathlib import Path
+from typing import Optional, Iterator
+
+
+# How many bytes are hashed from the start, the middle and the end of a file
+SAMPLE_SIZE = 64 * 1024
+
+# Files left behind by unfinished downloads and atomic saves
+PARTIAL_SUFFIXES = ('.part', '.part.json', '.tmp')
+
+
+def partial_hash(path: Path, size: int) -> str:
+    """
+    Hash a file's size and samples from its start, middle and end.
+    Tells video files apart about as well as a full hash, without reading gigabytes.
+    """
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(size // 2 - SAMPLE_SIZE // 2, 0), max(size - SAMPLE_SIZE, 0)}):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+def parse_filename(name: str) -> Optional[tuple[str, str]]:
+    """
+    Undo media_filename()
+    :return: The anime title and media ID, or None if the name isn't one of ours
+    """
+    if match := re.fullmatch(r'(.+) - Episode (\d+)\.mp4', name):
+        return match[1], str(int(match[2]))
+
+    title, separator, media_id = name.rpartition(' - ')
+
+    return (title, media_id) if separator else None
+
+
+class LibraryFile:
+    """
+    A file in the library, and the archive media it's a copy of if that's known
+    """
+    def __init__(
+            self,
+            path: str,
+            size: int,
+            mtime: int,
+            hash: str,
+            anime_id: str = None,
+            media_id: str = None
+    ):
+        """
+        :param mtime: The modification time in nanoseconds
+        :param hash: See partial_hash()
+        """
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.hash = hash
+        self.anime_id = anime_id
+        self.media_id = media_id
+
+    @property
+    def key(self) -> Optional[tuple[str, str]]:
+        return (self.anime_id, self.media_id) if self.anime_id else None
+
+    def unchanged(self, stat: os.stat_result) -> bool:
+        """Whether the file still looks the way it did when it was hashed."""
+        return self.size == stat.st_size and self.mtime == stat.st_mtime_ns
+
+    def to_dict(self) -> dict:
+        return {
+            'path': self.path,
+            'size': self.size,
+            'mtime': self.mtime,
+            'hash': self.hash,
+            'anime_id': self.anime_id,
+            'media_id': self.media_id
+        }
+
+
+class MediaLibrary:
+    """
+    Keeps track of the files in the downloads folder by path, size, modification time and partial hash,
+    and which episode or bonus file each of them is.
+
+    Rescans only hash files that are new or changed, so checking thousands of files costs little more than listing them.
+    """
+    def __init__(self, folder: Path, index_file: Path):
+        """
+        :param folder: The downloads folder
+        :param index_file: Where the index is stored between runs
+        """
+        self.folder = Path(folder).expanduser().absolute()
+        self.index_file = Path(index_file)
+
+        # By absolute path
+        self.files: dict[str, LibraryFile] = {}
+
+        # (anime ID, media ID) -> absolute path
+        self.media: dict[tuple[str, str], str] = {}
+
+        self.lock = threading.Lock()
+
+        # Saves come from download workers as well as the UI, and the last one to finish has to be the newest
+        self.save_lock = threading.Lock()
+
+        self.load()
+
+    def load(self):
+        """Read the index from disk."""
+        try:
+            with open(self.index_file, 'r') as f:
+                files = [LibraryFile(**file) for file in json.load(f)]
+        except (OSError, ValueError, TypeError):
+            files = []
+
+        with self.lock:
+            # Files from a previous downloads folder are forgotten
+            self.files = {file.path: file for file in files if Path(file.path).is_relative_to(self.folder)}
+            self._map()
+
+    def save(self):
+        """Write the index to disk."""
+        with self.save_lock:
+            with self.lock:
+                data = [file.to_dict() for file in self.files.values()]
+
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_file.with_suffix('.tmp')
+
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+
+            tmp.replace(self.index_file)
+
+    def _map(self):
+        """Rebuild the lookup from archive media to files"""
+        self.media = {file.key: path for path, file in self.files.items() if file.key}
+
+    def _walk(self, folder: str) -> Iterator[os.DirEntry]:
+        """Every finished file in a folder and its subfolders"""
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            return
+
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+
+            if entry.is_dir(follow_symlinks=False):
+                yield from self._walk(entry.path)
+            elif entry.is_file() and not entry.name.endswith(PARTIAL_SUFFIXES):
+                yield entry
+
+    def scan(self) -> tuple[int, int]:
+        """
+        Bring the index up to date with the downloads folder
+        :return: How many files were added or changed, and how many are gone
+        """
+        with self.lock:
+            known = dict(self.files)
+
+        files = {}
+        changed = 0
+
+        for entry in self._walk(str(self.folder)):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+
+            file = known.get(entry.path)
+
+            if file and file.unchanged(stat):
+                files[entry.path] = file
+                continue
+
+            try:
+                digest = partial_hash(Path(entry.path), stat.st_size)
+            except OSError:
+                continue
+
+            # Touching a file doesn't change what it's a copy of
+            anime_id, media_id = (file.anime_id, file.media_id) if file and file.hash == digest else (None, None)
+
+            files[entry.path] = LibraryFile(entry.path, stat.st_size, stat.st_mtime_ns, digest, anime_id, media_id)
+            changed += 1
+
+        removed = len(known.keys() - files.keys())
+
+        with self.lock:
+            # Keep files add() indexed during the walk, since they know what they're copies of
+            for path, file in self.files.items():
+                if known.get(path) is not file:
+                    files[path] = file
+
+            self.files = files
+            self._map()
+
+        if changed or removed:
+            self.save()
+
+        return changed, removed
+
+    def add(self, path: Path, anime_id, media_id) -> Optional[LibraryFile]:
+        """
+        Index a file that's known to be a copy of archive media, e.g. one that was just downloaded
+        :return: The indexed file, or None if it doesn't exist
+        """
+        path = str(Path(path).expanduser().absolute())
+
+        try:
+            stat = os.stat(path)
+            digest = partial_hash(Path(path), stat.st_size)
+        except OSError:
+            return None
+
+        file = LibraryFile(path, stat.st_size, stat.st_mtime_ns, digest, str(anime_id), str(media_id))
+
+        with self.lock:
+            self.files[path] = file
+            self.media[file.key] = path
+
+        self.save()
+
+        return file
+
+    def identify(self, catalog: dict[str, dict]) -> int:
+        """
+        Work out what files are copies of by their names, for files downloaded before they were indexed
+        :param catalog: Information on every anime by ID, as returned by all_info()
+        :return: How many files were newly matched
+        """
+        anime_ids = {info['title']: str(_id) for _id, info in catalog.items()}
+        matched = 0
+
+        with self.lock:
+            for path, file in self.files.items():
+                if file.key or not (parsed := parse_filename(Path(path).name)):
+                    continue
+
+                title, media_id = parsed
+
+                if title in anime_ids:
+                    file.anime_id, file.media_id = anime_ids[title], media_id
+                    matched += 1
+
+            self._map()
+
+        if matched:
+            self.save()
+
+        return matched
+
+    def find(self, anime_id, media_id) -> Optional[Path]:
+        """
+        The local copy of an episode or bonus file, if it's still there and unchanged since it was indexed
+        """
+        with self.lock:
+            path = self.media.get((str(anime_id), str(media_id)))
+            file = self.files.get(path)
+
+        if not file:
+            return None
+
+        try:
+            return Path(path) if file.unchanged(os.stat(path)) else None
+        except OSError:
+            return None
+
+    def duplicates(self) -> list[list[str]]:
+        """Groups of files with the same contents"""
+        with self.lock:
+            groups: dict[tuple[int, str], list[str]] = {}
+
+            for path, file in self.files.items():
+                groups.setdefault((file.size, file.hash), []).append(path)
+
+        return [paths for paths in groups.values() if len(paths) > 1]
+
+    def status(self) -> list[LibraryFile]:
+        """Get every indexed file."""
+        with self.lock:
+            return list(self.files.values())
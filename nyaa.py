@@ -3,8 +3,35 @@ A simple library for getting information from nyaa.si
 """
 
 from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+from urllib.parse import quote
+import xml.etree.ElementTree as ElementTree
+import threading
+import math
 import requests
 
+from catalog import normalize, trigrams
+from transport import Transport
+
+# Elements in Nyaa.si's RSS feeds
+NYAA_NAMESPACE = '{https://nyaa.si/xmlns/nyaa}'
+
+# Trackers added to magnet links built from search results, as Nyaa.si does on its own pages
+TRACKERS = [
+    'http://nyaa.tracker.wf:7777/announce',
+    'udp://open.stealth.si:80/announce',
+    'udp://tracker.opentrackr.org:1337/announce',
+    'udp://exodus.desync.com:6969/announce',
+    'udp://tracker.torrent.eu.org:451/announce'
+]
+
+# Multipliers for the sizes in search results, e.g. "1.4 GiB"
+SIZE_UNITS = {'B': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
+# Helper Exceptions
+class NyaaError(ValueError): """Nyaa.si didn't send what was asked for, e.g. a page without the torrent's links"""
+
 class NyaaParser(HTMLParser):
     """
     A simple parser for Nyaa.si
@@ -16,33 +43,307 @@ class NyaaParser(HTMLParser):
         super().__init__()
         self.result = {}
 
+    @property
+    def done(self) -> bool:
+        """Whether both links have been found, so the rest of the page can be skipped."""
+        return 'magnet' in self.result and 'torrent' in self.result
+
     def handle_starttag(self, tag, attr):
         """Tell the parser what to do with which tags."""
-        if tag == 'a':
-            params = dict(attr)
+        if tag != 'a' or self.done:
+            return
+
+        # Anchors without a link are skipped
+        if not (href := dict(attr).get('href')):
+            return
 
-            if (res := params['href']).startswith('magnet:?'):
-                self.result['magnet'] = res
+        if href.startswith('magnet:?'):
+            self.result.setdefault('magnet', href)
 
-            elif (res := params['href']).endswith('.torrent'):
-                self.result['torrent'] = res
+        elif href.endswith('.torrent'):
+            self.result.setdefault('torrent', href)
 
 
 class NyaaTorrent:
     """
     A torrent page on Nyaa.si
     """
-    def __init__(self, nyaa_id: int):
+    def __init__(self, nyaa_id: int, magnet: str, file: str, session: requests.Session = None):
+        """
+        :param magnet: The torrent's magnet link
+        :param file: The URL of the .torrent file
+        :param session: The session download_file() uses, e.g. the NyaaClient's
+        """
+        self.id = int(nyaa_id)
         self.url = 'https://nyaa.si/view/' + str(nyaa_id)
+        self.magnet = magnet
+        self.file = file
+        self.session = session
+
+    def download_file(self, session: requests.Session = None) -> bytes:
+        """
+        Fetch the contents of the .torrent file.
+        :param session: Use this session instead of the torrent's own
+        """
+        session = session or self.session
+
+        if session is None:
+            # A one-off session, so the download still gets a timeout, retries and a circuit breaker
+            with requests.Session() as session:
+                session.mount('https://', Transport())
+                return self.download_file(session)
+
+        r = session.get(self.file)
+        r.raise_for_status()
+
+        return r.content
+
+    def to_dict(self) -> dict:
+        return {
+            "magnet": self.magnet,
+            "file": self.file,
+            "url": self.url
+        }
+
+
+class NyaaResult:
+    """
+    A search result, with just enough to rank it and attach it to an anime
+    """
+    __slots__ = ('id', 'title', 'size', 'seeders', 'leechers', 'downloads', 'infohash', 'trusted', 'remake')
+
+    def __init__(
+            self,
+            id: int,
+            title: str,
+            size: int,
+            seeders: int,
+            leechers: int,
+            downloads: int,
+            infohash: str,
+            trusted: bool = False,
+            remake: bool = False
+    ):
+        """
+        :param size: In bytes
+        """
+        self.id = id
+        self.title = title
+        self.size = size
+        self.seeders = seeders
+        self.leechers = leechers
+        self.downloads = downloads
+        self.infohash = infohash
+        self.trusted = trusted
+        self.remake = remake
+
+    @property
+    def magnet(self) -> str:
+        return f'magnet:?xt=urn:btih:{self.infohash}&dn={quote(self.title)}' + ''.join(
+            '&tr=' + quote(tracker, safe='') for tracker in TRACKERS
+        )
+
+    def torrent(self, session: requests.Session = None) -> NyaaTorrent:
+        """
+        The torrent's links, without having to fetch its page
+        :param session: The session the torrent's download_file() uses
+        """
+        return NyaaTorrent(self.id, self.magnet, f'https://nyaa.si/download/{self.id}.torrent', session)
+
+    def describe(self) -> str:
+        """A one-line summary for menus."""
+        return f"[{self.seeders} seeders, {self.size / SIZE_UNITS['GiB']:.1f} GiB] {self.title}"
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__} | {'magnet': self.magnet}
+
+
+def parse_size(text: str) -> int:
+    """Turn a size like "1.4 GiB" into bytes."""
+    number, _, unit = text.strip().partition(' ')
+    return int(float(number) * SIZE_UNITS.get(unit, 1))
+
+
+def parse_rss(chunks: Iterable[bytes]) -> Iterator[NyaaResult]:
+    """
+    Read search results from a Nyaa.si RSS feed as it arrives.
+    Items with a field that doesn't parse, e.g. a non-numeric seeder count, are skipped.
+    :param chunks: The feed, e.g. a response's iter_content() or a saved feed opened in binary mode
+    """
+    parser = ElementTree.XMLPullParser(events=('end',))
+
+    def items() -> Iterator[NyaaResult]:
+        for _, element in parser.read_events():
+            if element.tag != 'item':
+                continue
+
+            def text(name: str, default: str = '') -> str:
+                return element.findtext(name, default).strip()
+
+            try:
+                result = NyaaResult(
+                    # The view page's URL is the item's GUID
+                    int(text('guid').rstrip('/').rsplit('/', 1)[-1]),
+                    text('title'),
+                    parse_size(text(NYAA_NAMESPACE + 'size', '0 B')),
+                    int(text(NYAA_NAMESPACE + 'seeders', '0')),
+                    int(text(NYAA_NAMESPACE + 'leechers', '0')),
+                    int(text(NYAA_NAMESPACE + 'downloads', '0')),
+                    text(NYAA_NAMESPACE + 'infoHash').lower(),
+                    trusted=text(NYAA_NAMESPACE + 'trusted') == 'Yes',
+                    remake=text(NYAA_NAMESPACE + 'remake') == 'Yes'
+                )
+            except ValueError:
+                # One broken item shouldn't cost the rest of the results
+                result = None
+
+            # Finished items aren't needed any more, so memory stays flat however long the feed is
+            element.clear()
+
+            if result:
+                yield result
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from items()
+
+    parser.close()
+    yield from items()
+
+
+def rank(results: Iterable[NyaaResult], title: str, threshold: float = 0.5) -> list[NyaaResult]:
+    """
+    Order search results by how likely they are to be torrents of an anime
+    :param title: The anime's title
+    :param threshold: How much of the title a result's title has to share to be kept at all
+    :return: The best candidates first
+    """
+    query = normalize(title)
+    grams = trigrams(query)
+    words = set(query.split())
+
+    ranked = []
+    for result in results:
+        name = normalize(result.title)
+
+        similarity = len(grams & trigrams(name)) / len(grams) if grams else 0
+
+        if similarity < threshold:
+            continue
+
+        score = (
+            similarity
+            + len(words & set(name.split())) / max(len(words), 1)
+            + math.log1p(result.seeders) / 10
+            + (0.2 if result.trusted else 0)
+            - (0.5 if result.remake else 0)
+        )
+
+        ranked.append((-score, result.id, result))
+
+    ranked.sort(key=lambda item: item[:2])
+
+    return [result for *_, result in ranked]
+
+
+class NyaaClient:
+    """
+    Resolves Nyaa.si torrent pages concurrently over pooled connections.
+
+    Pages are parsed as they arrive and the download stops as soon as both links are found.
+    Resolved torrents are remembered by ID.
+    """
+    BASE_URL = 'https://nyaa.si'
+
+    def __init__(self, workers: int = 8, chunk_size: int = 16 * 1024, timeout: float | tuple[float, float] = (5, 30)):
+        """
+        :param workers: How many pages are fetched at once
+        :param chunk_size: How many bytes of a page are parsed at a time
+        :param timeout: How many seconds to wait for Nyaa.si: to connect and between bytes, or (connect, read)
+        """
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+        self.session = requests.Session()
+        self.session.mount('https://', Transport(timeout=timeout, pool_connections=2, pool_maxsize=workers))
+
+        self.torrents: dict[int, NyaaTorrent] = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, nyaa_id: int) -> NyaaTorrent:
+        """
+        Find a torrent's magnet link and .torrent file
+        :raises NyaaError: If the page doesn't have them
+        """
+        nyaa_id = int(nyaa_id)
+
+        with self.lock:
+            if torrent := self.torrents.get(nyaa_id):
+                return torrent
 
-        html = requests.get(self.url).text
         parser = NyaaParser()
-        parser.feed(html)
 
-        self.magnet = parser.result['magnet']
-        self.file = 'https://nyaa.si' + parser.result['torrent']
+        with self.session.get(f'{self.BASE_URL}/view/{nyaa_id}', stream=True) as r:
+            r.raise_for_status()
+            r.encoding = r.encoding or 'utf-8'
+
+            # Leaving the with block drops whatever is left of the page
+            for chunk in r.iter_content(self.chunk_size, decode_unicode=True):
+                parser.feed(chunk)
+
+                if parser.done:
+                    break
+
+        if not parser.done:
+            raise NyaaError(f"Nyaa.si torrent {nyaa_id} has no magnet link or .torrent file")
+
+        torrent = NyaaTorrent(nyaa_id, parser.result['magnet'], self.BASE_URL + parser.result['torrent'], self.session)
+
+        with self.lock:
+            self.torrents[nyaa_id] = torrent
+
+        return torrent
+
+    def search(self, query: str, category: str = '1_2', trusted_only: bool = False) -> list[NyaaResult]:
+        """
+        Search Nyaa.si through its RSS feed
+        :param category: A Nyaa.si category, by default English-translated anime
+        :param trusted_only: Only include torrents from trusted uploaders
+        :return: Every result on the feed, newest first
+        :raises NyaaError: If the response isn't a feed, e.g. an error or challenge page
+        """
+        params = {'page': 'rss', 'q': query, 'c': category, 'f': 2 if trusted_only else 0}
+
+        with self.session.get(self.BASE_URL + '/', params=params, stream=True) as r:
+            r.raise_for_status()
+
+            try:
+                return list(parse_rss(r.iter_content(self.chunk_size)))
+            except ElementTree.ParseError as e:
+                raise NyaaError(f"Nyaa.si didn't send a search feed: {e}")
+
+    def search_anime(self, title: str, **kwargs) -> list[NyaaResult]:
+        """
+        Find candidate torrents for an anime
+        :param kwargs: Passed on to search()
+        :return: The results that look like the anime, best first
+        """
+        results = rank(self.search(title, **kwargs), title)
+
+        # Remember them, so that resolving a chosen result doesn't fetch its page
+        with self.lock:
+            for result in results:
+                self.torrents.setdefault(result.id, result.torrent(self.session))
+
+        return results
 
-    def download_file(self) -> bytes:
-        """Fetch the contents of the .torrent file."""
-        return requests.get(self.file).content
+    def resolve_many(self, nyaa_ids: list[int]) -> list[NyaaTorrent]:
+        """
+        Resolve several torrents at once
+        :return: The torrents, in the same order as their IDs
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(nyaa_ids)))) as pool:
+            return list(pool.map(self.resolve, nyaa_ids))
 
+    def close(self):
+        self.session.close()
@@ -0,0 +1,224 @@
+"""
+Background prefetching of metadata and signed URLs the user is likely to need next
+"""
+
+import json
+import time
+import threading
+
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from breadbox import Breadbox
+from ratelimit import TokenBucket
+from transport import measure, transferred
+
+
+class WatchHistory:
+    """
+    The anime the user recently opened, most recent first
+    """
+    def __init__(self, path: Path, limit: int = 20):
+        self.path = Path(path)
+        self.limit = limit
+
+        try:
+            with open(self.path, 'r') as f:
+                self.anime_ids: list[str] = json.load(f)
+        except (OSError, ValueError):
+            self.anime_ids = []
+
+    def add(self, anime_id):
+        anime_id = str(anime_id)
+        self.anime_ids = [anime_id] + [_id for _id in self.anime_ids if _id != anime_id][:self.limit - 1]
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.anime_ids, f)
+
+    def recent(self, count: int) -> list[str]:
+        return self.anime_ids[:count]
+
+
+class Prefetcher:
+    """
+    Warms the metadata cache and pre-signs media URLs on a background thread pool,
+    so the next menu or episode opens without waiting on the network.
+
+    Prefetching is best-effort: failures are ignored, and the foreground simply fetches as usual.
+    Metadata is only warmed when there's a metadata cache to keep it in; otherwise it would be fetched twice.
+    """
+    def __init__(
+            self,
+            breadbox: Breadbox,
+            episode_titles: Callable[[dict], dict] = None,
+            workers: int = 2,
+            bandwidth: Optional[int] = None,
+            url_ttl: float = 300,
+            highlights: int = 4
+    ):
+        """
+        :param episode_titles: Given an anime's info, returns its episode titles, e.g. from Jikan
+        :param workers: How many prefetches run at once
+        :param bandwidth: The most bytes per second prefetching may use on average, or None for no limit
+        :param url_ttl: How many seconds a pre-signed URL is trusted for
+        :param highlights: How many of the latest highlighted anime are kept waiting to be warmed, see highlight()
+        """
+        self.breadbox = breadbox
+        self.episode_titles = episode_titles
+        self.url_ttl = url_ttl
+        self.workers = workers
+
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.bandwidth = TokenBucket(bandwidth, bandwidth) if bandwidth else None
+
+        self.signed_urls: dict[tuple[str, str], tuple[float, str]] = {}
+        self.pending: set = set()
+        self.lock = threading.Lock()
+
+        # The latest highlighted anime, newest last; older ones fall off when the user scrolls past them
+        self.highlighted: deque[str] = deque(maxlen=highlights)
+        self.draining = 0
+        self.closed = False
+
+    def _claim(self, key) -> bool:
+        """Mark a task as queued, unless the same one already is."""
+        with self.lock:
+            if key in self.pending:
+                return False
+
+            self.pending.add(key)
+
+        return True
+
+    def _submit(self, key, task: Callable[[], object]):
+        """Run a task in the background unless the same one is already queued."""
+        if self._claim(key):
+            self.pool.submit(self._run, key, task)
+
+    def _run(self, key, task: Callable[[], object]):
+        """Run a claimed task within the bandwidth budget"""
+        try:
+            # Wait for the bandwidth budget to recover from earlier prefetches
+            if self.bandwidth:
+                self.bandwidth.acquire(0)
+
+            # Charge what actually came over the wire, so revalidating with a 304 is almost free
+            with measure() as responses:
+                try:
+                    task()
+                finally:
+                    if self.bandwidth:
+                        self.bandwidth.consume(transferred(responses))
+        except Exception:
+            pass  # Best-effort; the foreground will fetch it again if it's needed
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+    def _overview(self, anime_id) -> Optional[Callable[[], object]]:
+        """A task that warms an anime's screen, or None if it's already cached or there's nowhere to keep it"""
+        anime = self.breadbox.anime
+
+        if self.breadbox.cache is None:
+            return None
+
+        if anime.cached(f'/{anime_id}/media', 'media') is not None and \
+                anime.cached(f'/{anime_id}', 'info') is not None:
+            return None
+
+        return lambda: anime.overview(anime_id, self.episode_titles)
+
+    def warm(self, anime_ids):
+        """
+        Fetch the info, media list and episode titles of anime the user is likely to open.
+        """
+        for anime_id in anime_ids:
+            if task := self._overview(anime_id):
+                self._submit(('overview', str(anime_id)), task)
+
+    def highlight(self, anime_id):
+        """
+        Warm an anime the user has highlighted in a list.
+        Only the latest few highlights are kept, and the newest is warmed first,
+        so scrolling quickly through a long list doesn't queue up anime the user has already moved past.
+        """
+        if self.breadbox.cache is None:
+            return
+
+        with self.lock:
+            anime_id = str(anime_id)
+
+            if anime_id in self.highlighted:
+                self.highlighted.remove(anime_id)
+
+            self.highlighted.append(anime_id)
+
+            # The workers already draining the highlights will get to it
+            if self.draining >= self.workers:
+                return
+
+            self.draining += 1
+
+        self.pool.submit(self._drain)
+
+    def _drain(self):
+        """Warm highlighted anime, newest first, until there are none left"""
+        while True:
+            with self.lock:
+                if self.closed or not self.highlighted:
+                    self.draining -= 1
+                    return
+
+                anime_id = self.highlighted.pop()
+
+            if (task := self._overview(anime_id)) and self._claim(key := ('overview', anime_id)):
+                self._run(key, task)
+
+    def presign(self, anime_id, media_id):
+        """
+        Sign the URL of an episode or bonus file ahead of time.
+        """
+        key = (str(anime_id), str(media_id))
+
+        if self._signed(key):
+            return
+
+        def task():
+            url = self.breadbox.anime.get_media_url(anime_id, media_id)
+
+            with self.lock:
+                self.signed_urls[key] = (time.monotonic(), url)
+
+            return url
+
+        self._submit(('presign',) + key, task)
+
+    def _signed(self, key: tuple[str, str]) -> Optional[str]:
+        with self.lock:
+            if key in self.signed_urls:
+                signed, url = self.signed_urls[key]
+
+                if time.monotonic() - signed < self.url_ttl:
+                    return url
+
+                del self.signed_urls[key]
+
+        return None
+
+    def media_url(self, anime_id, media_id) -> str:
+        """
+        Get a signed URL, using a pre-signed one if it's still fresh.
+        """
+        if url := self._signed((str(anime_id), str(media_id))):
+            return url
+
+        return self.breadbox.anime.get_media_url(anime_id, media_id)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,77 @@
+"""
+Thread-safe rate limiting helpers
+"""
+
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    A token bucket that refills at a constant rate.
+
+    Every request takes one token; when the bucket is empty, acquire() blocks until a token is available.
+    """
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: How many tokens are added per second
+        :param capacity: The maximum number of tokens the bucket can hold, i.e. the allowed burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens if they are available
+        :return: 0 if the tokens were taken, else how many seconds to wait before trying again.
+        """
+        with self.lock:
+            self._refill()
+
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1):
+        """
+        Take tokens, blocking until they are available.
+        """
+        while wait := self.try_acquire(tokens):
+            time.sleep(wait)
+
+    def consume(self, tokens: float):
+        """
+        Take tokens after the fact, i.e. for bytes that were already transferred.
+        The bucket can go into debt, in which case acquire() waits until it's paid off.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= tokens
+
+
+class RateLimiter:
+    """
+    Several token buckets that all have to allow a request, e.g. a per-second and a per-minute limit.
+    """
+    def __init__(self, *buckets: TokenBucket):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until every bucket has a token, then take one from each.
+        """
+        # Only one thread queues at a time so tokens are handed out in order
+        with self.lock:
+            for bucket in self.buckets:
+                bucket.acquire()
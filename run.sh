@@ -7,7 +7,7 @@ base_path="/home/bitboard/Documents/Projects/Itadakimasu"
 . "$base_path/.venv/bin/activate"
 
 # Start the tool
-python "$base_path/app.py"
+python "$base_path/app.py" "$@"
 
 # Deactivate the virtual environment
 deactivate
@@ -0,0 +1,65 @@
+"""
+Timing of the app's startup, reported by running it with --startup-profile
+"""
+
+import sys
+import time
+import threading
+
+from contextlib import contextmanager
+
+
+class StartupProfile:
+    """
+    Records how long each step of starting up takes, on whichever thread it runs.
+    When disabled, recording does nothing, so it can be left in place.
+    """
+    def __init__(self, started: float = None, enabled: bool = True):
+        """
+        :param started: When timing started, from time.perf_counter(); by default, now
+        :param enabled: Whether anything is recorded
+        """
+        self.started = started if started is not None else time.perf_counter()
+        self.enabled = enabled
+
+        # (name, thread, start, end, modules loaded by the end)
+        self.steps: list[tuple[str, str, float, float, int]] = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.steps.append((name, threading.current_thread().name, start, end, len(sys.modules)))
+
+    @contextmanager
+    def step(self, name: str):
+        """Time the code inside the with block."""
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+
+    def mark(self, name: str):
+        """Record a point in time, e.g. when the first screen appears."""
+        now = time.perf_counter()
+        self.add(name, now, now)
+
+    def report(self, file=sys.stderr):
+        """Print every step in the order it started."""
+        if not self.enabled:
+            return
+
+        with self.lock:
+            steps = sorted(self.steps, key=lambda step: step[2])
+
+        print("Startup profile (ms since start, ms taken, thread, modules loaded, step)", file=file)
+
+        for name, thread, start, end, modules in steps:
+            print(
+                f"{(start - self.started) * 1000:9.1f} {(end - start) * 1000:9.1f}  {thread:<12} {modules:5}  {name}",
+                file=file
+            )
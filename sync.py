@@ -0,0 +1,246 @@
+"""
+Keeps a local snapshot of an archive's listing up to date by fetching only what changed
+"""
+
+import gzip
+import json
+import time
+import threading
+import email.utils
+
+from pathlib import Path
+from typing import Optional
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from transport import measure
+
+# How many seconds the next changes request reaches back past the server's clock.
+# Date headers are rounded down to the second and stamped after the changes were gathered; fetching an entry twice is harmless.
+CURSOR_OVERLAP = 2
+
+
+def server_time(responses: list[requests.Response]) -> Optional[float]:
+    """
+    When the server answered, by its own clock, from the latest Date header among the responses
+    :return: A Unix timestamp, or None if none of them say
+    """
+    for r in reversed(responses):
+        if date := r.headers.get('Date'):
+            try:
+                return email.utils.parsedate_to_datetime(date).timestamp()
+            except (TypeError, ValueError):
+                continue
+
+    return None
+
+
+class CatalogSnapshot:
+    """
+    Every entry of an archive listing, stored on disk as gzipped JSON
+    """
+    def __init__(self, path: Optional[Path] = None):
+        """
+        :param path: Where the snapshot is stored between runs, or None to only keep it in memory
+        """
+        self.path = Path(path) if path else None
+
+        self.entries: dict[str, dict] = {}
+        self.size = None
+        self.synced: float = 0
+        self.changes_supported: Optional[bool] = None
+
+        # Where the next changes request starts: a cursor the server gave, or a time by the server's clock
+        self.cursor: Optional[float | str] = None
+
+        # When the whole listing was last compared with the snapshot, by the client's clock
+        self.reconciled: float = 0
+
+        self.load()
+
+    def load(self):
+        """Read the snapshot from disk."""
+        if not self.path:
+            return
+
+        try:
+            with gzip.open(self.path, 'rt') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.entries = stored['entries']
+        self.size = stored['size']
+        self.synced = stored['synced']
+        self.changes_supported = stored.get('changes_supported')
+        self.cursor = stored.get('cursor')
+        self.reconciled = stored.get('reconciled', 0)
+
+    def save(self):
+        """Write the snapshot to disk."""
+        if not self.path:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+
+        with gzip.open(tmp, 'wt') as f:
+            json.dump({
+                'entries': self.entries,
+                'size': self.size,
+                'synced': self.synced,
+                'changes_supported': self.changes_supported,
+                'cursor': self.cursor,
+                'reconciled': self.reconciled
+            }, f, separators=(',', ':'))
+
+        tmp.replace(self.path)
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.synced
+
+
+class CatalogSync:
+    """
+    Refreshes a snapshot of an archive's listing with as little transfer as possible.
+
+    In order of preference:
+        1. the server's changes endpoint, if it has one
+        2. comparing list_ids() with the snapshot, then fetching only new entries concurrently
+        3. the full listing, when the size changed or the snapshot hasn't been reconciled for reconcile_interval,
+           since entries edited in place keep their IDs. It's revalidated with its ETag, so it costs a 304 if nothing changed.
+    """
+    def __init__(
+            self,
+            archive,
+            snapshot: CatalogSnapshot,
+            workers: int = 8,
+            max_age: float = 60,
+            reconcile_interval: float = 3600
+    ):
+        """
+        :param archive: The archive wrapper to sync, e.g. breadbox.anime
+        :param workers: How many entries are fetched at once
+        :param max_age: How many seconds the snapshot is trusted before it's checked against the archive
+        :param reconcile_interval: Without a changes endpoint, how many seconds pass before the full listing is checked
+        """
+        self.archive = archive
+        self.snapshot = snapshot
+        self.workers = workers
+        self.max_age = max_age
+        self.reconcile_interval = reconcile_interval
+
+        self.lock = threading.Lock()
+
+    def refresh(self, force: bool = False) -> dict[str, dict]:
+        """
+        Bring the snapshot up to date
+        :param force: Check the archive even if the snapshot is recent
+        :return: Information on every entry by ID, like all_info()
+        """
+        with self.lock:
+            snapshot = self.snapshot
+
+            if not force and snapshot.entries and snapshot.age < self.max_age:
+                return snapshot.entries
+
+            started = time.time()
+            cursor = None
+
+            with measure() as responses:
+                if not snapshot.entries:
+                    self._reconcile(started)
+                elif (changes := self._apply_changes()) is None:
+                    self._diff(started)
+                else:
+                    cursor = changes.get('cursor')
+
+            # Changes are asked for by the server's clock, which the client's may not agree with
+            if cursor is None:
+                now = server_time(responses)
+                cursor = now - CURSOR_OVERLAP if now is not None else started
+
+            snapshot.cursor = cursor
+            snapshot.synced = started
+            snapshot.save()
+
+            return snapshot.entries
+
+    def forget(self, _id):
+        """Drop an entry so that it's fetched again on the next refresh, e.g. after editing it."""
+        with self.lock:
+            self.snapshot.entries.pop(str(_id), None)
+
+    def _fetch(self, ids):
+        """Fetch entries concurrently and put them in the snapshot"""
+        ids = list(ids)
+
+        # Past the metadata cache, which may still hold the entry from before it changed
+        fetch = partial(self.archive.info, fresh=True)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for _id, info in zip(ids, pool.map(fetch, ids)):
+                self.snapshot.entries[_id] = info
+
+    def _reconcile(self, started: float, size=None):
+        """
+        Replace the snapshot with the full listing
+        :param size: The archive's size, if it's already been fetched
+        """
+        snapshot = self.snapshot
+
+        snapshot.entries = self.archive.all_info(fresh=True)
+        snapshot.size = size if size is not None else self.archive.size(fresh=True)
+        snapshot.reconciled = started
+
+    def _apply_changes(self) -> Optional[dict]:
+        """
+        Ask the server what changed since the last sync
+        :return: The changes, or None if they couldn't be used and the snapshot has to be compared instead
+        """
+        snapshot = self.snapshot
+
+        if snapshot.changes_supported is False:
+            return None
+
+        try:
+            changes = self.archive.changes(snapshot.cursor if snapshot.cursor is not None else snapshot.synced)
+        except (requests.RequestException, ValueError):
+            # A failure this once says nothing about whether the server has the endpoint
+            return None
+
+        # Only a server that says it has no such endpoint is never asked again
+        snapshot.changes_supported = changes is not None
+
+        if changes is None:
+            return None
+
+        for _id in changes.get('removed', ()):
+            snapshot.entries.pop(str(_id), None)
+
+        self._fetch(str(_id) for _id in changes.get('changed', ()))
+
+        return changes
+
+    def _diff(self, started: float):
+        """Compare the archive's IDs and size with the snapshot's, and fetch what's new or changed"""
+        snapshot = self.snapshot
+
+        ids = {str(_id) for _id in self.archive.list_ids(fresh=True)}
+        size = self.archive.size(fresh=True)
+
+        # Entries may have been edited in place, and the IDs don't say which. The full listing covers that;
+        # the size only moves on once it's been fetched, so a failure retries.
+        if size != snapshot.size or started - snapshot.reconciled > self.reconcile_interval:
+            self._reconcile(started, size)
+            return
+
+        known = set(snapshot.entries)
+
+        for _id in known - ids:
+            del snapshot.entries[_id]
+
+        self._fetch(ids - known)
@@ -0,0 +1,67 @@
+"""
+A local HTTP server for tests, answering with whatever a test's handler function says
+"""
+
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable
+
+
+class StubServer:
+    """
+    Serves requests on a random local port with a handler function, until it's closed:
+        with StubServer(lambda request: request.reply(200, b'hello')) as server:
+            requests.get(server.url + '/')
+
+    Every request's path is recorded in requests, in the order they arrived.
+    """
+    def __init__(self, handle: Callable[[BaseHTTPRequestHandler], None]):
+        """
+        :param handle: Called with the request handler for every request; it sends the response, e.g. with reply()
+        """
+        self.handle = handle
+        self.requests: list[str] = []
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status: int, body: bytes = b'', headers: dict = None):
+                self.send_response(status)
+
+                for name, value in {'Content-Length': str(len(body)), **(headers or {})}.items():
+                    self.send_header(name, value)
+
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+
+                try:
+                    stub.handle(self)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            do_PATCH = do_GET
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
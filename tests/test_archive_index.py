@@ -0,0 +1,56 @@
+import unittest
+
+from archive_index import ArchiveIndex, parse_query
+
+CATALOG = {
+    '1': {
+        'title': 'Re:Zero kara Hajimeru Isekai Seikatsu',
+        'audio': ['japanese'],
+        'subtitles': ['english'],
+        'external': {'myanimelist': 'https://myanimelist.net/anime/31240'}
+    },
+    '2': {
+        'title': 'Steins;Gate 0',
+        'audio': ['japanese', 'english'],
+        'subtitles': ['english'],
+        'external': {'myanimelist': 'https://myanimelist.net/anime/30484'}
+    }
+}
+
+
+class ParseQueryTest(unittest.TestCase):
+    def test_known_sites_filter_by_id(self):
+        self.assertEqual(parse_query('mal:21')['external'], {'myanimelist': '21'})
+        self.assertEqual(parse_query('anilist:21')['external'], {'anilist': '21'})
+
+    def test_other_words_with_colons_are_titles(self):
+        self.assertEqual(parse_query('re:zero'), {'title': 're zero', 'audio': [], 'subtitles': [], 'external': {}})
+        self.assertEqual(parse_query('steins;gate 0: english dub')['title'], 'steins gate 0')
+
+    def test_languages(self):
+        query = parse_query('japanese audio and subs:english')
+
+        self.assertEqual(query['audio'], ['japanese'])
+        self.assertEqual(query['subtitles'], ['english'])
+        self.assertIsNone(query['title'])
+
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        self.index = ArchiveIndex(':memory:')
+        self.index.sync(CATALOG)
+        self.addCleanup(self.index.close)
+
+    def test_title_with_a_colon(self):
+        self.assertEqual(list(self.index.search('re:zero')), ['1'])
+        self.assertEqual(list(self.index.search('steins;gate 0:')), ['2'])
+
+    def test_external_id(self):
+        self.assertEqual(list(self.index.search('mal:30484')), ['2'])
+
+    def test_languages(self):
+        self.assertEqual(list(self.index.search('english audio')), ['2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
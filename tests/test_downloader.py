@@ -0,0 +1,134 @@
+import os
+import base64
+import hashlib
+import tempfile
+import unittest
+
+from pathlib import Path
+
+import requests
+
+from downloader import Downloader, DownloadJournal, IntegrityError
+from tests.stub_server import StubServer
+
+FILE = os.urandom(1000)
+
+
+def digest(data: bytes) -> str:
+    return 'sha-256=:' + base64.b64encode(hashlib.sha256(data).digest()).decode() + ':'
+
+
+def ranged(request, data: bytes = FILE, headers: dict = None):
+    """Answer a Range request for part of data the way Breadbox does"""
+    start, end = map(int, request.headers['Range'].removeprefix('bytes=').split('-'))
+
+    request.reply(206, data[start:end + 1], {
+        'Content-Range': f'bytes {start}-{end}/{len(data)}',
+        'ETag': '"1"',
+        **(headers or {})
+    })
+
+
+def downloader(server: StubServer) -> Downloader:
+    """A downloader for the server's file, with small segments, one at a time so the order is known"""
+    session = requests.Session()
+
+    return Downloader(
+        lambda **kwargs: session.get(server.url + '/file', stream=True, **kwargs),
+        segment_size=100,
+        workers=1,
+        chunk_size=50,
+        checkpoint_interval=0.01
+    )
+
+
+class ResumeTest(unittest.TestCase):
+    def test_interrupted_download_resumes(self):
+        failing = True
+        fetched = []
+
+        def handle(request):
+            fetched.append(request.headers['Range'])
+
+            if failing and request.headers['Range'] == 'bytes=500-599':
+                request.reply(503)
+            else:
+                ranged(request, headers={'Repr-Digest': digest(FILE)})
+
+        with StubServer(handle) as server, tempfile.TemporaryDirectory() as folder:
+            destination = Path(folder) / 'episode.mp4'
+            part, journal_path = Downloader.partial_paths(destination)
+
+            with self.assertRaises(requests.HTTPError):
+                downloader(server).download(destination)
+
+            self.assertFalse(destination.exists())
+            self.assertTrue(part.is_file())
+
+            done = DownloadJournal.load(journal_path).done
+            self.assertEqual(done[0], [0, 499])
+
+            failing = False
+            fetched.clear()
+
+            progress = downloader(server).download(destination)
+
+            self.assertEqual(destination.read_bytes(), FILE)
+            self.assertEqual(progress.resumed, sum(end - start + 1 for start, end in done))
+            self.assertFalse(part.exists())
+            self.assertFalse(journal_path.exists())
+
+        # Only the probe and the ranges that were missing were asked for again
+        self.assertEqual(fetched[0], 'bytes=0-0')
+
+        for header in fetched[1:]:
+            start, end = map(int, header.removeprefix('bytes=').split('-'))
+            self.assertFalse(any(start <= _end and _start <= end for _start, _end in done), header)
+
+    def test_changed_file_starts_over(self):
+        with StubServer(ranged) as server, tempfile.TemporaryDirectory() as folder:
+            destination = Path(folder) / 'episode.mp4'
+            part, journal_path = Downloader.partial_paths(destination)
+
+            # A partial download of a different version of the file
+            part.write_bytes(b'\0' * len(FILE))
+            DownloadJournal(journal_path, len(FILE), etag='"0"', done=[[0, 499]]).save()
+
+            downloader(server).download(destination)
+
+            self.assertEqual(destination.read_bytes(), FILE)
+
+
+class ChecksumTest(unittest.TestCase):
+    def test_mismatch_is_rejected(self):
+        def handle(request):
+            ranged(request, headers={'Repr-Digest': digest(b'something else')})
+
+        with StubServer(handle) as server, tempfile.TemporaryDirectory() as folder:
+            destination = Path(folder) / 'episode.mp4'
+            part, journal_path = Downloader.partial_paths(destination)
+
+            with self.assertRaises(IntegrityError):
+                downloader(server).download(destination)
+
+            # Nothing corrupt is left behind to be resumed or played
+            self.assertFalse(destination.exists())
+            self.assertFalse(part.exists())
+            self.assertFalse(journal_path.exists())
+
+    def test_mismatch_in_a_single_stream_is_rejected(self):
+        def handle(request):
+            request.reply(200, FILE, {'X-Checksum-Sha256': hashlib.sha256(b'something else').hexdigest()})
+
+        with StubServer(handle) as server, tempfile.TemporaryDirectory() as folder:
+            destination = Path(folder) / 'episode.mp4'
+
+            with self.assertRaises(IntegrityError):
+                downloader(server).download(destination)
+
+            self.assertFalse(destination.exists())
+            self.assertFalse(Downloader.partial_paths(destination)[0].exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+from pathlib import Path
+
+from nyaa import NyaaClient, NyaaError, parse_rss, rank
+from tests.stub_server import StubServer
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+class ParseRSSTest(unittest.TestCase):
+    def setUp(self):
+        self.feed = (FIXTURES / 'nyaa_search.rss').read_bytes()
+
+    def test_reads_every_item(self):
+        results = list(parse_rss([self.feed]))
+
+        # The last item's seeder count isn't a number, so it's skipped
+        self.assertEqual([result.id for result in results], [1040000, 1030500, 1050003])
+
+        first = results[0]
+        self.assertEqual(first.seeders, 48)
+        self.assertEqual(first.size, int(16.3 * 1024 ** 3))
+        self.assertEqual(first.infohash, 'ab12cd34ef56ab12cd34ef56ab12cd34ef56ab12')
+        self.assertTrue(first.trusted)
+        self.assertTrue(results[1].remake)
+
+    def test_feed_split_into_small_chunks(self):
+        chunks = [self.feed[n:n + 7] for n in range(0, len(self.feed), 7)]
+
+        self.assertEqual(
+            [result.to_dict() for result in parse_rss(chunks)],
+            [result.to_dict() for result in parse_rss([self.feed])]
+        )
+
+    def test_magnet_links_come_from_the_info_hash(self):
+        result = next(parse_rss([self.feed]))
+
+        self.assertTrue(result.magnet.startswith('magnet:?xt=urn:btih:ab12cd34ef56ab12cd34ef56ab12cd34ef56ab12&dn='))
+        self.assertEqual(result.torrent().file, 'https://nyaa.si/download/1040000.torrent')
+
+
+class RankTest(unittest.TestCase):
+    def setUp(self):
+        self.results = list(parse_rss([(FIXTURES / 'nyaa_search.rss').read_bytes()]))
+
+    def test_best_match_first_and_unrelated_results_dropped(self):
+        ranked = rank(self.results, 'Shoujo Kageki Revue Starlight')
+
+        # The remake has more seeders, but a worse title match and the remake penalty
+        self.assertEqual([result.id for result in ranked], [1040000, 1030500])
+
+    def test_nothing_similar(self):
+        self.assertEqual(rank(self.results, 'Completely Different Show'), [])
+
+
+class SearchTest(unittest.TestCase):
+    def test_feed(self):
+        feed = (FIXTURES / 'nyaa_search.rss').read_bytes()
+
+        with StubServer(lambda request: request.reply(200, feed, {'Content-Type': 'application/rss+xml'})) as server:
+            client = NyaaClient()
+            client.BASE_URL = server.url
+
+            try:
+                results = client.search_anime('Revue Starlight')
+            finally:
+                client.close()
+
+        self.assertEqual(results[0].id, 1040000)
+        self.assertIn('page=rss', server.requests[0])
+
+    def test_html_instead_of_a_feed(self):
+        page = b'<html><body><h1>Checking your browser<br></h1></body></html>'
+
+        with StubServer(lambda request: request.reply(200, page, {'Content-Type': 'text/html'})) as server:
+            client = NyaaClient()
+            client.BASE_URL = server.url
+
+            try:
+                with self.assertRaises(NyaaError):
+                    client.search('revue starlight')
+            finally:
+                client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import json
+import tempfile
+import unittest
+
+from breadbox import Breadbox
+from tests.stub_server import StubServer
+
+
+class FakeArchive:
+    """An archive server without a changes endpoint, whose entries can be edited in place"""
+    def __init__(self):
+        self.entries = {'1': {'title': 'A'}}
+        self.changes = None
+
+    def handle(self, request):
+        path, _, query = request.path.partition('?')
+        path = path.removeprefix('/archive/anime')
+
+        if path == '/':
+            body = list(self.entries)
+        elif path == '/size':
+            body = len(json.dumps(self.entries))
+        elif path == '/all':
+            body = self.entries
+        elif path == '/changes':
+            if self.changes is None:
+                return request.reply(404)
+            if isinstance(self.changes, int):
+                return request.reply(self.changes)
+            body = self.changes
+        else:
+            body = self.entries[path.strip('/')]
+
+        request.reply(200, json.dumps(body).encode())
+
+
+class DiffTest(unittest.TestCase):
+    def setUp(self):
+        self.archive = FakeArchive()
+        self.server = StubServer(self.archive.handle)
+        self.folder = tempfile.TemporaryDirectory()
+        self.breadbox = Breadbox(self.server.url, 'k' * 16, cache_folder=self.folder.name, retries=0)
+
+    def tearDown(self):
+        self.breadbox.close()
+        self.server.close()
+        self.folder.cleanup()
+
+    def test_new_entries_are_fetched_on_their_own(self):
+        anime = self.breadbox.anime
+        anime.catalog()
+
+        # Same size, so only the new ID is fetched
+        self.archive.entries['2'] = {'title': 'B'}
+        anime.sync.snapshot.size = len(json.dumps(self.archive.entries))
+        self.server.requests.clear()
+
+        self.assertEqual(anime.catalog(force=True)['2'], {'title': 'B'})
+        self.assertNotIn('/archive/anime/all', self.server.requests)
+        self.assertIn('/archive/anime/2', self.server.requests)
+
+    def test_edits_in_place_are_picked_up_when_the_size_changes(self):
+        anime = self.breadbox.anime
+        anime.catalog()
+
+        self.archive.entries['1'] = {'title': 'A longer title'}
+
+        self.assertEqual(anime.catalog(force=True)['1'], {'title': 'A longer title'})
+
+    def test_edits_in_place_are_picked_up_when_reconciling(self):
+        anime = self.breadbox.anime
+        anime.catalog()
+
+        self.archive.entries['1'] = {'title': 'Z'}
+        anime.sync.snapshot.reconciled = 0
+
+        self.assertEqual(anime.catalog(force=True)['1'], {'title': 'Z'})
+
+
+class ChangesTest(unittest.TestCase):
+    def setUp(self):
+        self.archive = FakeArchive()
+        self.server = StubServer(self.archive.handle)
+        self.breadbox = Breadbox(self.server.url, 'k' * 16, retries=0)
+
+    def tearDown(self):
+        self.breadbox.close()
+        self.server.close()
+
+    def test_server_errors_do_not_turn_the_endpoint_off(self):
+        anime = self.breadbox.anime
+        anime.catalog()
+
+        self.archive.changes = 503
+        anime.catalog(force=True)
+
+        self.assertIsNone(anime.sync.snapshot.changes_supported)
+
+        self.archive.changes = {'changed': ['1'], 'removed': []}
+        self.archive.entries['1'] = {'title': 'B'}
+
+        self.assertEqual(anime.catalog(force=True)['1'], {'title': 'B'})
+        self.assertTrue(anime.sync.snapshot.changes_supported)
+
+    def test_missing_endpoint_is_remembered(self):
+        anime = self.breadbox.anime
+        anime.catalog()
+        anime.catalog(force=True)
+
+        self.assertFalse(anime.sync.snapshot.changes_supported)
+
+    def test_changes_are_asked_for_by_the_server_clock(self):
+        anime = self.breadbox.anime
+        anime.catalog()
+
+        # Far off the client's clock, as if it were wrong
+        anime.sync.snapshot.cursor = 1000
+        self.archive.changes = {'changed': [], 'removed': [], 'cursor': 'abc'}
+        anime.catalog(force=True)
+
+        self.assertIn('/archive/anime/changes?since=1000', self.server.requests)
+        self.assertEqual(anime.sync.snapshot.cursor, 'abc')
+
+        anime.catalog(force=True)
+
+        self.assertIn('/archive/anime/changes?since=abc', self.server.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
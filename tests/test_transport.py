@@ -0,0 +1,349 @@
+import json
+import time
+import asyncio
+import tempfile
+import unittest
+
+from unittest import mock
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from breadbox import Breadbox, get_user_info
+from breadbox_async import AsyncBreadbox, CircuitOpenError as AsyncCircuitOpenError
+from transport import Transport, CircuitOpenError, measure, transferred, retry_after
+from tests.stub_server import StubServer
+
+
+def session(**options) -> requests.Session:
+    """A session with a fast Transport, so failing tests don't take long"""
+    s = requests.Session()
+    s.mount('http://', Transport(**{'timeout': (1, 0.3), 'backoff': 0.01, **options}))
+    return s
+
+
+def stall(request, body: bytes = b'x' * 100, sent: int = 10):
+    """Send the headers and the start of the body, then stop answering"""
+    request.send_response(200)
+    request.send_header('Content-Length', str(len(body)))
+    request.end_headers()
+    request.wfile.write(body[:sent])
+    request.wfile.flush()
+    time.sleep(1)
+
+
+class RetryTest(unittest.TestCase):
+    def test_server_errors_are_retried(self):
+        def handle(request):
+            request.reply(503 if len(server.requests) < 3 else 200, b'ok')
+
+        with StubServer(handle) as server:
+            r = session().get(server.url + '/flaky')
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, b'ok')
+        self.assertEqual(len(server.requests), 3)
+
+    def test_retries_run_out(self):
+        with StubServer(lambda request: request.reply(502)) as server:
+            r = session(retries=2, threshold=10).get(server.url + '/')
+
+        self.assertEqual(r.status_code, 502)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        with StubServer(lambda request: request.reply(404)) as server:
+            r = session().get(server.url + '/missing')
+
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_retry_after(self):
+        def handle(request):
+            if len(server.requests) == 1:
+                request.reply(429, headers={'Retry-After': '1'})
+            else:
+                request.reply(200, b'ok')
+
+        with StubServer(handle) as server:
+            started = time.monotonic()
+            r = session().get(server.url + '/limited')
+
+        self.assertEqual(r.status_code, 200)
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+
+    def test_retry_after_longer_than_max_wait_is_returned(self):
+        with StubServer(lambda request: request.reply(429, headers={'Retry-After': '120'})) as server:
+            r = session(max_wait=5).get(server.url + '/')
+
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_every_attempt_is_throttled(self):
+        calls = []
+
+        def handle(request):
+            request.reply(503 if len(server.requests) < 3 else 200, b'ok')
+
+        with StubServer(handle) as server:
+            session(throttle=lambda: calls.append(len(server.requests))).get(server.url + '/')
+
+        # Before the first request and before each retry
+        self.assertEqual(calls, [0, 1, 2])
+
+    def test_retry_after_as_a_date(self):
+        r = requests.Response()
+        r.headers['Retry-After'] = 'Wed, 21 Oct 2015 07:28:00 GMT'
+
+        self.assertEqual(retry_after(r), 0)
+
+
+class TimeoutTest(unittest.TestCase):
+    def test_hung_server(self):
+        with StubServer(lambda request: time.sleep(2)) as server:
+            started = time.monotonic()
+
+            with self.assertRaises(requests.Timeout):
+                session(retries=1).get(server.url + '/hang')
+
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_stalled_body_is_retried(self):
+        def handle(request):
+            if len(server.requests) == 1:
+                stall(request)
+            else:
+                request.reply(200, b'x' * 100)
+
+        with StubServer(handle) as server:
+            r = session().get(server.url + '/body')
+
+        self.assertEqual(r.content, b'x' * 100)
+        self.assertEqual(len(server.requests), 2)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_and_fails_fast(self):
+        with StubServer(lambda request: request.reply(503)) as server:
+            s = session(retries=0, threshold=3, cooldown=60)
+
+            for _ in range(3):
+                s.get(server.url + '/')
+
+            with self.assertRaises(CircuitOpenError):
+                s.get(server.url + '/')
+
+        self.assertEqual(len(server.requests), 3)
+
+    def test_stalled_bodies_open_the_circuit(self):
+        with StubServer(stall) as server:
+            s = session(retries=0, threshold=3, cooldown=60)
+
+            for _ in range(3):
+                with self.assertRaises(requests.ConnectionError):
+                    s.get(server.url + '/')
+
+            breaker = s.get_adapter(server.url).breaker(server.url)
+
+            self.assertTrue(breaker.open)
+            self.assertEqual(breaker.failures, 3)
+
+    def test_stalled_streamed_bodies_open_the_circuit(self):
+        with StubServer(stall) as server:
+            s = session(retries=0, threshold=2, cooldown=60)
+
+            for _ in range(2):
+                with s.get(server.url + '/', stream=True) as r:
+                    with self.assertRaises(requests.ConnectionError):
+                        b''.join(r.iter_content(16))
+
+            with self.assertRaises(CircuitOpenError):
+                s.get(server.url + '/', stream=True)
+
+    def test_closes_again_when_the_host_is_back(self):
+        def handle(request):
+            request.reply(503 if len(server.requests) <= 2 else 200, b'ok')
+
+        with StubServer(handle) as server:
+            s = session(retries=0, threshold=2, cooldown=0.2)
+
+            s.get(server.url + '/')
+            s.get(server.url + '/')
+
+            with self.assertRaises(CircuitOpenError):
+                s.get(server.url + '/')
+
+            time.sleep(0.3)
+
+            self.assertEqual(s.get(server.url + '/').status_code, 200)
+            self.assertFalse(s.get_adapter(server.url).breaker(server.url).open)
+
+    def test_interrupted_trial_does_not_block_the_host(self):
+        with StubServer(lambda request: request.reply(200, b'ok')) as server:
+            s = session(retries=0, threshold=1, cooldown=0)
+            breaker = s.get_adapter(server.url).breaker(server.url)
+            breaker.failure()
+
+            with mock.patch.object(HTTPAdapter, 'send', side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    s.get(server.url + '/')
+
+            self.assertFalse(breaker.trial)
+            self.assertEqual(s.get(server.url + '/').status_code, 200)
+
+
+class MeasureTest(unittest.TestCase):
+    def test_counts_body_bytes(self):
+        def handle(request):
+            if request.headers.get('If-None-Match'):
+                request.reply(304)
+            else:
+                request.reply(200, b'x' * 1000, {'ETag': '"1"'})
+
+        with StubServer(handle) as server:
+            s = session()
+
+            with measure() as responses:
+                s.get(server.url + '/')
+
+            self.assertEqual(transferred(responses), 1000)
+
+            with measure() as responses:
+                s.get(server.url + '/', headers={'If-None-Match': '"1"'})
+
+            self.assertEqual(transferred(responses), 0)
+
+
+class CacheFallbackTest(unittest.TestCase):
+    def test_cached_metadata_while_the_server_is_down(self):
+        down = False
+
+        def handle(request):
+            if down:
+                request.reply(502)
+            else:
+                request.reply(200, json.dumps({'title': 'A'}).encode())
+
+        with StubServer(handle) as server, tempfile.TemporaryDirectory() as folder:
+            breadbox = Breadbox(server.url, 'k' * 16, cache_folder=folder, retries=0)
+            breadbox.session.get_adapter(server.url).threshold = 2
+
+            self.assertEqual(breadbox.anime.info(1), {'title': 'A'})
+
+            down = True
+
+            for _ in range(3):
+                self.assertEqual(breadbox.anime.info(1, fresh=False), {'title': 'A'})
+                breadbox.anime.breadbox.cache.get(server.url + '/archive/anime/1').stored = 0
+
+            # The circuit is open, so the last attempt didn't reach the server
+            self.assertEqual(len(server.requests), 3)
+
+            # Decisions about what to change need the server's copy
+            with self.assertRaises(requests.RequestException):
+                breadbox.anime.info(1, fresh=True)
+
+            breadbox.close()
+
+    def test_unknown_id_is_an_error_when_strict(self):
+        def handle(request):
+            request.reply(404, json.dumps({'error': 'Not found'}).encode())
+
+        with StubServer(handle) as server, tempfile.TemporaryDirectory() as folder:
+            for cache_folder in (None, folder):
+                breadbox = Breadbox(server.url, 'k' * 16, cache_folder=cache_folder, retries=0)
+
+                self.assertEqual(breadbox.anime.info(9), {'error': 'Not found'})
+
+                with self.assertRaises(requests.HTTPError):
+                    breadbox.anime.info(9, strict=True)
+
+                with self.assertRaises(requests.HTTPError):
+                    breadbox.anime.list_media(9, strict=True)
+
+                breadbox.close()
+
+
+class AsyncTest(unittest.TestCase):
+    def test_server_errors_are_retried(self):
+        def handle(request):
+            request.reply(503 if len(server.requests) < 3 else 200, b'{"title": "A"}')
+
+        async def fetch():
+            async with AsyncBreadbox(server.url, 'k' * 16, backoff=0.01) as breadbox:
+                return await breadbox.anime.info(1)
+
+        with StubServer(handle) as server:
+            self.assertEqual(asyncio.run(fetch()), {'title': 'A'})
+
+        self.assertEqual(len(server.requests), 3)
+
+    def test_hung_server(self):
+        async def fetch():
+            async with AsyncBreadbox(server.url, 'k' * 16, timeout=(1, 0.3), retries=0) as breadbox:
+                await breadbox.fetch('/hang')
+
+        with StubServer(lambda request: time.sleep(2)) as server:
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(fetch())
+
+    def test_circuit_opens(self):
+        async def fetch():
+            async with AsyncBreadbox(server.url, 'k' * 16, retries=0) as breadbox:
+                for _ in range(5):
+                    await breadbox.fetch('/')
+
+                await breadbox.fetch('/')
+
+        with StubServer(lambda request: request.reply(503)) as server:
+            with self.assertRaises(AsyncCircuitOpenError):
+                asyncio.run(fetch())
+
+        self.assertEqual(len(server.requests), 5)
+
+    def test_user_info(self):
+        status = 200
+
+        async def user_info():
+            async with AsyncBreadbox(server.url, 'k' * 16, retries=0) as breadbox:
+                return await breadbox.user_info()
+
+        with StubServer(lambda request: request.reply(status, b'{"username": "a"}')) as server:
+            self.assertEqual(asyncio.run(user_info()), {'username': 'a'})
+
+            # The same answers as the blocking wrapper's get_user_info()
+            for status in (401, 403, 404):
+                self.assertIsNone(asyncio.run(user_info()))
+                self.assertIsNone(get_user_info(server.url, 1))
+
+            status = 500
+
+            with self.assertRaises(aiohttp.ClientResponseError):
+                asyncio.run(user_info())
+
+            with self.assertRaises(requests.HTTPError):
+                get_user_info(server.url, 1, timeout=1)
+
+    def test_patch_drops_cached_entry(self):
+        def handle(request):
+            if request.command == 'PATCH':
+                request.rfile.read(int(request.headers['Content-Length']))
+
+            request.reply(200, b'{}')
+
+        async def patch(folder):
+            async with AsyncBreadbox(server.url, 'k' * 16, cache_folder=folder) as breadbox:
+                await breadbox.anime.info(1)
+                await breadbox.anime.patch('/1', {'title': 'B'})
+                await breadbox.anime.info(1)
+
+        with StubServer(handle) as server, tempfile.TemporaryDirectory() as folder:
+            asyncio.run(patch(folder))
+
+        # The entry was fetched again after the patch, instead of coming from the cache
+        self.assertEqual(server.requests, ['/archive/anime/1'] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import tempfile
+import unittest
+
+from pathlib import Path
+
+import requests
+
+from uploads import ResumableUpload
+
+
+class FakeUploadServer:
+    """Takes Content-Range uploads the way ResumableUpload expects, and already has the first received bytes"""
+    def __init__(self, total: int, received: int = 0):
+        self.total = total
+        self.data = bytearray(received)
+        self.ranges: list[str] = []
+
+    def put(self, data: bytes = b'', headers: dict = None) -> requests.Response:
+        content_range = headers['Content-Range']
+        self.ranges.append(content_range)
+
+        if not content_range.startswith('bytes */'):
+            start = int(content_range.split()[1].split('-')[0])
+            self.data[start:start + len(data)] = data
+
+        r = requests.Response()
+
+        if len(self.data) < self.total:
+            r.status_code = 308
+            if self.data:
+                r.headers['Range'] = f'bytes=0-{len(self.data) - 1}'
+        else:
+            r.status_code = 200
+
+        return r
+
+
+class ResumableUploadTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+
+        self.file = Path(folder.name) / 'video.mp4'
+        self.file.write_bytes(bytes(range(256)) * 40)
+
+    def test_resume_continues_where_an_earlier_run_stopped(self):
+        server = FakeUploadServer(self.file.stat().st_size, received=4096)
+
+        r = ResumableUpload(server.put, self.file, chunk_size=4096, resume=True).upload()
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(server.ranges[0], f'bytes */{server.total}')
+        self.assertEqual(server.ranges[1], f'bytes 4096-8191/{server.total}')
+        self.assertEqual(len(server.ranges), 3)
+        self.assertEqual(bytes(server.data[4096:]), self.file.read_bytes()[4096:])
+
+    def test_resume_when_the_server_has_everything(self):
+        server = FakeUploadServer(self.file.stat().st_size, received=self.file.stat().st_size)
+
+        r = ResumableUpload(server.put, self.file, resume=True).upload()
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(server.ranges), 1)
+
+    def test_without_resume_starts_from_the_beginning(self):
+        server = FakeUploadServer(self.file.stat().st_size)
+
+        ResumableUpload(server.put, self.file, chunk_size=4096).upload()
+
+        self.assertTrue(server.ranges[0].startswith('bytes 0-4095/'))
+        self.assertEqual(bytes(server.data), self.file.read_bytes())
+
+    def test_server_unreachable_while_asking_how_much_arrived(self):
+        server = FakeUploadServer(self.file.stat().st_size)
+        put = server.put
+        failures = iter([True, True, True])
+
+        def flaky(data: bytes = b'', headers: dict = None):
+            # The second piece and the status probe after it fail, then the server comes back
+            if len(server.ranges) >= 1 and next(failures, False):
+                server.ranges.append('failed')
+                raise requests.ConnectionError
+            return put(data, headers)
+
+        r = ResumableUpload(flaky, self.file, chunk_size=4096, backoff=0).upload()
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(server.ranges.count('failed'), 3)
+        self.assertEqual(bytes(server.data), self.file.read_bytes())
+
+    def test_retries_run_out_while_the_server_is_unreachable(self):
+        def down(data: bytes = b'', headers: dict = None):
+            calls.append(headers['Content-Range'])
+            raise requests.ConnectionError
+
+        calls = []
+
+        with self.assertRaises(requests.ConnectionError):
+            ResumableUpload(down, self.file, retries=3, backoff=0).upload()
+
+        # Every attempt counts, status probes included
+        self.assertEqual(len(calls), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,289 @@
+"""
+Copies anime thumbnails from MyAnimeList (through Jikan) to the archive, many at a time
+"""
+
+import io
+import json
+import hashlib
+import tempfile
+import threading
+
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from breadbox import Breadbox
+from jikan import Jikan
+from downloader import ChecksumVerifier, MiB
+from transport import Transport
+
+
+def resize_image(data: bytes, max_size: int = None, quality: int = 85) -> bytes:
+    """
+    Scale an image down to fit in a max_size square and recompress it as a progressive JPEG.
+    Needs Pillow, which is only imported here, so nothing else depends on it.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+
+        if max_size:
+            image.thumbnail((max_size, max_size))
+
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+
+    return output.getvalue()
+
+
+def hashing(chunks: Iterable[bytes], digest) -> Iterator[bytes]:
+    """Pass chunks through, adding each of them to a hash on the way"""
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+class ThumbnailPipeline:
+    """
+    Fetches anime thumbnails from their source and uploads them to the archive on a thread pool.
+
+    Images are streamed from the source into the upload, unless they're resized or the archive already has
+    a thumbnail to compare them with, in which case they're spooled to a temporary file and hashed first.
+    Images the archive already has are never uploaded again.
+
+    What was uploaded for every anime is recorded (Jikan and source URLs, ETag and SHA-256), so later runs ask the source
+    whether the image changed, and don't have to download the archive's copy to know what it is.
+    """
+    UPLOADED = 'uploaded'
+    UNCHANGED = 'unchanged'
+
+    # Images bigger than this are spooled to disk instead of memory
+    SPOOL_SIZE = 1 * MiB
+
+    def __init__(
+            self,
+            breadbox: Breadbox,
+            jikan: Jikan,
+            state_file: Path = None,
+            workers: int = 8,
+            max_size: int = None,
+            quality: int = None,
+            timeout: float | tuple[float, float] = (5, 30)
+    ):
+        """
+        :param state_file: Where the record of earlier uploads is stored between runs
+        :param workers: How many thumbnails are processed at once
+        :param max_size: If set, images are scaled down to fit in a square this many pixels wide (needs Pillow)
+        :param quality: If set, images are recompressed as JPEG at this quality (needs Pillow)
+        :param timeout: How many seconds to wait for image hosts: to connect and between bytes, or (connect, read)
+        """
+        self.breadbox = breadbox
+        self.jikan = jikan
+        self.state_file = Path(state_file) if state_file else None
+        self.workers = workers
+        self.max_size = max_size
+        self.quality = quality
+
+        # Fail now rather than once for every anime if Pillow is missing
+        if self.variant != 'original':
+            import PIL
+
+        # Image hosts are separate from Breadbox and Jikan, so they get their own connection pool
+        self.session = requests.Session()
+        self.session.mount('https://', Transport(timeout=timeout, pool_connections=4, pool_maxsize=workers))
+
+        # Anime ID -> what was last uploaded for it
+        self.state: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+        self.load()
+
+    @property
+    def variant(self) -> str:
+        """The processing options, so changing them makes every thumbnail count as changed"""
+        return f'{self.max_size}:{self.quality}' if self.max_size or self.quality else 'original'
+
+    def load(self):
+        if not self.state_file:
+            return
+
+        try:
+            with open(self.state_file, 'r') as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def save(self):
+        if not self.state_file:
+            return
+
+        with self.lock:
+            data = json.dumps(self.state)
+
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.state_file.with_suffix('.tmp')
+            tmp.write_text(data)
+            tmp.replace(self.state_file)
+
+    def _record(self, anime_id: str, **record):
+        with self.lock:
+            self.state[anime_id] = record
+
+        self.save()
+
+    def source_url(self, jikan_url: str) -> str:
+        """The thumbnail of an anime on MyAnimeList"""
+        return self.jikan.anime(jikan_url)['images']['jpg']['image_url']
+
+    def archive_digest(self, anime_id: str) -> Optional[str]:
+        """
+        The SHA-256 of the archive's thumbnail for an anime, or None if it doesn't have one.
+        Uses the archive's own checksum if it sends one, then the record of the last upload,
+        and only downloads the image to hash it when neither is there.
+        """
+        try:
+            with self.breadbox.anime.fetch(f'/{anime_id}/thumbnail', stream=True) as r:
+                if r.status_code == 404:
+                    return None
+
+                r.raise_for_status()
+
+                verifier = ChecksumVerifier.from_headers(r.headers)
+
+                if verifier and verifier.algorithm == 'sha256':
+                    return verifier.expected.hex()
+
+                if record := self.state.get(anime_id):
+                    return record['sha256']
+
+                digest = hashlib.sha256()
+                for chunk in r.iter_content(64 * 1024):
+                    digest.update(chunk)
+
+                return digest.hexdigest()
+        except requests.RequestException:
+            # Uploading is the safe choice when the archive can't say what it has
+            return None
+
+    def process(self, anime_id) -> str:
+        """
+        Bring one anime's thumbnail in the archive up to date
+        :return: UPLOADED or UNCHANGED
+        """
+        anime_id = str(anime_id)
+        record = self.state.get(anime_id)
+
+        # The anime's MyAnimeList entry decides the source, so correcting it changes the image
+        jikan_url = self.breadbox.anime.info(anime_id)['external']['jikan']
+
+        # Reuse the source URL from last time, so reruns don't wait on Jikan's rate limit
+        if not (record and record['variant'] == self.variant and record.get('jikan') == jikan_url):
+            record = None
+
+        url = record['url'] if record else self.source_url(jikan_url)
+        archived = self.archive_digest(anime_id)
+        source = {'url': url, 'jikan': jikan_url}
+
+        headers = {}
+        if record and record.get('etag'):
+            headers['If-None-Match'] = record['etag']
+        if record and record.get('last_modified'):
+            headers['If-Modified-Since'] = record['last_modified']
+
+        with self.session.get(url, headers=headers, stream=True) as response:
+            if response.status_code != 304:
+                response.raise_for_status()
+                return self._upload(anime_id, source, response, archived)
+
+            if archived == record['sha256']:
+                return self.UNCHANGED
+
+        # The archive's copy is different, so fetch the image again without conditions
+        with self.session.get(url, stream=True) as response:
+            response.raise_for_status()
+            return self._upload(anime_id, source, response, archived)
+
+    def _upload(self, anime_id: str, source: dict, response: requests.Response, archived: Optional[str]) -> str:
+        """
+        Upload an image from its source, unless it's the same as the archive's
+        :param source: The image's URL and the Jikan URL it was found through
+        :param archived: The hash of the archive's thumbnail, see archive_digest()
+        """
+        record = {
+            **source,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'variant': self.variant
+        }
+
+        chunks = response.iter_content(64 * 1024)
+        digest = hashlib.sha256()
+
+        # Nothing to compare with: stream the image straight through, hashing it on the way
+        if archived is None and self.variant == 'original':
+            length = response.headers.get('Content-Length') if 'Content-Encoding' not in response.headers else None
+
+            self._send(anime_id, hashing(chunks, digest), int(length) if length else None)
+            self._record(anime_id, sha256=digest.hexdigest(), **record)
+
+            return self.UPLOADED
+
+        with tempfile.SpooledTemporaryFile(self.SPOOL_SIZE) as spool:
+            if self.variant == 'original':
+                for chunk in hashing(chunks, digest):
+                    spool.write(chunk)
+            else:
+                image = resize_image(b''.join(chunks), self.max_size, self.quality or 85)
+                digest.update(image)
+                spool.write(image)
+
+            sha256 = digest.hexdigest()
+
+            if sha256 == archived:
+                self._record(anime_id, sha256=sha256, **record)
+                return self.UNCHANGED
+
+            size = spool.tell()
+            spool.seek(0)
+
+            self._send(anime_id, spool, size)
+
+        self._record(anime_id, sha256=sha256, **record)
+
+        return self.UPLOADED
+
+    def _send(self, anime_id: str, content, size: Optional[int]):
+        r = self.breadbox.anime.upload(
+            f'/{anime_id}/thumbnail',
+            content,
+            filename='thumbnail.jpg',
+            mimetype='image/jpeg',
+            size=size
+        )
+        r.raise_for_status()
+
+    def run(self, anime_ids: Iterable, progress: Callable[[str, str], None] = None) -> dict[str, str]:
+        """
+        Process many anime at once
+        :param progress: Called with each anime's ID and result as it finishes
+        :return: The result for every anime by ID: UPLOADED, UNCHANGED, or the error that stopped it
+        """
+        def work(anime_id) -> tuple[str, str]:
+            try:
+                result = self.process(anime_id)
+            except (requests.RequestException, OSError, ValueError, KeyError) as e:
+                result = f'failed: {e}'
+
+            if progress:
+                progress(str(anime_id), result)
+
+            return str(anime_id), result
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnail') as pool:
+            return dict(pool.map(work, anime_ids))
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,332 @@
+"""
+Timeouts, retries and circuit breaking for outbound HTTP, shared by every client's session
+"""
+
+import time
+import random
+import threading
+import email.utils
+
+from typing import Callable, Iterator, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Helper Exceptions
+class CircuitOpenError(requests.ConnectionError): """The host kept failing, so requests to it fail fast for a while"""
+
+
+# Responses worth trying again: rate limited, or the server (or a proxy in front of it) is struggling
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Methods that can be repeated without changing the outcome
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+# Failures that say the host is unreachable or stopped answering, before or in the middle of a response
+NETWORK_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+# The responses received while measure() is collecting them. Thread pools only see it when
+# their tasks run in a copy of the caller's context, i.e. submit(contextvars.copy_context().run, ...)
+_measured: ContextVar[Optional[list[requests.Response]]] = ContextVar('measured', default=None)
+
+
+@contextmanager
+def measure() -> Iterator[list[requests.Response]]:
+    """
+    Collect every response received through a Transport, e.g. to count what some work cost:
+        with measure() as responses:
+            breadbox.anime.overview(anime_id)
+
+        cost = transferred(responses)
+    """
+    responses = []
+    token = _measured.set(responses)
+
+    try:
+        yield responses
+    finally:
+        _measured.reset(token)
+
+
+def transferred(responses: list[requests.Response]) -> int:
+    """How many bytes of the responses' bodies came over the wire, compressed, so a 304 costs nothing"""
+    return sum(r.raw.tell() for r in responses if hasattr(r.raw, 'tell'))
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    How long to wait before trying again, with "full jitter" exponential backoff,
+    so clients that failed together don't all come back at the same moment
+    :param attempt: How many tries have failed so far, minus one
+    :param base: The longest wait after the first failure, in seconds
+    :param cap: The longest wait ever, in seconds
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after(r: Optional[requests.Response]) -> Optional[float]:
+    """
+    How many seconds a response asks us to wait before trying again, from its Retry-After header
+    :return: The wait, or None if the response doesn't say
+    """
+    value = r.headers.get('Retry-After') if r is not None else None
+
+    if not value:
+        return None
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        # The header can also be an HTTP date
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+
+    return max(seconds, 0)
+
+
+class CircuitBreaker:
+    """
+    Tracks whether a host is up.
+
+    After enough failures in a row the circuit opens, and requests are refused without touching the network.
+    Once the cooldown is over, a single request is let through to find out whether the host is back:
+    if it works the circuit closes again, otherwise it stays open for another cooldown.
+    """
+    def __init__(self, threshold: int = 5, cooldown: float = 30):
+        """
+        :param threshold: How many failures in a row open the circuit
+        :param cooldown: How many seconds the circuit stays open before the host is tried again
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        self.failures = 0
+        self.opened: Optional[float] = None
+
+        # Whether the one request allowed through after the cooldown is still running
+        self.trial = False
+
+        self.lock = threading.Lock()
+
+    @property
+    def open(self) -> bool:
+        return self.opened is not None
+
+    def retry_in(self) -> float:
+        """How many seconds are left before the host is tried again"""
+        with self.lock:
+            return max(self.opened + self.cooldown - time.monotonic(), 0) if self.opened is not None else 0
+
+    def allow(self) -> bool:
+        """Whether a request may be sent; every allowed request must be followed by success(), failure() or release()"""
+        with self.lock:
+            if self.opened is None:
+                return True
+
+            if self.trial or time.monotonic() - self.opened < self.cooldown:
+                return False
+
+            self.trial = True
+
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def release(self):
+        """Forget a request that ended without saying anything about the host, e.g. because it was interrupted"""
+        with self.lock:
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+
+            if self.opened is not None or self.failures >= self.threshold:
+                self.opened = time.monotonic()
+
+
+class Transport(HTTPAdapter):
+    """
+    A connection pool that gives requests a timeout unless they set their own,
+    retries idempotent requests after connection errors, timeouts and RETRY_STATUSES,
+    and stops sending anything to a host that keeps failing, see CircuitBreaker.
+
+    Mount one on a session, so every request the session makes goes through it:
+        session.mount('https://', Transport(timeout=(5, 30)))
+
+    Waits between retries use jittered exponential backoff, or the server's Retry-After if it sends one.
+    A response that asks for a longer wait than max_wait is returned as it is, for the caller to deal with.
+    """
+    def __init__(
+            self,
+            timeout: float | tuple[float, float] = (5, 30),
+            retries: int = 3,
+            backoff: float = 0.5,
+            max_wait: float = 60,
+            methods: frozenset[str] = IDEMPOTENT_METHODS,
+            threshold: int = 5,
+            cooldown: float = 30,
+            throttle: Callable[[], None] = None,
+            **kwargs
+    ):
+        """
+        :param timeout: How many seconds to wait for the server: to connect and between bytes, or (connect, read)
+        :param retries: How many times a failed request is tried again
+        :param backoff: The longest wait after the first failure; it doubles with every retry
+        :param max_wait: The longest wait between retries, in seconds
+        :param methods: The request methods that are safe to send again
+        :param threshold: How many failures in a row stop requests to a host, see CircuitBreaker
+        :param cooldown: How many seconds requests to a failing host are refused for
+        :param throttle: Called before every attempt, retries included, e.g. to wait for a rate limiter's token
+        :param kwargs: Passed on to HTTPAdapter, e.g. pool_connections and pool_maxsize
+        """
+        super().__init__(**kwargs)
+
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.methods = methods
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.throttle = throttle
+
+        # By host, since one session can talk to many, e.g. image hosts
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.lock = threading.Lock()
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """The circuit breaker for a URL's host"""
+        host = urlsplit(url).netloc
+
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(self.threshold, self.cooldown)
+
+            return self.breakers[host]
+
+    def build_response(self, req, resp) -> requests.Response:
+        response = super().build_response(req, resp)
+
+        if (responses := _measured.get()) is not None:
+            responses.append(response)
+
+        return response
+
+    def send(self, request: requests.PreparedRequest, stream=False, timeout=None, **kwargs) -> requests.Response:
+        breaker = self.breaker(request.url)
+        retries = self.retries if request.method in self.methods else 0
+
+        if timeout is None:
+            timeout = self.timeout
+
+        attempt = 0
+
+        while True:
+            if self.throttle:
+                self.throttle()
+
+            if not breaker.allow():
+                raise CircuitOpenError(
+                    f"{urlsplit(request.url).netloc} isn't responding, trying again in {breaker.retry_in():.0f}s",
+                    request=request
+                )
+
+            try:
+                r = self._attempt(breaker, request, stream, timeout, **kwargs)
+            except NETWORK_ERRORS:
+                if attempt >= retries:
+                    raise
+
+                wait = backoff_delay(attempt, self.backoff, self.max_wait)
+            else:
+                if r.status_code not in RETRY_STATUSES or attempt >= retries:
+                    return r
+
+                wait = retry_after(r)
+
+                if wait is None:
+                    wait = backoff_delay(attempt, self.backoff, self.max_wait)
+                elif wait > self.max_wait:
+                    return r
+
+                # Give the connection back to the pool before waiting
+                r.close()
+
+            time.sleep(wait)
+            attempt += 1
+
+    def _attempt(self, breaker: CircuitBreaker, request: requests.PreparedRequest, stream, timeout, **kwargs) -> requests.Response:
+        """Send a request once, and tell the breaker how it went once the body has been read"""
+        try:
+            r = super().send(request, stream=stream, timeout=timeout, **kwargs)
+        except NETWORK_ERRORS:
+            breaker.failure()
+            raise
+        except BaseException:
+            # E.g. KeyboardInterrupt, which says nothing about the host but mustn't leave it blocked
+            breaker.release()
+            raise
+
+        # Rate limiting and client errors don't mean the host is down
+        if r.status_code >= 500:
+            breaker.failure()
+            return r
+
+        self._watch(r, breaker)
+
+        # Read the body now, so a connection that drops partway through is retried like any other failure.
+        # Streamed bodies are read by the caller, and reported to the breaker when they're done.
+        if not stream:
+            r.content
+
+        return r
+
+    @staticmethod
+    def _watch(r: requests.Response, breaker: CircuitBreaker):
+        """Report a response to the breaker when its body has been read, fails, or the response is closed"""
+        reported = False
+
+        def report(outcome: Callable[[], None]):
+            nonlocal reported
+
+            if not reported:
+                reported = True
+                outcome()
+
+        iter_content, close = r.iter_content, r.close
+
+        def watched_iter_content(*args, **kwargs):
+            try:
+                yield from iter_content(*args, **kwargs)
+            except NETWORK_ERRORS:
+                report(breaker.failure)
+                raise
+            except GeneratorExit:
+                # The caller stopped reading early, having got what it wanted
+                report(breaker.success)
+                raise
+            except BaseException:
+                report(breaker.release)
+                raise
+            else:
+                report(breaker.success)
+
+        def watched_close():
+            report(breaker.success)
+            close()
+
+        # Response.content and Response.__exit__ go through these too
+        r.iter_content = watched_iter_content
+        r.close = watched_close
@@ -0,0 +1,817 @@
+"""
+Interchangeable terminal UI backends for the interactive app
+
+Every backend shows the same handful of dialogs, so the menus in app.py are written once:
+    ui = create_ui('curses')
+    anime_id = ui.menu("Breadbox / Archive", "Choose an anime to watch:", [('12', "Some anime")])
+
+Each backend imports its toolkit when it's created, so only the one in use is ever loaded.
+"""
+
+import os
+import sys
+import shutil
+import textwrap
+import threading
+
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Sequence
+
+
+# A handy dandy eraser
+Eraser = '\x1b[1A\x1b[2K'
+
+# A menu item is either a tag, or a tag and its description
+MenuItem = str | tuple[str, str]
+
+
+def _normalize(items: Sequence[MenuItem]) -> list[tuple[str, str]]:
+    """Turn menu items into (tag, description) pairs"""
+    return [(item, '') if isinstance(item, str) else (str(item[0]), str(item[1])) for item in items]
+
+
+class UI(ABC):
+    """
+    The dialogs every backend has to provide; a backend missing one can't be created.
+
+    Dialogs return None (or False, or an empty list) when the user cancels,
+    so callers can always test the result with `if not inp`.
+    """
+    # How many search results are listed at once; typing more of the query narrows them down
+    SEARCH_LIMIT = 200
+
+    def __init__(self):
+        # The text shown behind every dialog, e.g. the app version and username
+        self.backtitle = ''
+
+    def spinner(self):
+        """Create a spinner with start(text), stop() and a settable text attribute."""
+        from halo import Halo
+
+        return Halo(spinner='line', placement='right', color="yellow")
+
+    def apply_theme(self, theme: dict):
+        """
+        Use a theme from the themes folder
+        :param theme: A dict of hex colors, e.g. {'root_bg': '#db6212', ...}
+        """
+
+    @abstractmethod
+    def menu(self, title: str, msg: str, items: Sequence[MenuItem], on_highlight: Callable[[str], None] = None) -> Optional[str]:
+        """
+        Ask the user to choose one item
+        :param on_highlight: Called with an item's tag when the cursor moves onto it, if the backend can tell
+        :return: The chosen tag, or None if the user cancelled
+        """
+
+    @abstractmethod
+    def inputbox(self, title: str, msg: str, default: str = '', password: bool = False) -> Optional[str]:
+        """
+        Ask the user for some text
+        :param password: Hide the text being typed
+        :return: The text, or None if the user cancelled
+        """
+
+    @abstractmethod
+    def yesno(self, title: str, msg: str, default: bool = True) -> bool:
+        """
+        Ask the user a yes or no question
+        :param default: The answer that's selected to begin with
+        """
+
+    @abstractmethod
+    def msgbox(self, title: str, msg: str):
+        """Show a message until the user dismisses it."""
+
+    @abstractmethod
+    def checklist(self, title: str, msg: str, items: Sequence[MenuItem]) -> list[str]:
+        """
+        Ask the user to choose any number of items
+        :return: The chosen tags
+        """
+
+    def search(self, title: str, msg: str, search: Callable[[str, Optional[int]], list[tuple[str, str]]],
+               on_highlight: Callable[[str], None] = None) -> Optional[str]:
+        """
+        Ask the user to find and choose one item.
+        By default the query is asked for first, then the results are shown in a menu.
+        :param search: Given a query and the most results wanted (None for all), returns matching (tag, description) items
+        :return: The chosen tag, or None if the user cancelled
+        """
+        query = ''
+
+        while True:
+            query = self.inputbox(title, msg + "\n\nLeave it empty to browse everything.", default=query)
+
+            if query is None:
+                return None
+
+            results = search(query, self.SEARCH_LIMIT)
+
+            if not results:
+                self.msgbox(title, f'Nothing matches "{query}".')
+                continue
+
+            inp = self.menu(title, f'Results for "{query}":' if query else msg, results, on_highlight)
+
+            # Cancelling the results goes back to the query
+            if inp:
+                return inp
+
+    def close(self):
+        """Give the terminal back."""
+
+
+class WhiptailUI(UI):
+    """
+    Dialogs drawn by the whiptail program, one process per dialog
+    """
+    def __init__(self):
+        super().__init__()
+
+        from whiptail import Whiptail
+        self.whiptail = Whiptail
+
+    def _dialog(self, title: str):
+        return self.whiptail(title=title, backtitle=self.backtitle)
+
+    def apply_theme(self, theme: dict):
+        t = theme
+
+        root = f"{t['root_fg']},{t['root_bg']}"
+        window = f"{t['window_fg']},{t['window_bg']}"
+        element = f"{t['element_fg']},{t['element_bg']}"
+        select = f"{t['select_fg']},{t['select_bg']}"
+        focus = f"{t['focus_fg']},{t['focus_bg']}"
+
+        # noinspection SpellCheckingInspection
+        os.environ['NEWT_COLORS'] = f"""
+            root={root}
+            border={t['border']},{t['window_bg']}
+            window={window}
+            shadow={t['shadow']},{t['shadow']}
+            title={t['window_title']},{t['window_bg']}
+            button={focus}
+            actbutton={focus}
+            checkbox={element}
+            actcheckbox={focus}
+            entry={focus}
+            label={window}
+            listbox={element}
+            actlistbox={select}
+            textbox={window}
+            acttextbox={focus}
+            helpline={window}
+            roottext={root}
+            emptyscale={element}
+            fullscale={focus}
+            disentry={element}
+            compactbutton={window}
+            actsellistbox={focus}
+            sellistbox={element}
+        """
+
+    def menu(self, title, msg, items, on_highlight=None):
+        inp, code = self._dialog(title).menu(msg, items)
+        return inp if code == 0 else None
+
+    def inputbox(self, title, msg, default='', password=False):
+        inp, code = self._dialog(title).inputbox(msg, default=default, password=password)
+        return inp if code == 0 else None
+
+    def yesno(self, title, msg, default=True):
+        return self._dialog(title).yesno(msg, default='yes' if default else 'no')
+
+    def msgbox(self, title, msg):
+        self._dialog(title).msgbox(msg)
+
+    def checklist(self, title, msg, items):
+        inp, code = self._dialog(title).checklist(msg, items)
+        return inp if code == 0 else []
+
+
+class QuestionaryUI(UI):
+    """
+    Prompts printed inline with questionary, for terminals without whiptail.
+    Answered prompts are erased, so only the current question is ever on screen.
+    """
+    BACK = "<-----[ Back ]"
+
+    def __init__(self):
+        super().__init__()
+
+        import questionary
+        self.q = questionary
+
+        self.style = None
+
+    @staticmethod
+    def erase(msg: str):
+        """Erase an answered prompt from stdout"""
+        sys.stdout.write(Eraser * (msg.count('\n') + 1))
+
+    def apply_theme(self, theme: dict):
+        t = theme
+
+        self.style = self.q.Style([
+            ('qmark', f"fg:{t['focus_bg']} bold"),
+            ('pointer', f"fg:{t['focus_bg']} bold"),
+            ('highlighted', f"fg:{t['select_fg']} bg:{t['select_bg']}"),
+            ('selected', f"fg:{t['focus_bg']}"),
+            ('answer', f"fg:{t['focus_bg']}")
+        ])
+
+    def menu(self, title, msg, items, on_highlight=None):
+        choices = [self.q.Choice(title=f"{tag} - {desc}" if desc else tag, value=tag) for tag, desc in _normalize(items)]
+        # questionary uses the title as the value when the value is None, so Back is marked with False
+        choices.append(self.q.Choice(title=self.BACK, value=False))
+
+        inp = self.q.select(msg, choices, style=self.style).ask(kbi_msg=Eraser)
+        self.erase(msg)
+
+        return inp or None
+
+    def inputbox(self, title, msg, default='', password=False):
+        if password:
+            inp = self.q.password(msg, style=self.style).ask(kbi_msg=Eraser)
+        else:
+            inp = self.q.text(msg, default=default or '', style=self.style).ask(kbi_msg=Eraser)
+
+        self.erase(msg)
+
+        return inp
+
+    def yesno(self, title, msg, default=True):
+        inp = self.q.confirm(msg, default=default, style=self.style).ask(kbi_msg=Eraser)
+        self.erase(msg)
+
+        return bool(inp)
+
+    def msgbox(self, title, msg):
+        self.q.press_any_key_to_continue(msg, style=self.style).ask(kbi_msg=Eraser)
+        self.erase(msg)
+
+    def checklist(self, title, msg, items):
+        choices = [self.q.Choice(title=f"{tag} - {desc}" if desc else tag, value=tag) for tag, desc in _normalize(items)]
+
+        inp = self.q.checkbox(msg, choices, style=self.style).ask(kbi_msg=Eraser)
+        self.erase(msg)
+
+        return inp or []
+
+    def search(self, title, msg, search, on_highlight=None):
+        while True:
+            query = self.q.autocomplete(
+                msg,
+                choices=[],
+                completer=search_completer(search),
+                style=self.style
+            ).ask(kbi_msg=Eraser)
+            self.erase(msg)
+
+            if query is None:
+                return None
+
+            results = search(query, self.SEARCH_LIMIT)
+
+            # A completion was picked
+            for tag, desc in results:
+                if desc == query:
+                    return tag
+
+            if inp := self.menu(title, f'Results for "{query}":', results):
+                return inp
+
+
+def search_completer(search: Callable[[str, Optional[int]], list[tuple[str, str]]], limit: int = 20):
+    """
+    Create a prompt_toolkit completer that completes from a search function, best match first
+    """
+    from prompt_toolkit.completion import Completer, Completion
+
+    class SearchCompleter(Completer):
+        def get_completions(self, document, complete_event):
+            query = document.text_before_cursor
+
+            for tag, desc in search(query, limit):
+                yield Completion(desc, start_position=-len(query))
+
+    return SearchCompleter()
+
+
+class CursesSpinner:
+    """
+    A spinner drawn on the bottom line of a CursesUI screen
+    """
+    FRAMES = '-\\|/'
+
+    def __init__(self, ui: 'CursesUI', interval: float = 0.1):
+        self.ui = ui
+        self.interval = interval
+        self.text = ''
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, text: str = None):
+        if text is not None:
+            self.text = text
+
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._spin, name='spinner', daemon=True)
+        self._thread.start()
+
+    def _spin(self):
+        frame = 0
+
+        while not self._stop.is_set():
+            self.ui.status(f"{self.text} {self.FRAMES[frame % len(self.FRAMES)]}")
+            frame += 1
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+        self.ui.status('')
+
+
+class CursesUI(UI):
+    """
+    Dialogs drawn in-process with curses.
+
+    The terminal is set up once instead of once per dialog, themes are applied natively,
+    and menus only draw the rows that are visible, so long lists stay responsive.
+    """
+    # Color pair numbers for each part of the screen
+    ROOT, WINDOW, TITLE, BORDER, ELEMENT, SELECT, FOCUS, SHADOW = range(1, 9)
+
+    # Pairs of (foreground, background) theme keys
+    THEME_PAIRS = {
+        ROOT: ('root_fg', 'root_bg'),
+        WINDOW: ('window_fg', 'window_bg'),
+        TITLE: ('window_title', 'window_bg'),
+        BORDER: ('border', 'window_bg'),
+        ELEMENT: ('element_fg', 'element_bg'),
+        SELECT: ('select_fg', 'select_bg'),
+        FOCUS: ('focus_fg', 'focus_bg'),
+        SHADOW: ('shadow', 'shadow')
+    }
+
+    # Roughly whiptail's own colors, used when no theme is applied
+    DEFAULT_THEME = {
+        'root_bg': '#0000ff',
+        'root_fg': '#ffffff',
+        'window_bg': '#ffffff',
+        'window_fg': '#000000',
+        'window_title': '#ff0000',
+        'border': '#000000',
+        'shadow': '#000000',
+        'element_bg': '#ffffff',
+        'element_fg': '#000000',
+        'select_bg': '#ff0000',
+        'select_fg': '#ffffff',
+        'focus_bg': '#ff0000',
+        'focus_fg': '#ffffff'
+    }
+
+    # The eight colors every terminal has
+    BASIC_COLORS = [
+        (0, 0, 0), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+        (0, 0, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255)
+    ]
+
+    def __init__(self):
+        super().__init__()
+
+        # Imported here because Windows doesn't ship curses
+        import curses
+        self.curses = curses
+
+        # Don't wait a whole second to tell Esc apart from escape sequences
+        os.environ.setdefault('ESCDELAY', '25')
+
+        self.screen = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        self.screen.keypad(True)
+
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+
+        curses.start_color()
+
+        # Drawing happens on the main thread and the spinner thread
+        self.lock = threading.RLock()
+        self.status_text = ''
+        self.custom_colors: dict[str, int] = {}
+
+        self.apply_theme(self.DEFAULT_THEME)
+
+    def spinner(self):
+        return CursesSpinner(self)
+
+    # ------ Colors ------
+
+    def color(self, hex_color: str) -> int:
+        """Get the curses color closest to a hex color"""
+        curses = self.curses
+
+        hex_color = hex_color.lstrip('#').lower()
+        rgb = tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+
+        if hex_color in self.custom_colors:
+            return self.custom_colors[hex_color]
+
+        # Define the exact color if the terminal allows it, leaving the first 16 alone
+        number = 16 + len(self.custom_colors)
+        if curses.can_change_color() and number < curses.COLORS:
+            curses.init_color(number, *(round(c * 1000 / 255) for c in rgb))
+            self.custom_colors[hex_color] = number
+            return number
+
+        return min(
+            range(len(self.BASIC_COLORS)),
+            key=lambda n: sum((a - b) ** 2 for a, b in zip(rgb, self.BASIC_COLORS[n]))
+        )
+
+    def apply_theme(self, theme: dict):
+        theme = self.DEFAULT_THEME | theme
+
+        with self.lock:
+            for pair, (fg, bg) in self.THEME_PAIRS.items():
+                self.curses.init_pair(pair, self.color(theme[fg]), self.color(theme[bg]))
+
+    def attr(self, pair: int) -> int:
+        return self.curses.color_pair(pair)
+
+    # ------ Drawing ------
+
+    def _put(self, win, y: int, x: int, text: str, attr: int = 0):
+        """Write text, clipped to the window instead of raising"""
+        height, width = win.getmaxyx()
+
+        if not 0 <= y < height or x >= width:
+            return
+
+        try:
+            win.addnstr(y, x, text, width - x, attr)
+        except self.curses.error:
+            pass  # Writing the bottom right corner always "fails"
+
+    def _background(self):
+        """Draw the backtitle and status line"""
+        screen = self.screen
+        height, width = screen.getmaxyx()
+
+        screen.bkgd(' ', self.attr(self.ROOT))
+        screen.erase()
+        self._put(screen, 0, 1, self.backtitle, self.attr(self.ROOT))
+        self._put(screen, height - 1, 1, self.status_text, self.attr(self.ROOT))
+        screen.noutrefresh()
+
+    def status(self, text: str):
+        """Show some text on the bottom line, e.g. a spinner."""
+        with self.lock:
+            self.status_text = text
+            self._background()
+            self.curses.doupdate()
+
+    @staticmethod
+    def _wrap(msg: str, width: int) -> list[str]:
+        lines = []
+        for paragraph in msg.split('\n'):
+            lines += textwrap.wrap(paragraph, max(width, 1)) or ['']
+
+        return lines
+
+    def _window(self, title: str, height: int, width: int):
+        """Draw an empty dialog box in the middle of the screen"""
+        curses = self.curses
+        screen_height, screen_width = self.screen.getmaxyx()
+
+        height = max(min(height, screen_height - 3), 3)
+        width = max(min(width, screen_width - 4), 10)
+        y = (screen_height - height) // 2
+        x = (screen_width - width) // 2
+
+        self._background()
+
+        # Shadow
+        try:
+            shadow = curses.newwin(height, width, y + 1, x + 2)
+            shadow.bkgd(' ', self.attr(self.SHADOW))
+            shadow.noutrefresh()
+        except curses.error:
+            pass
+
+        win = curses.newwin(height, width, y, x)
+        win.keypad(True)
+        win.bkgd(' ', self.attr(self.WINDOW))
+
+        win.attron(self.attr(self.BORDER))
+        win.box()
+        win.attroff(self.attr(self.BORDER))
+
+        if title:
+            title = f" {title[:width - 6]} "
+            self._put(win, 0, (width - len(title)) // 2, title, self.attr(self.TITLE))
+
+        return win
+
+    def _buttons(self, win, labels: Sequence[str], focused: int):
+        """Draw a row of buttons along the bottom of a dialog"""
+        height, width = win.getmaxyx()
+
+        text_width = sum(len(label) + 4 for label in labels)
+        x = max((width - text_width) // 2, 1)
+
+        for n, label in enumerate(labels):
+            attr = self.attr(self.FOCUS) if n == focused else self.attr(self.WINDOW)
+            self._put(win, height - 2, x, f"<{label}>", attr)
+            x += len(label) + 4
+
+    def _read_key(self, win):
+        """Wait for a key, returning a str for characters and an int for special keys"""
+        try:
+            key = win.get_wch()
+        except self.curses.error:
+            return None
+        except KeyboardInterrupt:
+            return '\x1b'
+
+        if key == self.curses.KEY_RESIZE:
+            self.curses.update_lines_cols()
+
+        return key
+
+    # ------ Dialogs ------
+
+    def _list(self, title: str, msg: str, items: list[tuple[str, str]], checked: set = None,
+              on_highlight: Callable[[str], None] = None, search: Callable = None):
+        """
+        The shared loop of menus, checklists and searches
+        :param checked: The tags that are ticked, if this is a checklist
+        :param search: If set, typing filters the list through this function instead of jumping to a tag
+        :return: The tag of the highlighted item, or None if the user cancelled
+        """
+        curses = self.curses
+
+        cursor = 0
+        top = 0
+        button = 0
+        highlighted = None
+        query = ''
+
+        if search:
+            items = search(query, self.SEARCH_LIMIT)
+
+        tag_width = max((len(tag) for tag, _ in items), default=0)
+
+        while True:
+            screen_height, screen_width = self.screen.getmaxyx()
+            width = screen_width - 10
+            text = self._wrap(msg, width - 4)
+
+            # Only as many rows as fit are ever drawn. Searches always use the whole height,
+            # so the dialog doesn't change size while typing.
+            rows = max(screen_height - len(text) - 9, 1)
+            if search:
+                text.append('')
+            else:
+                rows = min(len(items), rows)
+
+            if cursor < top:
+                top = cursor
+            elif cursor >= top + rows:
+                top = cursor - rows + 1
+
+            with self.lock:
+                win = self._window(title, len(text) + rows + 6, width)
+
+                for n, line in enumerate(text):
+                    self._put(win, 1 + n, 2, line)
+
+                if search:
+                    self._put(win, len(text), 3, query[-(width - 7):].ljust(width - 6), self.attr(self.FOCUS))
+
+                for row, (tag, desc) in enumerate(items[top:top + rows]):
+                    n = top + row
+                    box = ('[*] ' if tag in checked else '[ ] ') if checked is not None else ''
+                    line = f"{box}{tag.ljust(tag_width)}  {desc}".ljust(width - 6)
+                    attr = self.attr(self.SELECT if n == cursor else self.ELEMENT)
+                    self._put(win, 2 + len(text) + row, 3, line, attr)
+
+                # Scroll marks
+                if top > 0:
+                    self._put(win, 2 + len(text), width - 3, '^')
+                if top + rows < len(items):
+                    self._put(win, 1 + len(text) + rows, width - 3, 'v')
+
+                self._buttons(win, ['Ok', 'Cancel'], button)
+                win.noutrefresh()
+                curses.doupdate()
+
+            if on_highlight and items and items[cursor][0] != highlighted:
+                highlighted = items[cursor][0]
+                on_highlight(highlighted)
+
+            key = self._read_key(win)
+            previous_query = query
+
+            match key:
+                case curses.KEY_UP:
+                    cursor = max(cursor - 1, 0)
+                case curses.KEY_DOWN:
+                    cursor = min(cursor + 1, len(items) - 1)
+                case curses.KEY_PPAGE:
+                    cursor = max(cursor - rows, 0)
+                case curses.KEY_NPAGE:
+                    cursor = min(cursor + rows, len(items) - 1)
+                case curses.KEY_HOME:
+                    cursor = 0
+                case curses.KEY_END:
+                    cursor = len(items) - 1
+                case '\t' | curses.KEY_LEFT | curses.KEY_RIGHT:
+                    button = 1 - button
+                case ' ' if checked is not None and items:
+                    checked ^= {items[cursor][0]}
+                case '\n' | '\r' | curses.KEY_ENTER:
+                    if button == 1 or not items:
+                        return None
+                    return items[cursor][0]
+                case '\x1b':
+                    return None
+                case curses.KEY_BACKSPACE | '\x7f' | '\b' if search:
+                    query = query[:-1]
+                case str() if search and key.isprintable():
+                    query += key
+                case str() if key.isprintable():
+                    # Jump to the next tag starting with the key, like whiptail
+                    for n in list(range(cursor + 1, len(items))) + list(range(cursor + 1)):
+                        if items[n][0].lower().startswith(key.lower()):
+                            cursor = n
+                            break
+
+            # Filter again whenever the query changes
+            if query != previous_query:
+                items = search(query, self.SEARCH_LIMIT)
+                tag_width = max((len(tag) for tag, _ in items), default=0)
+                cursor = top = 0
+
+            cursor = max(min(cursor, len(items) - 1), 0)
+
+    def menu(self, title, msg, items, on_highlight=None):
+        return self._list(title, msg, _normalize(items), on_highlight=on_highlight)
+
+    def search(self, title, msg, search, on_highlight=None):
+        return self._list(title, msg, [], on_highlight=on_highlight, search=search)
+
+    def checklist(self, title, msg, items):
+        items = _normalize(items)
+        checked = set()
+
+        if self._list(title, msg, items, checked=checked) is None:
+            return []
+
+        # Keep the order of the list
+        return [tag for tag, _ in items if tag in checked]
+
+    def inputbox(self, title, msg, default='', password=False):
+        curses = self.curses
+
+        value = default or ''
+        button = 0
+
+        while True:
+            width = self.screen.getmaxyx()[1] - 10
+            text = self._wrap(msg, width - 4)
+            field_width = width - 6
+
+            shown = '*' * len(value) if password else value
+            shown = shown[-(field_width - 1):]
+
+            with self.lock:
+                win = self._window(title, len(text) + 6, width)
+
+                for n, line in enumerate(text):
+                    self._put(win, 1 + n, 2, line)
+
+                self._put(win, 2 + len(text), 3, shown.ljust(field_width), self.attr(self.FOCUS))
+                self._buttons(win, ['Ok', 'Cancel'], button)
+                win.noutrefresh()
+                curses.doupdate()
+
+            key = self._read_key(win)
+
+            match key:
+                case '\t':
+                    button = 1 - button
+                case '\n' | '\r' | curses.KEY_ENTER:
+                    return None if button == 1 else value
+                case '\x1b':
+                    return None
+                case curses.KEY_BACKSPACE | '\x7f' | '\b':
+                    value = value[:-1]
+                case '\x15':  # Ctrl+U
+                    value = ''
+                case str() if key.isprintable():
+                    value += key
+
+    def yesno(self, title, msg, default=True):
+        curses = self.curses
+
+        button = 0 if default else 1
+
+        while True:
+            width = self.screen.getmaxyx()[1] - 10
+            text = self._wrap(msg, width - 4)
+
+            with self.lock:
+                win = self._window(title, len(text) + 4, width)
+
+                for n, line in enumerate(text):
+                    self._put(win, 1 + n, 2, line)
+
+                self._buttons(win, ['Yes', 'No'], button)
+                win.noutrefresh()
+                curses.doupdate()
+
+            key = self._read_key(win)
+
+            match key:
+                case '\t' | curses.KEY_LEFT | curses.KEY_RIGHT:
+                    button = 1 - button
+                case 'y' | 'Y':
+                    return True
+                case 'n' | 'N' | '\x1b':
+                    return False
+                case '\n' | '\r' | curses.KEY_ENTER:
+                    return button == 0
+
+    def msgbox(self, title, msg):
+        curses = self.curses
+
+        top = 0
+
+        while True:
+            screen_height, screen_width = self.screen.getmaxyx()
+            width = screen_width - 10
+            text = self._wrap(msg, width - 4)
+            rows = max(min(len(text), screen_height - 7), 1)
+
+            with self.lock:
+                win = self._window(title, rows + 4, width)
+
+                for n, line in enumerate(text[top:top + rows]):
+                    self._put(win, 1 + n, 2, line)
+
+                self._buttons(win, ['Ok'], 0)
+                win.noutrefresh()
+                curses.doupdate()
+
+            key = self._read_key(win)
+
+            match key:
+                case curses.KEY_UP:
+                    top = max(top - 1, 0)
+                case curses.KEY_DOWN:
+                    top = min(top + 1, max(len(text) - rows, 0))
+                case '\n' | '\r' | ' ' | '\x1b' | curses.KEY_ENTER:
+                    return
+
+    def close(self):
+        curses = self.curses
+
+        with self.lock:
+            self.screen.keypad(False)
+            curses.nocbreak()
+            curses.echo()
+            curses.endwin()
+
+
+# Every backend by name, as used in the "ui" setting
+Backends = {
+    'whiptail': WhiptailUI,
+    'questionary': QuestionaryUI,
+    'curses': CursesUI
+}
+
+
+def create_ui(name: str = 'auto') -> UI:
+    """
+    Set up a UI backend
+    :param name: One of Backends, or 'auto' to use whiptail if it's installed and questionary otherwise
+    """
+    if name not in Backends:
+        name = 'whiptail' if shutil.which('whiptail') else 'questionary'
+
+    return Backends[name]()
@@ -0,0 +1,341 @@
+"""
+Request bodies that stream files to the server a piece at a time, so uploads use little memory however big they are
+"""
+
+import io
+import os
+import re
+import time
+import uuid
+import threading
+
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, BinaryIO
+
+import requests
+
+from downloader import MiB
+from transport import backoff_delay
+
+# Anything upload() accepts as a file's content
+UploadSource = bytes | str | Path | BinaryIO | Iterable[bytes]
+
+
+# Helper Exceptions
+class ResumeNotSupported(requests.RequestException): """The server took part of a file as the whole file"""
+class UploadCancelled(Exception): """The upload was stopped before it finished"""
+
+
+class IterableReader(io.RawIOBase):
+    """
+    A read-only file over an iterable of byte strings, e.g. a streaming response's iter_content()
+    """
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            try:
+                self.buffer = bytes(next(self.chunks))
+            except StopIteration:
+                return 0
+
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+
+        return n
+
+
+def open_source(content: UploadSource, size: int = None) -> tuple[BinaryIO, Optional[int], bool]:
+    """
+    Turn anything upload() accepts into a file
+    :param content: Bytes, a file path, a binary file object, or an iterable of byte strings
+    :param size: How many bytes the content has, if it can't be worked out (i.e. for iterables)
+    :return: The file, how many bytes are left in it (None if unknown), and whether the caller should close it
+    """
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return io.BytesIO(content), len(content), True
+
+    if isinstance(content, (str, Path)):
+        file = open(content, 'rb')
+        return file, os.fstat(file.fileno()).st_size, True
+
+    if hasattr(content, 'read'):
+        if size is None:
+            try:
+                size = os.fstat(content.fileno()).st_size - content.tell()
+            except (AttributeError, OSError, ValueError):
+                pass
+
+        return content, size, False
+
+    return io.BufferedReader(IterableReader(content)), size, True
+
+
+class MultipartBody:
+    """
+    A multipart/form-data body holding a single file, generated as it's read instead of built in memory.
+
+    Pass it as a request's data, with content_type as the Content-Type header.
+    When the file's size is known the body has a length, so it's sent with a Content-Length;
+    otherwise, send iter(body) and it goes out with chunked transfer encoding.
+    """
+    def __init__(
+            self,
+            field: str,
+            filename: str,
+            content: UploadSource,
+            mimetype: str,
+            size: int = None,
+            chunk_size: int = 1 * MiB
+    ):
+        """
+        :param field: The form field the file is sent as
+        :param content: See open_source()
+        :param size: The content's size, if it can't be worked out
+        :param chunk_size: How many bytes are read at a time when iterating
+        """
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+
+        head = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {mimetype}\r\n\r\n'
+        ).encode()
+        tail = f'\r\n--{self.boundary}--\r\n'.encode()
+
+        self.file, self.size, self.owned = open_source(content, size)
+
+        try:
+            self.start = self.file.tell() if self.file.seekable() else None
+        except (AttributeError, OSError):
+            self.start = None
+
+        self.parts = [io.BytesIO(head), self.file, io.BytesIO(tail)]
+        self.part = 0
+        self.position = 0
+
+        self.length = len(head) + self.size + len(tail) if self.size is not None else None
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        if self.length is None:
+            raise TypeError("The size of the file isn't known")
+
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+
+        while self.part < len(self.parts) and size != 0:
+            data = self.parts[self.part].read(size if size > 0 else -1)
+
+            if not data:
+                self.part += 1
+                continue
+
+            chunks.append(data)
+
+            if size > 0:
+                size -= len(data)
+
+        data = b''.join(chunks)
+        self.position += len(data)
+
+        return data
+
+    def __iter__(self) -> Iterator[bytes]:
+        while data := self.read(self.chunk_size):
+            yield data
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Go back to the start, so the body can be sent again. Nothing else is supported."""
+        if offset != 0 or whence != io.SEEK_SET or self.start is None:
+            raise io.UnsupportedOperation("An upload body can only be rewound to the start")
+
+        self.parts[0].seek(0)
+        self.file.seek(self.start)
+        self.parts[2].seek(0)
+        self.part = 0
+        self.position = 0
+
+        return 0
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+
+
+class ResumableUpload:
+    """
+    Uploads a large file in pieces, so that an interrupted upload continues where it stopped
+    instead of starting over, and at most one piece is in memory at a time.
+
+    Follows the common Content-Range convention for resumable uploads (used by e.g. Google Cloud Storage):
+        every piece is PUT with "Content-Range: bytes <first>-<last>/<total>",
+        the server answers "308 Resume Incomplete" with "Range: bytes=0-<last received>" until it has everything,
+        and an empty PUT with "Content-Range: bytes */<total>" asks how much has arrived.
+    """
+    def __init__(
+            self,
+            request: Callable[..., requests.Response],
+            file: str | Path,
+            mimetype: str = 'application/octet-stream',
+            chunk_size: int = 8 * MiB,
+            retries: int = 5,
+            progress: Callable[[int, int], None] = None,
+            cancel: threading.Event = None,
+            resume: bool = False,
+            backoff: float = 0.5,
+            max_wait: float = 30
+    ):
+        """
+        :param request: Makes a PUT request to the upload URL, passing on any keyword arguments (i.e. data and headers)
+        :param file: The file to upload
+        :param chunk_size: How many bytes each piece has
+        :param retries: How many times in a row an interrupted piece is resumed before giving up
+        :param progress: Called with the bytes uploaded so far and the total after every piece
+        :param cancel: If set, the upload stops (and can be resumed later) once this event is set
+        :param resume: Ask the server how much it already has before sending anything,
+                       to continue an upload that was interrupted in an earlier run
+        :param backoff: The longest wait after the first failure; it doubles with every retry
+        :param max_wait: The longest wait between retries, in seconds
+        """
+        self.request = request
+        self.file = Path(file)
+        self.mimetype = mimetype
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.progress = progress
+        self.cancel = cancel or threading.Event()
+        self.resume = resume
+        self.backoff = backoff
+        self.max_wait = max_wait
+
+        self.total = self.file.stat().st_size
+
+        # How much the server has, as far as we know
+        self.offset = 0
+
+    @staticmethod
+    def _received(r: requests.Response) -> int:
+        """How many bytes the server says it has, from a 308 response's Range header"""
+        match = re.fullmatch(r'bytes=0-(\d+)', r.headers.get('Range', ''))
+        return int(match[1]) + 1 if match else 0
+
+    def status(self) -> Optional[requests.Response]:
+        """
+        Ask the server how much of the file has arrived, and continue from there
+        :return: The server's final response if it already has the whole file
+        """
+        r = self.request(data=b'', headers={'Content-Range': f'bytes */{self.total}'})
+
+        if r.status_code == 308:
+            self.offset = self._received(r)
+            return None
+
+        r.raise_for_status()
+        self.offset = self.total
+
+        return r
+
+    def upload(self) -> requests.Response:
+        """
+        Upload everything the server doesn't have yet
+        :return: The server's response to the last piece
+        """
+        failures = 0
+
+        # Skip whatever arrived before the program was last stopped
+        if self.resume:
+            if done := self.status():
+                return done
+
+            self._report()
+
+        with open(self.file, 'rb') as f:
+            while True:
+                if self.cancel.is_set():
+                    raise UploadCancelled
+
+                f.seek(self.offset)
+                data = f.read(self.chunk_size)
+                end = self.offset + len(data)
+
+                content_range = f'bytes {self.offset}-{end - 1}/{self.total}' if data else f'bytes */{self.total}'
+
+                try:
+                    r = self.request(
+                        data=data,
+                        headers={'Content-Range': content_range, 'Content-Type': self.mimetype}
+                    )
+                except (requests.ConnectionError, requests.Timeout):
+                    failures += 1
+
+                    if not self._wait(failures):
+                        raise
+
+                    # Find out how much of the piece made it before sending the rest.
+                    # If the server can't say either, that's another failed attempt, and the last offset it confirmed stands.
+                    try:
+                        if done := self.status():
+                            return done
+                    except (requests.ConnectionError, requests.Timeout):
+                        failures += 1
+
+                        if not self._wait(failures):
+                            raise
+
+                    continue
+
+                if r.status_code != 308:
+                    r.raise_for_status()
+
+                    if end < self.total:
+                        raise ResumeNotSupported(
+                            f"The server finished the upload after {end} of {self.total} bytes", response=r
+                        )
+
+                    self.offset = self.total
+                    self._report()
+
+                    return r
+
+                received = self._received(r)
+
+                # A server that keeps taking pieces without keeping them would otherwise be sent them forever
+                failures = 0 if received > self.offset else failures + 1
+
+                if failures > self.retries:
+                    raise requests.RequestException(f"The server stopped taking the upload at {received} bytes", response=r)
+
+                self.offset = received
+                self._report()
+
+    def _wait(self, failures: int) -> bool:
+        """
+        Wait before trying again after a failure
+        :return: False, without waiting, if the retries have run out
+        """
+        if failures > self.retries:
+            return False
+
+        time.sleep(backoff_delay(failures - 1, self.backoff, self.max_wait))
+
+        return True
+
+    def _report(self):
+        if self.progress:
+            self.progress(self.offset, self.total)